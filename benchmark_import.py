@@ -0,0 +1,76 @@
+"""Measure the import time of the command line scripts with python -X importtime
+"""
+# MIT License
+# 
+# Copyright (c) 2022 Debayan Deb
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+from collections import defaultdict
+
+repo_dir = os.path.dirname(os.path.abspath(__file__))
+
+def import_time(module, python=sys.executable):
+    ''' Run "import module" in a new interpreter with -X importtime. Returns the wall time
+    of the process in seconds and the self import time of each top-level package in seconds.'''
+    start_time = time.time()
+    process = subprocess.run([python, '-X', 'importtime', '-c', 'import %s' % module],
+        cwd=repo_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    wall_time = time.time() - start_time
+    if process.returncode != 0:
+        raise ImportError(process.stderr.strip().split('\n')[-1])
+    packages = defaultdict(float)
+    for line in process.stderr.split('\n'):
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_time, _cumulative, name = line[len('import time:'):].split('|')
+        packages[name.strip().split('.')[0]] += int(self_time) / 1e6
+    return wall_time, dict(packages)
+
+def main(args):
+    print('%-24s %8s %8s   %s' % ('module', 'wall', 'imports', 'slowest packages'))
+    for module in args.modules:
+        try:
+            runs = [import_time(module) for _ in range(args.repeat)]
+        except ImportError as e:
+            print('%-24s failed: %s' % (module, e))
+            continue
+        # The fastest run has the file system cache warm
+        wall_time, packages = min(runs, key=lambda run: run[0])
+        slowest = sorted(packages.items(), key=lambda item: -item[1])[:args.top]
+        print('%-24s %7.2fs %7.2fs   %s' % (module, wall_time, sum(packages.values()),
+            ', '.join(['%s %.2fs' % item for item in slowest])))
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules", help="The scripts or modules to import",
+                        type=str, nargs='*', default=['utils', 'evaluation', 'test_binary_detector',
+                        'test_chimney_detector', 'score_stream', 'serve_detector', 'train_chimney_detector'])
+    parser.add_argument("--repeat", help="Number of runs of each import, the fastest one is reported",
+                        type=int, default=3)
+    parser.add_argument("--top", help="Number of packages with the longest import time listed for each module",
+                        type=int, default=5)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,105 @@
+"""Measure the scaling of data-parallel training over worker processes
+"""
+# MIT License
+# 
+# Copyright (c) 2022 Debayan Deb
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+import multiprocessing
+import numpy as np
+import utils
+from nntools.tensorflow.networks import JointCNN, ChimneyCNN
+
+worker_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'train_worker.py')
+
+def run(config, Network, num_workers, port, args):
+    ''' Images per second of training with num_workers local worker processes.'''
+    cluster = ['localhost:%d' % (port + i) for i in range(num_workers)]
+    num_threads = max(1, multiprocessing.cpu_count() // num_workers)
+    workers = [subprocess.Popen([sys.executable, worker_script, '--cluster', ','.join(cluster),
+        '--task_index', str(i), '--num_threads', str(num_threads)]) for i in range(1, num_workers)]
+    try:
+        config.cluster = cluster
+        config.num_threads = num_threads
+        network = Network()
+        network.initialize(config, args.num_classes)
+
+        # Every tower gets all the classes
+        h, w = config.image_size
+        batch_size = args.batch_size * num_workers
+        images = np.random.uniform(-1., 1., (batch_size, h, w, config.channels)).astype(np.float32)
+        labels = np.tile(np.arange(args.batch_size) % args.num_classes, num_workers)
+
+        for step in range(args.num_warmup):
+            network.train(images, labels, config.lr, config.keep_prob)
+        start_time = time.time()
+        for step in range(args.num_steps):
+            network.train(images, labels, config.lr, config.keep_prob)
+        duration = time.time() - start_time
+        network.sess.close()
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.wait()
+    return batch_size * args.num_steps / duration
+
+def main(args):
+    config = utils.import_file(args.config_file, 'config')
+    Network = ChimneyCNN if 'chimney' in config.network else JointCNN
+
+    results = []
+    for k, num_workers in enumerate(args.num_workers):
+        # The server of the first worker lives in this process and cannot be stopped,
+        # every run uses new ports
+        port = args.port + 100 * k
+        results.append(run(config, Network, num_workers, port, args))
+        print('%d workers: %.1f images/s' % (num_workers, results[-1]))
+
+    print('\nBatch size %d per worker, %d cores' % (args.batch_size, multiprocessing.cpu_count()))
+    print('%8s %12s %10s %12s' % ('workers', 'images/s', 'speedup', 'efficiency'))
+    base = results[0] / args.num_workers[0]
+    for num_workers, images_per_sec in zip(args.num_workers, results):
+        speedup = images_per_sec / base
+        print('%8d %12.1f %10.2f %11.0f%%' % (num_workers, images_per_sec, speedup, 100 * speedup / num_workers))
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config_file", help="The path to the training configuration file",
+                        type=str)
+    parser.add_argument("--num_workers", help="Numbers of worker processes to compare",
+                        type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument("--batch_size", help="Batch size of each worker",
+                        type=int, default=32)
+    parser.add_argument("--num_classes", help="Number of classes of the synthetic labels",
+                        type=int, default=4)
+    parser.add_argument("--num_steps", help="Number of timed training steps",
+                        type=int, default=50)
+    parser.add_argument("--num_warmup", help="Number of training steps before timing",
+                        type=int, default=5)
+    parser.add_argument("--port", help="First port of the local workers",
+                        type=int, default=2222)
+    args = parser.parse_args()
+    main(args)
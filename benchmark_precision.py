@@ -0,0 +1,107 @@
+"""Compare float32 and mixed precision (float16) training of a detector
+"""
+# MIT License
+# 
+# Copyright (c) 2022 Debayan Deb
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+import utils
+import evaluation
+from nntools.common.dataset import Dataset
+from nntools.common.imageprocessing import preprocess
+from nntools.tensorflow.networks import JointCNN, ChimneyCNN
+
+def run(config, Network, trainset, test_images, test_labels, args):
+    tf.set_random_seed(args.seed)
+    network = Network()
+    network.initialize(config, trainset.num_classes)
+
+    step_times = []
+    for step in range(args.num_warmup + args.num_steps):
+        learning_rate = utils.get_updated_learning_rate(step, config)
+        batch = trainset.pop_batch_queue()
+        start_time = time.time()
+        network.train(batch['images'], batch['labels'], learning_rate, config.keep_prob)
+        if step >= args.num_warmup:
+            step_times.append(time.time() - start_time)
+
+    scores = network.extract_feature(test_images, batch_size=args.test_batch_size)[:,0]
+    result = evaluation.evaluate(scores, test_labels)
+    network.sess.close()
+    step_time = np.median(step_times)
+    return {'step_time': step_time, 'images_per_sec': config.batch_size / step_time,
+        'eer': result['eer'], 'tdr': result['tdr'][0.002]}
+
+def main(args):
+    config = utils.import_file(args.config_file, 'config')
+    if args.batch_size is not None:
+        config.batch_size = args.batch_size
+    Network = ChimneyCNN if 'chimney' in config.network else JointCNN
+
+    trainset = Dataset(config.train_dataset_path)
+    testset = Dataset(args.test_dataset or config.test_dataset_path)
+    index = np.random.RandomState(args.seed).permutation(len(testset.images))[:args.num_test]
+    test_images = preprocess(np.array(testset.images)[index], config, False)
+    test_labels = np.array(testset.labels)[index]
+
+    proc_func = lambda images: preprocess(images, config, True)
+    trainset.start_batch_queue(config.batch_size, config.batch_format, proc_func=proc_func)
+
+    results = {}
+    for mixed_precision in [False, True]:
+        config.mixed_precision = mixed_precision
+        np.random.seed(args.seed)
+        results[mixed_precision] = run(config, Network, trainset, test_images, test_labels, args)
+    trainset.release_queue()
+
+    print('\n%d steps of batch size %d, EER/TDR on %d test images' % (args.num_steps, config.batch_size, len(test_images)))
+    print('%-10s %12s %12s %10s %12s' % ('precision', 'step (ms)', 'images/s', 'EER (%)', 'TDR@0.2% (%)'))
+    for mixed_precision, name in [(False, 'float32'), (True, 'mixed')]:
+        r = results[mixed_precision]
+        print('%-10s %12.1f %12.1f %10.2f %12.2f' % (name, 1000 * r['step_time'], r['images_per_sec'],
+            100 * r['eer'], 100 * r['tdr']))
+    print('Speedup: %.2fx' % (results[False]['step_time'] / results[True]['step_time']))
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config_file", help="The path to the training configuration file",
+                        type=str)
+    parser.add_argument("--num_steps", help="Number of timed training steps for each precision",
+                        type=int, default=300)
+    parser.add_argument("--num_warmup", help="Number of training steps before timing",
+                        type=int, default=20)
+    parser.add_argument("--batch_size", help="Training batch size (config.batch_size by default)",
+                        type=int, default=None)
+    parser.add_argument("--test_dataset", help="Dataset for the EER (config.test_dataset_path by default)",
+                        type=str, default=None)
+    parser.add_argument("--num_test", help="Number of test images",
+                        type=int, default=2000)
+    parser.add_argument("--test_batch_size", help="Batch size for scoring the test images",
+                        type=int, default=128)
+    parser.add_argument("--seed", help="Random seed of both runs",
+                        type=int, default=0)
+    args = parser.parse_args()
+    main(args)
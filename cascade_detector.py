@@ -0,0 +1,93 @@
+"""Evaluate the JointCNN to ChimneyCNN early-exit cascade on a labeled dataset
+"""
+# MIT License
+# 
+# Copyright (c) 2022 Debayan Deb
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import time
+import argparse
+import numpy as np
+import utils
+import evaluation
+from nntools.common.dataset import Dataset
+from nntools.common.imageprocessing import preprocess
+from nntools.tensorflow.networks import JointCNN, ChimneyCNN, CascadeScorer
+
+def report(name, scores, labels, escalated=None):
+    live_scores = scores[labels == 0].tolist()
+    spoof_scores = scores[labels != 0].tolist()
+    eer, eer_thr, tdr = evaluation.eer(live_scores, spoof_scores)
+    line = '{}: EER = {}%, TDR = {}%'.format(name, eer * 100, tdr * 100)
+    if escalated is not None:
+        line += ', escalated = {:.1f}%'.format(100. * np.mean(escalated))
+    print(line)
+
+def main(args):
+    bands = [tuple(float(t) for t in band.split(',')) for band in args.bands]
+    dataset = Dataset(args.dataset_path)
+    labels = np.array(dataset.labels)
+
+    networks, proc_funcs = [], []
+    for model_path, Network in [(args.joint_model, JointCNN), (args.chimney_model, ChimneyCNN)]:
+        config = utils.import_file(os.path.join(model_path, 'config.py'), 'config')
+        network = Network()
+        network.load_model(model_path)
+        networks.append(network)
+        proc_funcs.append(lambda images, config=config: preprocess(images, config, False))
+
+    if args.compare:
+        # Score everything with both detectors, any band can then be evaluated without running them again
+        scores = []
+        for name, network, proc_func in zip(['JointCNN', 'ChimneyCNN'], networks, proc_funcs):
+            start_time = time.time()
+            scores.append(network.extract_feature(dataset.images, batch_size=args.batch_size, proc_func=proc_func)[:,0])
+            print('%s: %.2f ms per image' % (name, 1000 * (time.time() - start_time) / len(labels)))
+            report(name, scores[-1], labels)
+        for band in bands:
+            cascade = CascadeScorer(networks[0], networks[1], band)
+            escalated = cascade.escalate(scores[0])
+            report('Cascade [%.2f, %.2f]' % band, np.where(escalated, scores[1], scores[0]), labels, escalated)
+    else:
+        for band in bands:
+            cascade = CascadeScorer(networks[0], networks[1], band)
+            start_time = time.time()
+            scores, escalated = cascade.predict(dataset.images, batch_size=args.batch_size, proc_funcs=proc_funcs)
+            print('Cascade [%.2f, %.2f]: %.2f ms per image' % (band + (1000 * (time.time() - start_time) / len(labels),)))
+            report('Cascade [%.2f, %.2f]' % band, scores, labels, escalated)
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("joint_model", help="The path to the JointCNN model",
+                        type=str)
+    parser.add_argument("chimney_model", help="The path to the ChimneyCNN model",
+                        type=str)
+    parser.add_argument("dataset_path", help="The labeled dataset directory or list file",
+                        type=str)
+    parser.add_argument("--bands", help="Uncertainty bands of the JointCNN score escalated to ChimneyCNN, as low,high",
+                        type=str, nargs='+', default=['0.1,0.9'])
+    parser.add_argument("--compare", help="Also score all the images with both detectors and evaluate the bands from these scores",
+                        action='store_true')
+    parser.add_argument("--batch_size", help="Batch size of the detectors",
+                        type=int, default=128)
+    args = parser.parse_args()
+    main(args)
@@ -47,6 +47,15 @@ preprocess_test = [
 # Number of GPUs
 num_gpus = 1
 
+# Data-parallel training over processes: the host:port addresses of the workers,
+# one tower per worker (the training process is the first worker, start the others
+# with train_worker.py). None to use the GPUs.
+cluster = None
+# e.g. ['localhost:2222', 'localhost:2223', 'localhost:2224', 'localhost:2225']
+
+# Size of the thread pools of the first worker (0 for all the cores)
+num_threads = 0
+
 ####### NETWORK #######
 
 # Auto alignment network
@@ -73,6 +82,14 @@ batch_size = 180
 # The structure of the batch
 batch_format = 'random_even_classes:4'
 
+# Number of batches whose gradients are accumulated before an update, the
+# effective batch size is batch_size * gradient_accumulation_steps
+gradient_accumulation_steps = 1
+
+# Build the network in float16 with float32 master weights,
+# float32 batch normalization and dynamic loss scaling
+mixed_precision = False
+
 
 # Number of batches per epoch
 epoch_size = 500
@@ -99,6 +116,17 @@ learning_rate_multipliers = {
     # 'LocalizationNet/': 1e-3,
 }
 
+# Write the checkpoints from a background thread, the training loop only waits
+# for the variables to be copied to host memory
+async_checkpoint = False
+
+# Number of last checkpoints to keep (None for all)
+keep_checkpoints = None
+
+# Number of checkpoints with the best test EER to keep besides the last ones,
+# only used with async_checkpoint and keep_checkpoints
+keep_best_checkpoints = 1
+
 # Restore model
 restore_model = None
 # restore_model = 'log/binary_cnn/occl/20210131-205614'
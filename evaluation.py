@@ -1,4 +1,4 @@
-from sklearn.metrics import roc_curve, accuracy_score
+from sklearn.metrics import accuracy_score
 import numpy as np
 
 def apcer(dataset_name, spoof_paths, spoof_scores, thr):
@@ -27,22 +27,89 @@ def accuracy(live_scores, spoof_scores):
     pred = np.array(scores>0.5, np.int32)
     return accuracy_score(y, pred)
 
-def eer(live_scores, spoof_scores, fdr=0.002):
-    # print('Computing ROC for {} live scores and {} spoof scores'.format(len(live_scores), len(spoof_scores)))
-    live_labels = [0 for ls in live_scores]
-    spoof_labels = [1 for ss in spoof_scores]
-    y = np.array(spoof_labels + live_labels)
-    scores = np.array(spoof_scores + live_scores)
+def _tpr(positions, ends, num_positives, t):
+    ''' True positive rate at the t-th point of the ROC, positions are the sorted
+    ranks of the positive samples and ends the last rank of each threshold.'''
+    if t == 0:
+        return 0.0
+    return np.searchsorted(positions, ends[t-1], side='right') / float(num_positives)
+
+def _eer_tdr(positions, ends, fpr, thresholds, fdr_points):
+    num_positives = len(positions)
+    # fnr - fpr is non-increasing along the ROC, binary search its sign change
+    low, high = 0, len(fpr) - 1
+    while low < high:
+        mid = (low + high) // 2
+        if 1 - _tpr(positions, ends, num_positives, mid) - fpr[mid] <= 0:
+            high = mid
+        else:
+            low = mid + 1
+    t = low
+    if t > 0 and abs(1 - _tpr(positions, ends, num_positives, t-1) - fpr[t-1]) \
+        <= abs(1 - _tpr(positions, ends, num_positives, t) - fpr[t]):
+        t = t - 1
+    tdr = [_tpr(positions, ends, num_positives, point) for point in fdr_points]
+    return fpr[t], thresholds[t], tdr
 
-    fpr, tpr, thresholds = roc_curve(y, scores)
-    fnr = 1 - tpr
-    eer_thr = thresholds[np.nanargmin(np.absolute((fnr - fpr)))]
-    tdr = 0.0
-    for j, val in enumerate(fpr):
-        if val > fdr:
-            tdr = tpr[j-1]
-            break
-    return fpr[np.nanargmin(np.absolute((fnr-fpr)))], eer_thr, tdr
+def evaluate(scores, labels, fdrs=(0.002,), threshold=None):
+    ''' Evaluate spoof scores (higher for spoofs) with integer labels, 0 for live
+    and k > 0 for the k-th attack type. The scores are sorted once and the rates
+    of all attack types are read from cumulative counts.
+    Returns a dict with the overall EER, EER threshold and TDR at each FDR, the
+    BPCER and the APCER (maximum over the attacks) at the threshold (the overall
+    EER threshold by default), and the same metrics for each attack type in
+    'attacks'. All rates are fractions. Raises ValueError if there are no live or
+    no spoof samples, the rates are undefined then.'''
+    scores = np.asarray(scores, dtype=np.float64).ravel()
+    labels = np.asarray(labels, dtype=np.int64).ravel()
+    num_live = np.count_nonzero(labels == 0)
+    if num_live == 0 or num_live == len(labels):
+        raise ValueError('evaluate needs both live and spoof samples, got %d live and %d spoof' \
+            % (num_live, len(labels) - num_live))
+    order = np.argsort(-scores, kind='mergesort')
+    sorted_scores = scores[order]
+    sorted_labels = labels[order]
+
+    # The ROC has one point per distinct score, plus the point where nothing is rejected
+    ends = np.append(np.where(np.diff(sorted_scores))[0], len(scores) - 1)
+    thresholds = np.append(np.inf, sorted_scores[ends])
+    live = sorted_labels == 0
+    fpr = np.append(0., np.cumsum(live)[ends]) / float(num_live)
+    fdr_points = [np.searchsorted(fpr, fdr, side='right') - 1 for fdr in fdrs]
+
+    # Ranks of the samples grouped by label
+    by_label = np.argsort(sorted_labels, kind='mergesort')
+    counts = np.bincount(sorted_labels)
+    splits = np.split(by_label, np.cumsum(counts)[:-1])
+
+    result = {}
+    eer, eer_threshold, tdr = _eer_tdr(np.where(~live)[0], ends, fpr, thresholds, fdr_points)
+    result['eer'], result['eer_threshold'] = eer, eer_threshold
+    result['tdr'] = dict(zip(fdrs, tdr))
+    result['threshold'] = eer_threshold if threshold is None else threshold
+
+    accepted = np.bincount(labels[scores < result['threshold']], minlength=len(counts))
+    result['bpcer'] = 1. - accepted[0] / float(counts[0])
+    result['attacks'] = {}
+    for label in range(1, len(counts)):
+        if counts[label] == 0:
+            continue
+        eer, eer_threshold, tdr = _eer_tdr(splits[label], ends, fpr, thresholds, fdr_points)
+        result['attacks'][label] = {
+            'eer': eer,
+            'eer_threshold': eer_threshold,
+            'tdr': dict(zip(fdrs, tdr)),
+            'apcer': accepted[label] / float(counts[label]),
+        }
+    apcers = [attack['apcer'] for attack in result['attacks'].values()]
+    result['apcer'] = max(apcers)
+    return result
+
+def eer(live_scores, spoof_scores, fdr=0.002):
+    scores = np.concatenate([np.ravel(spoof_scores), np.ravel(live_scores)])
+    labels = np.concatenate([np.ones(np.size(spoof_scores), np.int64), np.zeros(np.size(live_scores), np.int64)])
+    result = evaluate(scores, labels, fdrs=[fdr])
+    return result['eer'], result['eer_threshold'], result['tdr'][fdr]
 
 def fuse_scores(live_paths, live_scores, method='mean'):
     lives = []
@@ -0,0 +1,109 @@
+"""Export a frozen inference graph of a trained detector
+"""
+# MIT License
+# 
+# Copyright (c) 2022 Debayan Deb
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import time
+import argparse
+import numpy as np
+import utils
+from nntools.common.dataset import Dataset
+from nntools.common.imageprocessing import preprocess
+from nntools.tensorflow import utils as tfutils
+
+def verify(network, frozen_network, images):
+    ''' Compare the scores of the frozen graph against the checkpoint.'''
+    outputs = {}
+    for name, net in [('checkpoint', network), ('frozen', frozen_network)]:
+        net.extract_feature(images[:1])
+        start_time = time.time()
+        outputs[name] = net.extract_feature(images)
+        print('%s: %.2f ms per image' % (name, 1000 * (time.time() - start_time) / len(images)))
+    diff = np.abs(outputs['checkpoint'] - outputs['frozen']).max()
+    print('Max absolute difference of the scores: %.2e' % diff)
+    return diff
+
+def main(args):
+    config, Network = utils.load_network_config(args.model_path, args.network)
+
+    start_time = time.time()
+    network = Network()
+    # Freeze the checkpoint even if the directory has an older inference bundle
+    network.load_model(args.model_path, use_bundle=False)
+    print('Metagraph loaded in %.2f seconds' % (time.time() - start_time))
+
+    # The fused score keeps the name used by the released checkpoints
+    outputs = {'predicted': network.heads['fused']}
+    for head in ['adversarial', 'digital', 'physical', 'trunk']:
+        if head in network.heads:
+            outputs[head] = network.heads[head]
+    if network.embeddings is not None:
+        outputs['embeddings'] = network.embeddings
+
+    output_file = args.output_file or os.path.join(args.model_path, 'frozen_graph.pb')
+    tfutils.export_frozen_graph(network.sess, output_file,
+        inputs=[network.inputs],
+        outputs=outputs,
+        constants={'phase_train': False, 'keep_prob': 1.0},
+        optimize=not args.no_optimize)
+
+    if args.bundle:
+        bundle_file = os.path.join(args.model_path, tfutils.BUNDLE_FILENAME)
+        tfutils.export_bundle(network.sess, bundle_file,
+            inputs=[network.inputs],
+            outputs=outputs,
+            constants={'phase_train': False, 'keep_prob': 1.0})
+
+    if args.verify is not None:
+        dataset = Dataset(args.verify)
+        images = preprocess(dataset.images[:args.num_verify], config, False)
+        frozen_network = Network()
+        frozen_network.load_model(output_file)
+        diff = verify(network, frozen_network, images)
+        assert diff < args.tolerance, 'The frozen graph does not match the checkpoint'
+        if args.bundle:
+            bundle_network = Network()
+            bundle_network.load_model(bundle_file)
+            diff = verify(network, bundle_network, images)
+            assert diff < args.tolerance, 'The inference bundle does not match the checkpoint'
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model_path", help="The path to the saved checkpoint and model file",
+                        type=str)
+    parser.add_argument("--output_file", help="The path of the frozen graph, default: <model_path>/frozen_graph.pb",
+                        type=str, default=None)
+    parser.add_argument("--network", help="Type of the detector, inferred from the config by default",
+                        type=str, choices=['joint', 'chimney'], default=None)
+    parser.add_argument("--no_optimize", help="Do not fold constants and batch normalization",
+                        action='store_true')
+    parser.add_argument("--bundle", help="Also write <model_path>/%s, which load_model uses instead of the checkpoint" % tfutils.BUNDLE_FILENAME,
+                        action='store_true')
+    parser.add_argument("--verify", help="A dataset directory or list file to compare the frozen graph against the checkpoint",
+                        type=str, default=None)
+    parser.add_argument("--num_verify", help="Number of images used for the comparison",
+                        type=int, default=64)
+    parser.add_argument("--tolerance", help="Maximum absolute difference of the scores",
+                        type=float, default=1e-4)
+    args = parser.parse_args()
+    main(args)
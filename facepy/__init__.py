@@ -3,10 +3,17 @@
 from .dataset import Template, Dataset
 from . import evaluation
 from . import io
-from . import learning
 from . import linalg
 from . import metric
-from . import plot
 from . import protocol
 from . import system
-from . import brickie
\ No newline at end of file
+
+# Modules with heavy dependencies (sklearn, matplotlib and the web viewer)
+# are only imported when they are first accessed, e.g. facepy.plot
+_lazy_modules = ['learning', 'plot', 'brickie']
+
+def __getattr__(name):
+    if name in _lazy_modules:
+        import importlib
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
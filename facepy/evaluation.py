@@ -23,7 +23,6 @@
 # SOFTWARE.
 
 import numpy as np
-from .system import warning
 
 # Find thresholds given FARs
 # but the real FARs using these thresholds could be different
@@ -46,15 +45,8 @@ def find_thresholds_by_FAR(score_vec, label_vec, FARs=None, epsilon=10e-8):
     else:
         FARs = np.array(FARs)
         num_false_alarms = (num_neg * FARs).astype(np.int32)
-
-        thresholds = []
-        for num_false_alarm in num_false_alarms:
-            if num_false_alarm==0:
-                threshold = score_neg[0] + epsilon
-            else:
-                threshold = score_neg[num_false_alarm-1]
-            thresholds.append(threshold)
-        thresholds = np.array(thresholds)
+        thresholds = np.where(num_false_alarms==0, score_neg[0] + epsilon,
+                        score_neg[np.maximum(num_false_alarms-1, 0)])
 
     return thresholds
 
@@ -71,23 +63,27 @@ def ROC(score_vec, label_vec, thresholds=None, FARs=None, get_false_indices=Fals
         thresholds = find_thresholds_by_FAR(score_vec, label_vec, FARs=FARs)
 
     assert len(thresholds.shape)==1 
-    if np.size(thresholds) > 10000:
-        warning('number of thresholds (%d) very large, computation may take a long time!' % np.size(thresholds))
-
-    # FARs would be check again
-    TARs = np.zeros(thresholds.shape[0])
-    FARs = np.zeros(thresholds.shape[0])
-    false_accept_indices = []
-    false_reject_indices = []
-    for i,threshold in enumerate(thresholds):
-        accept = score_vec >= threshold
-        TARs[i] = np.mean(accept[label_vec])
-        FARs[i] = np.mean(accept[~label_vec])
-        if get_false_indices:
-            false_accept_indices.append(np.argwhere(accept & (~label_vec)).flatten())
-            false_reject_indices.append(np.argwhere((~accept) & label_vec).flatten())
+
+    # Sort the scores once, the number of accepted pairs for each
+    # threshold is found by binary search. FARs would be check again.
+    pos_idx = np.where(label_vec)[0]
+    neg_idx = np.where(~label_vec)[0]
+    pos_order = np.argsort(score_vec[pos_idx], kind='mergesort')
+    neg_order = np.argsort(score_vec[neg_idx], kind='mergesort')
+    pos_sorted = score_vec[pos_idx][pos_order]
+    neg_sorted = score_vec[neg_idx][neg_order]
+    num_rejects = np.searchsorted(pos_sorted, thresholds, side='left')
+    num_negative_rejects = np.searchsorted(neg_sorted, thresholds, side='left')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        TARs = (pos_idx.size - num_rejects) / np.float64(pos_idx.size)
+        FARs = (neg_idx.size - num_negative_rejects) / np.float64(neg_idx.size)
 
     if get_false_indices:
+        false_accept_indices = []
+        false_reject_indices = []
+        for i in range(thresholds.shape[0]):
+            false_accept_indices.append(np.sort(neg_idx[neg_order[num_negative_rejects[i]:]]))
+            false_reject_indices.append(np.sort(pos_idx[pos_order[:num_rejects[i]]]))
         return TARs, FARs, thresholds, false_accept_indices, false_reject_indices
     else:
         return TARs, FARs, thresholds
@@ -120,24 +116,115 @@ def ROC_by_mat(score_mat, label_mat, thresholds=None, FARs=None, get_false_indic
 
     # Convert false accept/reject indices into [row, col] indices
     if get_false_indices:
-        rows, cols = np.meshgrid(np.arange(m), np.arange(n), indexing='ij')
-        rc = np.stack([rows, cols], axis=2)
-        if triu_k is not None:
-            rc = rc[triu_indices,:]
-        else:
-            rc = rc.reshape([-1,2])
+        def to_rc(indices):
+            if triu_k is not None:
+                return np.stack([triu_indices[0][indices], triu_indices[1][indices]], axis=1)
+            else:
+                return np.stack(np.unravel_index(indices, (m,n)), axis=1)
 
         for i in range(len(FARs)):
-            false_accept_indices[i] = rc[false_accept_indices[i]]
-            false_reject_indices[i] = rc[false_reject_indices[i]]
+            false_accept_indices[i] = to_rc(false_accept_indices[i])
+            false_reject_indices[i] = to_rc(false_reject_indices[i])
         return TARs, FARs, thresholds, false_accept_indices, false_reject_indices
     else:
         return TARs, FARs, thresholds
 
 
 
+class ROCAccumulator:
+    ''' Streaming ROC with fixed-bin histograms of the genuine and impostor scores.
+    Chunks of scores (e.g. blocks of a pairwise score matrix) are added with update,
+    accumulators of other processes with the same bins are added with merge.
+    The rates at the bin edges are exact, the bin width is the resolution of
+    the thresholds. Memory does not depend on the number of scores.
+    '''
+    def __init__(self, min_score=-1.0, max_score=1.0, num_bins=100000):
+        self.min_score = float(min_score)
+        self.max_score = float(max_score)
+        self.num_bins = int(num_bins)
+        # Underflow (< min_score) and overflow (>= max_score) bins at both ends
+        self.genuine = np.zeros(self.num_bins + 2, dtype=np.int64)
+        self.impostor = np.zeros(self.num_bins + 2, dtype=np.int64)
+
+    @property
+    def edges(self):
+        return np.linspace(self.min_score, self.max_score, self.num_bins + 1)
+
+    def bin_indices(self, scores):
+        scale = self.num_bins / (self.max_score - self.min_score)
+        # Infinite and very large scores would overflow the integer cast,
+        # they fall in the underflow/overflow bins all the same
+        width = self.max_score - self.min_score
+        scores = np.clip(scores, self.min_score - width, self.max_score + width)
+        indices = np.floor((scores - self.min_score) * scale).astype(np.int64) + 1
+        indices = np.clip(indices, 0, self.num_bins + 1)
+        # Fix the rounding errors so that bin i holds edges[i-1] <= score < edges[i]
+        edges = np.concatenate([[-np.inf], self.edges, [np.inf]])
+        indices += scores >= edges[indices + 1]
+        indices -= scores < edges[indices]
+        return indices
+
+    def update(self, score_vec, label_vec):
+        score_vec = np.asarray(score_vec, dtype=np.float64).ravel()
+        label_vec = np.asarray(label_vec, dtype=np.bool).ravel()
+        assert score_vec.shape == label_vec.shape
+        valid = ~np.isnan(score_vec)
+        indices = self.bin_indices(score_vec[valid])
+        label_vec = label_vec[valid]
+        self.genuine += np.bincount(indices[label_vec], minlength=self.num_bins + 2)
+        self.impostor += np.bincount(indices[~label_vec], minlength=self.num_bins + 2)
+        return self
+
+    def merge(self, other):
+        assert (self.min_score, self.max_score, self.num_bins) == \
+            (other.min_score, other.max_score, other.num_bins), 'The bins must be the same to merge'
+        self.genuine += other.genuine
+        self.impostor += other.impostor
+        return self
 
-def DIR_FAR(score_mat, label_mat, ranks=[1], FARs=[1.0], get_false_indices=False):
+    def save(self, filename):
+        np.savez(filename, genuine=self.genuine, impostor=self.impostor,
+            bins=np.array([self.min_score, self.max_score, self.num_bins]))
+
+    @classmethod
+    def load(cls, filename):
+        data = np.load(filename)
+        min_score, max_score, num_bins = data['bins']
+        accumulator = cls(min_score, max_score, int(num_bins))
+        accumulator.genuine += data['genuine']
+        accumulator.impostor += data['impostor']
+        return accumulator
+
+    def ROC(self, FARs=None):
+        ''' TARs, FARs and thresholds in ascending order of the thresholds, a score
+        is accepted if it is >= threshold. With FARs, the lowest threshold whose FAR
+        does not exceed each given FAR is used.'''
+        thresholds = np.concatenate([[-np.inf], self.edges, [np.inf]])
+        accept_genuine = np.append(np.cumsum(self.genuine[::-1])[::-1], 0)
+        accept_impostor = np.append(np.cumsum(self.impostor[::-1])[::-1], 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            TARs = accept_genuine / np.float64(self.genuine.sum())
+            FARs_ = accept_impostor / np.float64(self.impostor.sum())
+        if FARs is None:
+            return TARs, FARs_, thresholds
+        # FARs_ is non-increasing, search on the reversed array
+        indices = len(FARs_) - np.searchsorted(FARs_[::-1], np.array(FARs), side='right')
+        indices = np.minimum(indices, len(FARs_) - 1)
+        return TARs[indices], FARs_[indices], thresholds[indices]
+
+    def DET(self):
+        ''' False reject rates, false accept rates and thresholds.'''
+        TARs, FARs, thresholds = self.ROC()
+        return 1 - TARs, FARs, thresholds
+
+    def EER(self):
+        ''' Equal error rate and its threshold.'''
+        FRRs, FARs, thresholds = self.DET()
+        idx = np.nanargmin(np.abs(FRRs - FARs))
+        return 0.5 * (FRRs[idx] + FARs[idx]), thresholds[idx]
+
+
+def DIR_FAR(score_mat, label_mat, ranks=[1], FARs=[1.0], get_false_indices=False, block_size=256):
     ''' Closed/Open-set Identification. 
         A general case of Cummulative Match Characteristic (CMC) 
         where thresholding is allowed for open-set identification.
@@ -147,6 +234,7 @@ def DIR_FAR(score_mat, label_mat, ranks=[1], FARs=[1.0], get_false_indices=False
         ranks:                a list of integers
         FARs:                 false alarm rates, if 1.0, closed-set identification (CMC)
         get_false_indices:    not implemented yet
+        block_size:           number of probes processed at a time
     return:
         DIRs:                 an F x R matrix, F is the number of FARs, R is the number of ranks, 
                               flatten into a vector if F=1 or R=1.
@@ -154,49 +242,48 @@ def DIR_FAR(score_mat, label_mat, ranks=[1], FARs=[1.0], get_false_indices=False
         thredholds:           an vector of length = F.
     '''
     assert score_mat.shape==label_mat.shape
-    assert np.all(label_mat.astype(np.float32).sum(axis=1) <=1 )
-    # Split the matrix for match probes and non-match probes
+    # Process the probes in blocks, for match probes only the ground-truth score
+    # and its rank (the number of gallery scores above it) are kept, so that the
+    # rows never need to be sorted. For non-match probes the max score is kept.
     # subfix _m: match, _nm: non-match
-    # For closed set, we only use the match probes
-    match_indices = label_mat.astype(np.bool).any(axis=1)
-    score_mat_m = score_mat[match_indices,:]
-    label_mat_m = label_mat[match_indices,:]
-    score_mat_nm = score_mat[np.logical_not(match_indices),:]
-    label_mat_nm = label_mat[np.logical_not(match_indices),:]
+    gt_score_m, gt_rank_m, max_score_nm = [], [], []
+    min_score = np.inf
+    for start in range(0, score_mat.shape[0], block_size):
+        score_block = np.asarray(score_mat[start:start+block_size])
+        label_block = np.asarray(label_mat[start:start+block_size]).astype(np.bool)
+        assert np.all(label_block.sum(axis=1) <= 1)
+        match_indices = label_block.any(axis=1)
+        gt_score = score_block[label_block]
+        gt_score_m.append(gt_score)
+        gt_rank_m.append((score_block[match_indices] > gt_score[:,None]).sum(axis=1))
+        max_score_nm.append(np.max(score_block[~match_indices], axis=1))
+        min_score = min(min_score, np.min(score_block))
+    gt_score_m = np.concatenate(gt_score_m)
+    gt_rank_m = np.concatenate(gt_rank_m)
+    max_score_nm = np.concatenate(max_score_nm)
 
-    print('mate probes: %d, non mate probes: %d' % (score_mat_m.shape[0], score_mat_nm.shape[0]))
+    print('mate probes: %d, non mate probes: %d' % (gt_score_m.shape[0], max_score_nm.shape[0]))
 
     # Find the thresholds for different FARs
-    max_score_nm = np.max(score_mat_nm, axis=1)
     label_temp = np.zeros(max_score_nm.shape, dtype=np.bool)
     if len(FARs) == 1 and FARs[0] >= 1.0:
         # If only testing closed-set identification, use the minimum score as threshold
         # in case there is no non-mate probes
-        thresholds = [np.min(score_mat) - 1e-10]
+        thresholds = [min_score - 1e-10]
     else:
         # If there is open-set identification, find the thresholds by FARs.
-        assert score_mat_nm.shape[0] > 0, "For open-set identification (FAR<1.0), there should be at least one non-mate probe!"
+        assert max_score_nm.shape[0] > 0, "For open-set identification (FAR<1.0), there should be at least one non-mate probe!"
         thresholds = find_thresholds_by_FAR(max_score_nm, label_temp, FARs=FARs)
 
-    # Sort the labels row by row according to scores
-    sort_idx_mat_m = np.argsort(score_mat_m, axis=1)
-    sorted_label_mat_m = np.ndarray(label_mat_m.shape, dtype=np.bool)
-    for row in range(label_mat_m.shape[0]):
-        sort_idx = (sort_idx_mat_m[row, :])[::-1]
-        sorted_label_mat_m[row,:] = label_mat_m[row, sort_idx]
-        
     # Calculate DIRs for different FARs and ranks
-    gt_score_m = score_mat_m[label_mat_m]
-    assert gt_score_m.size == score_mat_m.shape[0]
-
     DIRs = np.zeros([len(FARs), len(ranks)], dtype=np.float32)
     FARs = np.zeros([len(FARs)], dtype=np.float32)
     for i, threshold in enumerate(thresholds):
         for j, rank  in enumerate(ranks):
             score_rank = gt_score_m >= threshold
-            retrieval_rank = sorted_label_mat_m[:,0:rank].any(axis=1)
+            retrieval_rank = gt_rank_m < rank
             DIRs[i,j] = (score_rank & retrieval_rank).astype(np.float32).mean()
-        if score_mat_nm.shape[0] > 0:
+        if max_score_nm.shape[0] > 0:
             FARs[i] = (max_score_nm >= threshold).astype(np.float32).mean()
 
     if DIRs.shape[0] == 1 or DIRs.shape[1] == 1:
@@ -215,18 +302,13 @@ def accuracy(score_vec, label_vec, thresholds=None):
         thresholds = np.sort(score_pos)[::1]    
 
     assert len(thresholds.shape)==1
-    if np.size(thresholds) > 10000:
-        warning('number of thresholds (%d) very large, computation may take a long time!' % np.size(thresholds))
-    
-    # Loop Computation
-    accuracies = np.zeros(np.size(thresholds))
-    for i, threshold in enumerate(thresholds):
-        pred_vec = score_vec>=threshold
-        accuracies[i] = np.mean(pred_vec==label_vec)
 
-    # Matrix Computation, Each column is a threshold
-    # predictions = score_vec[:,None] >= thresholds[None,:]
-    # accuracies = np.mean(predictions==label_vec[:,None], axis=0)
+    # Count the correct predictions of each threshold from the sorted scores
+    score_pos = np.sort(score_vec[label_vec])
+    score_neg = np.sort(score_vec[~label_vec])
+    true_accepts = score_pos.size - np.searchsorted(score_pos, thresholds, side='left')
+    true_rejects = np.searchsorted(score_neg, thresholds, side='left')
+    accuracies = (true_accepts + true_rejects) / np.float64(score_vec.size)
 
     argmax = np.argmax(accuracies)
     accuracy = accuracies[argmax]
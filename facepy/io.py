@@ -1,6 +1,4 @@
 import numpy as np
-import scipy.io as sio
-import h5py
 # import hdf5storage
 import os
 import csv 
@@ -19,6 +17,8 @@ def load_data(filename, delimiter=r'[ ,\t]+'):
 	return np.array(lines, dtype=np.object)
 
 def load_mat(filename):
+	import scipy.io as sio
+	import h5py
 	try:
 		return sio.loadmat(filename)
 	except:
@@ -27,11 +27,64 @@ import numpy as np
 import multiprocessing
 import threading
 import time
+from . import metric
+
+# Metrics that can be computed on whole feature matrices: 
+# metric -> (matrix function for sets, row-wise function for pairs)
+vectorized_metrics = {
+    'euclidean': (metric.euclidean, metric.euclidean_pair),
+    'cosine': (metric.cosineSimilarity, metric.cosine_pair),
+    metric.euclidean: (metric.euclidean, metric.euclidean_pair),
+    metric.cosineSimilarity: (metric.cosineSimilarity, metric.cosine_pair),
+}
+
+def feature_matrix(templates):
+    ''' Stack the templates into an N x D float32 matrix if every template is a
+    single feature vector, otherwise return None.'''
+    if isinstance(templates, np.ndarray) and templates.ndim == 2 and templates.dtype.kind in 'fiu':
+        return templates.astype(np.float32, copy=False)
+    try:
+        features = [np.asarray(t, dtype=np.float32) for t in templates]
+    except (TypeError, ValueError):
+        return None
+    if len(features) == 0 or any([f.ndim != 1 or f.shape != features[0].shape for f in features]):
+        return None
+    return np.stack(features)
+
+def output_array(shape, output_file=None):
+    if output_file is None:
+        return np.ndarray(shape, dtype=np.float32)
+    return np.lib.format.open_memmap(output_file, mode='w+', dtype=np.float32, shape=shape)
+
+# Compare every row of x1 to every row of x2 in blocks with a matrix metric,
+# the result can be written into a memory-mapped .npy file
+def compareSetsBlocked(x1, x2, matrixFunc, block_size=2048, output_file=None, log_info=False):
+    m, n = x1.shape[0], x2.shape[0]
+    scores = output_array((m,n), output_file)
+    for i in range(0, m, block_size):
+        if log_info:
+            print('Comparing row: %d' % i)
+        for j in range(0, n, block_size):
+            scores[i:i+block_size, j:j+block_size] = matrixFunc(x1[i:i+block_size], x2[j:j+block_size])
+    if output_file is not None:
+        scores.flush()
+    return scores
 
 # compare a list of pairs of templates
 # metricFunc is a function handle
 # return: a vector of scores
-def comparePairs(template_pairs, metricFunc, num_proc=8, log_info=False):
+def comparePairs(template_pairs, metricFunc, num_proc=8, log_info=False, block_size=65536):
+    if metricFunc in vectorized_metrics and len(template_pairs) > 0:
+        x1 = feature_matrix([pair[0] for pair in template_pairs])
+        x2 = feature_matrix([pair[1] for pair in template_pairs])
+        if x1 is not None and x2 is not None:
+            pairFunc = vectorized_metrics[metricFunc][1]
+            print('# of pairs: %d' % len(template_pairs))
+            scores = np.ndarray(len(template_pairs), dtype=np.float32)
+            for i in range(0, len(template_pairs), block_size):
+                scores[i:i+block_size] = pairFunc(x1[i:i+block_size], x2[i:i+block_size])
+            return scores
+    assert not isinstance(metricFunc, str), 'Metric %s needs feature vectors as templates' % metricFunc
     proc_list = []
     result_array = multiprocessing.Array('f', len(template_pairs))
     print('# of pairs: %d' % len(template_pairs))
@@ -58,10 +111,21 @@ def comparePairs(template_pairs, metricFunc, num_proc=8, log_info=False):
 # compare every template in set1 to every template in set2
 # set1 is of size m
 # set2 is of size n
-def compareSets(template_set1, template_set2, metricFunc, num_proc=8, log_info=False):
+# Metrics in vectorized_metrics are computed with matrix products in blocks
+# when the templates are feature vectors, other metrics are called for each
+# pair in num_proc processes.
+def compareSets(template_set1, template_set2, metricFunc, num_proc=8, log_info=False, 
+                block_size=2048, output_file=None):
     m = len(template_set1)
     n = len(template_set2)
     print('Set1 size: %d Set2 size: %d' % (m,n))
+    if metricFunc in vectorized_metrics:
+        x1 = feature_matrix(template_set1)
+        x2 = feature_matrix(template_set2)
+        if x1 is not None and x2 is not None:
+            return compareSetsBlocked(x1, x2, vectorized_metrics[metricFunc][0], 
+                block_size=block_size, output_file=output_file, log_info=log_info)
+    assert not isinstance(metricFunc, str), 'Metric %s needs feature vectors as templates' % metricFunc
     proc_list = []
     result_array = multiprocessing.Array('f', m*n)
     def proc_job(s1, s2, start_idx, n, result_array):
@@ -84,4 +148,9 @@ def compareSets(template_set1, template_set2, metricFunc, num_proc=8, log_info=F
         p.join()
 
     scores = np.array(result_array).reshape((m,n))
+    if output_file is not None:
+        output = output_array((m,n), output_file)
+        output[:] = scores
+        output.flush()
+        return output
     return scores
@@ -5,6 +5,7 @@ from __future__ import print_function
 import math
 import tensorflow as tf
 import tensorflow.contrib.slim as slim
+from nntools.tensorflow.utils import float32_batch_norm
 
 model_params = {
     'basic': ([0, 0, 0, 0], [16, 32, 64, 128]),
@@ -100,7 +101,7 @@ def branch(net, name='Branch', keep_probability=1.0, phase_train=True, bottlenec
             weight_decay=1e-4, reuse=None, model_version=None):
     with slim.arg_scope([slim.conv2d, slim.separable_conv2d, slim.fully_connected],
                         activation_fn=activation,
-                        normalizer_fn=slim.batch_norm,
+                        normalizer_fn=float32_batch_norm,
                         normalizer_params=batch_norm_params):
         with tf.variable_scope(name, [net], reuse=reuse):
             with slim.arg_scope([slim.batch_norm, slim.dropout],
@@ -124,7 +125,7 @@ def inference(images, keep_probability, phase_train=True, bottleneck_layer_size=
             weight_decay=1e-4, reuse=None, model_version=None):
     with slim.arg_scope([slim.conv2d, slim.separable_conv2d, slim.fully_connected],
                         activation_fn=activation,
-                        normalizer_fn=slim.batch_norm,
+                        normalizer_fn=float32_batch_norm,
                         normalizer_params=batch_norm_params):
         with tf.variable_scope('ResNeXt', [images], reuse=reuse):
             with slim.arg_scope([slim.batch_norm, slim.dropout],
@@ -135,11 +136,12 @@ def inference(images, keep_probability, phase_train=True, bottleneck_layer_size=
                 net = conv_module(images, 0, 16, scope='Common/global_conv1')
                 print('module_1 she:', [dim.value for dim in net.shape])
                 net = conv_module(net, 0, 32, scope='Common/global_conv2')
+                net = tf.identity(net, name='trunk')
 
                 ## BRANCHING JOINT LEARNING
-                feat_1 , score_1 = branch(net, 'AdversarialBranch')
-                feat_2 , score_2 = branch(net, 'DigitalBranch')
-                feat_3 , score_3 = branch(net, 'PhysicalBranch')
+                feat_1 , score_1 = branch(net, 'AdversarialBranch', phase_train=phase_train)
+                feat_2 , score_2 = branch(net, 'DigitalBranch', phase_train=phase_train)
+                feat_3 , score_3 = branch(net, 'PhysicalBranch', phase_train=phase_train)
                 
                 final_feat = tf.concat([feat_1, feat_2, feat_3], axis=-1)
 
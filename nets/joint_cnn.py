@@ -5,6 +5,7 @@ from __future__ import print_function
 import math
 import tensorflow as tf
 import tensorflow.contrib.slim as slim
+from nntools.tensorflow.utils import float32_batch_norm
 
 model_params = {
     'basic': ([0, 0, 0, 0], [16, 32, 64, 128]),
@@ -157,7 +158,7 @@ def inference(images, keep_probability, phase_train=True, bottleneck_layer_size=
             weight_decay=1e-4, reuse=None, model_version=None):
     with slim.arg_scope([slim.conv2d, slim.separable_conv2d, slim.fully_connected],
                         activation_fn=activation,
-                        normalizer_fn=slim.batch_norm,
+                        normalizer_fn=float32_batch_norm,
                         normalizer_params=batch_norm_params):
         with tf.variable_scope('ResNeXt', [images], reuse=reuse):
             with slim.arg_scope([slim.batch_norm, slim.dropout],
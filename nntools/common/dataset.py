@@ -30,7 +30,6 @@ import random
 import shutil
 from multiprocessing import Process, Queue
 
-import h5py
 import numpy as np
 
 class DataClass(object):
@@ -229,6 +228,7 @@ class Dataset():
 
 
     def init_from_hdf5(self, filename):
+        import h5py
         with h5py.File(filename, 'r') as f:
             self.images = np.array(f['images'])
             self.labels = np.array(f['labels'])
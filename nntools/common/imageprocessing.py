@@ -27,14 +27,11 @@ import os
 import math
 import random
 import numpy as np
-from scipy import misc
-import imageio
-import cv2
-from PIL import Image       
-from matplotlib.colors import rgb_to_hsv
-from skimage.util import view_as_blocks
 from scipy.special import expit
 
+# cv2, skimage, imageio, PIL and scipy.misc are imported by the functions that
+# use them, so that importing preprocess stays fast for the scoring scripts
+
 # Calulate the shape for creating new array given (h,w)
 def get_new_shape(images, size=None, n=None):
     shape = list(images.shape)
@@ -187,6 +184,7 @@ def random_crop(images, size):
     return images_new
 
 def patches(images, size):
+    from skimage.util import view_as_blocks
     n, _h, _w = images.shape[:3]
     h, w = tuple(size)
     patch_n = _h // h
@@ -239,6 +237,7 @@ def flip(images):
     return images_new
 
 def resize(images, size):
+    from scipy import misc
     n, _h, _w = images.shape[:3]
     h, w = tuple(size)
     shape_new = get_new_shape(images, size)
@@ -310,6 +309,7 @@ def random_shift(images, max_ratio):
     return images_new    
     
 def random_rotate(images, max_degree):
+    import cv2
     n, _h, _w = images.shape[:3]
     images_new = images.copy()
     
@@ -323,6 +323,7 @@ def random_rotate(images, max_degree):
 
 
 def random_blur(images, blur_type, max_size):
+    import cv2
     n, _h, _w = images.shape[:3]
     images_new = images.copy()
     
@@ -353,6 +354,7 @@ def random_noise(images, stddev, min_=-1.0, max_=1.0):
     return images_new
 
 def random_downsample(images, min_ratio):
+    from scipy import misc
     n, _h, _w = images.shape[:3]
     images_new = images.copy()
     ratios = min_ratio + (1-min_ratio) * np.random.rand(n)
@@ -410,7 +412,42 @@ def ten_crop(images, size):
     images_new = images_new.reshape(shape_new)
     return images_new
 
+# Number of test-time augmentation views of each image
+tta_num_views = {'flip': 2, 'five_crop': 5, 'ten_crop': 10}
+
+def expand_views(images, mode, crop_size=None):
+    '''Expand each image into its test-time augmentation views, the views of an image
+    are consecutive. Crops (90% of the image by default) are resized back to the input
+    size so that they can be fed to the same network.'''
+    import cv2
+    if mode == 'flip':
+        return expand_flip(images)
+    _n, _h, _w = images.shape[:3]
+    if crop_size is None:
+        crop_size = (int(0.9 * _h), int(0.9 * _w))
+    if mode == 'five_crop':
+        views = five_crop(images, crop_size)
+    elif mode == 'ten_crop':
+        views = ten_crop(images, crop_size)
+    else:
+        raise ValueError('Unknown test-time augmentation: %s' % mode)
+    images_new = np.ndarray(get_new_shape(views, (_h, _w)), dtype=images.dtype)
+    for i in range(views.shape[0]):
+        images_new[i] = cv2.resize(views[i], (_w, _h), interpolation=cv2.INTER_LINEAR).reshape(images_new.shape[1:])
+    return images_new
+
+def reduce_views(outputs, num_views, method='mean'):
+    '''Reduce the outputs of the consecutive views of each image to one output.'''
+    outputs = outputs.reshape((-1, num_views) + outputs.shape[1:])
+    if method == 'mean':
+        return outputs.mean(axis=1)
+    elif method == 'max':
+        return outputs.max(axis=1)
+    else:
+        raise ValueError('Unknown reduction of the views: %s' % method)
+
 def center_patch(images, landmarks, offset):
+    from scipy import misc
     _n, _h, _w = images.shape[:3]
     num_patches = 51
     # shape_new = get_new_shape(images, [offset, offset], n=num_patches*_n)
@@ -549,6 +586,7 @@ def random_distorted_crop(images,
     # 1. generate random square [h * a, w * a]
     # 2. generate random aspect ratio (MAX = 1.3)
     # 3. select location within image
+    from scipy import misc
     _n, _h, _w = images.shape[:3]
     h, w = tuple(output_size)
     shape_new = get_new_shape(images, output_size)
@@ -596,6 +634,7 @@ register = {
 }
 
 def resize_and_remove_bg(im, size, eyes_only=False):
+    from scipy import misc
     non_black_pixels = np.any(im > [10,10,10], axis=-1)
     min_x = np.min(np.where(non_black_pixels)[0])
     min_y = np.min(np.where(non_black_pixels)[1])
@@ -613,6 +652,7 @@ def resize_and_remove_bg(im, size, eyes_only=False):
         return cropped
 
 def load_files(images, config, is_training=False):
+    from scipy import misc
     image_list = []
     for image_path in images:
         image = misc.imread(image_path)
@@ -620,13 +660,16 @@ def load_files(images, config, is_training=False):
     return np.array(images_list)
 
 def preprocess(images, config, is_training=False):
-    # Load images first if they are file paths
+    # Load images first if they are file paths, decoded images (e.g. video frames) are used as they are
+    import imageio
+    from PIL import Image
     image_paths = images
     images = []
     # assert (config.channels==1 or config.channels==3)
     mode = 'RGB' if config.channels>=3 else 'I'
     for image_path in image_paths:
-        image = np.array(Image.fromarray(imageio.imread(image_path)).resize((160,160)))
+        image = image_path if type(image_path)==np.ndarray else imageio.imread(image_path)
+        image = np.array(Image.fromarray(image).resize((160,160)))
 
         images.append(image)
 
@@ -3,6 +3,8 @@ from . import watcher
 from . import tensor_ops
 from . import image_ops
 from . import losses
+from . import loss_registry
+from . import graph_ops
 
 # sub-packages
 from . import networks
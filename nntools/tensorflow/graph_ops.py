@@ -0,0 +1,274 @@
+"""Transformations of frozen inference graphs
+"""
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.framework import tensor_util
+
+from . import utils as tfutils
+
+batch_norm_ops = ['FusedBatchNorm', 'FusedBatchNormV2', 'FusedBatchNormV3']
+
+def parse_input(inp):
+    ''' Split a node input into (node_name, port, is_control).'''
+    control = inp.startswith('^')
+    name = inp.lstrip('^')
+    name, port = (name.split(':') + ['0'])[:2]
+    return name, int(port), control
+
+def topological_order(graph_def):
+    ''' Node names sorted so that every node comes after its inputs.'''
+    node_map = {node.name: node for node in graph_def.node}
+    order = []
+    visited = set()
+    for node in graph_def.node:
+        stack = [(node.name, False)]
+        while stack:
+            name, done = stack.pop()
+            if done:
+                order.append(name)
+            elif name not in visited:
+                visited.add(name)
+                stack.append((name, True))
+                stack.extend([(parse_input(inp)[0], False) for inp in node_map[name].input])
+    return order
+
+def const_node(name, value):
+    node = tf.NodeDef()
+    node.op = 'Const'
+    node.name = name
+    tensor = tensor_util.make_tensor_proto(value)
+    node.attr['dtype'].type = tensor.dtype
+    node.attr['value'].tensor.CopyFrom(tensor)
+    return node
+
+def const_value(node_map, inp):
+    ''' Value of a constant input, following Identity nodes. None if not a constant.'''
+    name = parse_input(inp)[0]
+    while name in node_map and node_map[name].op == 'Identity':
+        name = parse_input(node_map[name].input[0])[0]
+    node = node_map.get(name)
+    if node is None or node.op != 'Const':
+        return None
+    return tensor_util.MakeNdarray(node.attr['value'].tensor)
+
+def _foldable(node):
+    if node.op in ['Placeholder', 'PlaceholderWithDefault', 'NoOp'] or len(node.input) == 0:
+        return False
+    return not ('Random' in node.op or 'Variable' in node.op or 'Assign' in node.op)
+
+def fold_constants(graph_def, output_names):
+    ''' Evaluate the nodes whose inputs are all constants and replace them by constants.'''
+    node_map = {node.name: node for node in graph_def.node}
+    constant = set()
+    for name in topological_order(graph_def):
+        node = node_map[name]
+        if node.op == 'Const' or (_foldable(node) \
+            and all([parse_input(inp)[0] in constant for inp in node.input])):
+            constant.add(name)
+
+    # Only evaluate the tensors consumed outside of the constant region
+    fold_tensors = set()
+    for node in graph_def.node:
+        if node.name in constant:
+            continue
+        for inp in node.input:
+            name, port, control = parse_input(inp)
+            if not control and name in constant and node_map[name].op != 'Const':
+                fold_tensors.add((name, port))
+    for name in output_names:
+        if name in constant and node_map[name].op != 'Const':
+            fold_tensors.add((name, 0))
+    if len(fold_tensors) == 0:
+        return graph_def
+    fold_tensors = sorted(fold_tensors)
+
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name='')
+        with tf.Session(graph=graph) as sess:
+            values = sess.run(['%s:%d' % t for t in fold_tensors])
+
+    folded = {}
+    for (name, port), value in zip(fold_tensors, values):
+        folded[(name, port)] = name if port == 0 else '%s/folded_%d' % (name, port)
+
+    output_graph_def = tf.GraphDef()
+    output_graph_def.versions.CopyFrom(graph_def.versions)
+    output_graph_def.library.CopyFrom(graph_def.library)
+    for (name, port), value in zip(fold_tensors, values):
+        output_graph_def.node.extend([const_node(folded[(name, port)], value)])
+    for node in graph_def.node:
+        if (node.name, 0) in folded:
+            continue
+        new_node = output_graph_def.node.add()
+        new_node.CopyFrom(node)
+        del new_node.input[:]
+        for inp in node.input:
+            name, port, control = parse_input(inp)
+            if not control and (name, port) in folded:
+                inp = folded[(name, port)]
+            new_node.input.append(inp)
+    return tf.graph_util.extract_sub_graph(output_graph_def, output_names)
+
+def fold_batch_norms(graph_def):
+    ''' Fold the inference batch normalization that follows a convolution into
+    the convolution weights and a bias:
+        conv(x, w) * scale + offset = conv(x, w * scale) + offset
+    where scale = gamma / sqrt(variance + epsilon), offset = beta - mean * scale.'''
+    node_map = {node.name: node for node in graph_def.node}
+    consumers = {}
+    for node in graph_def.node:
+        for inp in node.input:
+            name, port, control = parse_input(inp)
+            consumers.setdefault(name, []).append((node.name, port, control))
+
+    replaced = {}
+    new_nodes = []
+    for node in graph_def.node:
+        if node.op not in batch_norm_ops or node.attr['is_training'].b:
+            continue
+        if node.attr['data_format'].s not in [b'', b'NHWC']:
+            continue
+        if any([port > 0 for _, port, _ in consumers.get(node.name, [])]):
+            continue
+        conv = node_map.get(parse_input(node.input[0])[0])
+        if conv is None or conv.op not in ['Conv2D', 'DepthwiseConv2dNative'] \
+            or len(consumers[conv.name]) > 1:
+            continue
+        weights = const_value(node_map, conv.input[1])
+        params = [const_value(node_map, inp) for inp in node.input[1:5]]
+        if weights is None or any([p is None for p in params]):
+            continue
+
+        gamma, beta, mean, variance = params
+        scale = gamma / np.sqrt(variance + node.attr['epsilon'].f)
+        offset = beta - mean * scale
+        if conv.op == 'Conv2D':
+            weights = weights * scale
+        else:
+            # Depthwise weights are [h, w, in_channels, multiplier]
+            weights = weights * scale.reshape(weights.shape[2:])
+
+        weights_node = const_node(conv.name + '/folded_weights', weights.astype(np.float32))
+        bias_node = const_node(node.name + '/folded_bias', offset.astype(np.float32))
+        conv_node = tf.NodeDef()
+        conv_node.CopyFrom(conv)
+        conv_node.input[1] = weights_node.name
+        bias_add = tf.NodeDef()
+        bias_add.op = 'BiasAdd'
+        bias_add.name = node.name
+        bias_add.input.extend([node.input[0], bias_node.name])
+        bias_add.attr['T'].type = tf.float32.as_datatype_enum
+        bias_add.attr['data_format'].s = b'NHWC'
+        replaced[conv.name] = conv_node
+        replaced[node.name] = bias_add
+        new_nodes.extend([weights_node, bias_node])
+
+    print('Folded %d batch normalization layers' % (len(new_nodes) // 2))
+    output_graph_def = tf.GraphDef()
+    output_graph_def.versions.CopyFrom(graph_def.versions)
+    output_graph_def.library.CopyFrom(graph_def.library)
+    output_graph_def.node.extend(new_nodes)
+    for node in graph_def.node:
+        output_graph_def.node.extend([replaced.get(node.name, node)])
+    return output_graph_def
+
+def optimize_for_inference(sess, output_names, constants=None):
+    ''' Build an inference graph from a restored session: the variables are frozen,
+    the placeholders in constants (e.g. {'phase_train': False}) are fixed, the
+    conditionals on them are resolved and the constants and batch normalizations
+    are folded.'''
+    graph_def = tfutils.freeze_graph_def(sess, output_names, constants)
+    num_nodes = len(graph_def.node)
+    graph_def = fold_constants(graph_def, output_names)
+    graph_def = fold_batch_norms(graph_def)
+    graph_def = tf.graph_util.extract_sub_graph(graph_def, output_names)
+    print('Optimized inference graph: %d ops (%d after freezing)' % (len(graph_def.node), num_nodes))
+    return graph_def
+
+def quantize_weights_float16(graph_def, minimum_size=1024):
+    ''' Store the large float32 constants (the weights) as float16, they are
+    cast back to float32 when the graph is run.'''
+    output_graph_def = tf.GraphDef()
+    output_graph_def.versions.CopyFrom(graph_def.versions)
+    output_graph_def.library.CopyFrom(graph_def.library)
+    num_quantized = 0
+    for node in graph_def.node:
+        if node.op != 'Const' or node.attr['dtype'].type != tf.float32.as_datatype_enum:
+            output_graph_def.node.extend([node])
+            continue
+        value = tensor_util.MakeNdarray(node.attr['value'].tensor)
+        if value.size < minimum_size:
+            output_graph_def.node.extend([node])
+            continue
+        half_node = const_node(node.name + '/float16', value.astype(np.float16))
+        cast_node = tf.NodeDef()
+        cast_node.op = 'Cast'
+        cast_node.name = node.name
+        cast_node.input.extend([half_node.name])
+        cast_node.attr['SrcT'].type = tf.float16.as_datatype_enum
+        cast_node.attr['DstT'].type = tf.float32.as_datatype_enum
+        output_graph_def.node.extend([half_node, cast_node])
+        num_quantized += 1
+    print('Quantized %d constants to float16' % num_quantized)
+    return output_graph_def
+
+def quantize_graph_int8(graph_def, input_names, output_names):
+    ''' Convert the weights and the supported ops (convolutions, matmul, relu,
+    pooling...) to eight-bit. The activation ranges are computed on the fly
+    by RequantizationRange ops until they are frozen by calibrate_int8_ranges.'''
+    from tensorflow.tools.graph_transforms import TransformGraph
+    transforms = [
+        'add_default_attributes',
+        'strip_unused_nodes',
+        'fold_constants(ignore_errors=true)',
+        'fold_batch_norms',
+        'fold_old_batch_norms',
+        'quantize_weights',
+        'quantize_nodes',
+        'strip_unused_nodes',
+        'sort_by_execution_order',
+    ]
+    return TransformGraph(graph_def, input_names, output_names, transforms)
+
+def calibrate_int8_ranges(graph_def, input_name, batches, output_names):
+    ''' Run the quantized graph on the calibration batches, record the range of each
+    RequantizationRange op and replace the ops by the constant ranges.'''
+    range_nodes = [node.name for node in graph_def.node if node.op == 'RequantizationRange']
+    if len(range_nodes) == 0:
+        return graph_def
+    ranges = {name: [np.inf, -np.inf] for name in range_nodes}
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name='')
+        inputs = graph.get_tensor_by_name(input_name + ':0')
+        fetches = [(graph.get_tensor_by_name(name + ':0'), graph.get_tensor_by_name(name + ':1')) \
+            for name in range_nodes]
+        with tf.Session(graph=graph) as sess:
+            for batch in batches:
+                values = sess.run(fetches, feed_dict={inputs: batch})
+                for name, (min_value, max_value) in zip(range_nodes, values):
+                    ranges[name][0] = min(ranges[name][0], float(min_value))
+                    ranges[name][1] = max(ranges[name][1], float(max_value))
+
+    output_graph_def = tf.GraphDef()
+    output_graph_def.versions.CopyFrom(graph_def.versions)
+    output_graph_def.library.CopyFrom(graph_def.library)
+    for name in range_nodes:
+        min_value, max_value = ranges[name]
+        output_graph_def.node.extend([
+            const_node(name + '/calibrated_min', np.float32(min_value)),
+            const_node(name + '/calibrated_max', np.float32(max_value))])
+    for node in graph_def.node:
+        if node.name in ranges:
+            continue
+        new_node = output_graph_def.node.add()
+        new_node.CopyFrom(node)
+        del new_node.input[:]
+        for inp in node.input:
+            name, port, control = parse_input(inp)
+            if name in ranges:
+                if control:
+                    continue
+                inp = name + ('/calibrated_min' if port == 0 else '/calibrated_max')
+            new_node.input.append(inp)
+    print('Calibrated %d requantization ranges' % len(range_nodes))
+    return tf.graph_util.extract_sub_graph(output_graph_def, output_names)
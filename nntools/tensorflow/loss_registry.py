@@ -0,0 +1,162 @@
+"""Registry of the losses built by BaseNetwork.initialize
+"""
+import tensorflow as tf
+
+from . import losses as tflosses
+
+# name -> function(context) computing a tensor shared by the losses of a tower
+intermediate_registry = {}
+# name in config.losses -> (function(context, **params), watch name), in build order
+loss_registry = {}
+
+def register_intermediate(name):
+    ''' Decorator registering a tensor that is computed at most once per tower,
+    the first time a loss asks the LossContext for it.'''
+    def decorator(func):
+        intermediate_registry[name] = func
+        return func
+    return decorator
+
+def register_loss(name, watch_name=None):
+    ''' Decorator registering the loss built when name is a key of config.losses.
+    The function is called with the LossContext of the tower and the parameters
+    config.losses[name], and returns a loss tensor or a list of loss tensors.
+    The (first) loss is watched and summarized as watch_name.'''
+    def decorator(func):
+        loss_registry[name] = (func, watch_name or name)
+        return func
+    return decorator
+
+class LossContext:
+    ''' Inputs of the losses of one tower and the intermediates computed so far.'''
+    def __init__(self, prelogits, labels, num_classes, global_step=None,
+            learning_rate=None, weight_decay=0.0, embeddings=None):
+        self.prelogits = prelogits
+        self.labels = labels
+        self.num_classes = num_classes
+        self.global_step = global_step
+        self.learning_rate = learning_rate
+        self.weight_decay = weight_decay
+        self.intermediates = {}
+        if embeddings is not None:
+            self.intermediates['embeddings'] = embeddings
+
+    def __getitem__(self, name):
+        if name not in self.intermediates:
+            self.intermediates[name] = intermediate_registry[name](self)
+        return self.intermediates[name]
+
+def build_losses(context, losses_config):
+    ''' Build the losses in losses_config (a dict of name: params) for one tower.
+    Returns a list of (watch_name, [loss tensors]) in registration order.'''
+    unknown = [name for name in losses_config.keys() if name not in loss_registry]
+    if len(unknown) > 0:
+        raise ValueError('Unknown losses: %s (registered: %s)' % \
+            (', '.join(unknown), ', '.join(loss_registry.keys())))
+    results = []
+    for name, (func, watch_name) in loss_registry.items():
+        if name not in losses_config:
+            continue
+        loss = func(context, **losses_config[name])
+        results.append((watch_name, loss if type(loss) in [list, tuple] else [loss]))
+    return results
+
+
+# Shared intermediates
+
+@register_intermediate('embeddings')
+def _embeddings(context):
+    return tf.nn.l2_normalize(context.prelogits, dim=1, name='embeddings')
+
+@register_intermediate('label_mat')
+def _label_mat(context):
+    return tf.equal(context.labels[:,None], context.labels[None,:])
+
+@register_intermediate('dist_mat')
+def _dist_mat(context):
+    prelogits = context.prelogits
+    return tflosses.euclidean_distance(prelogits, tf.transpose(prelogits), False)
+
+@register_intermediate('embeddings_dist_mat')
+def _embeddings_dist_mat(context):
+    embeddings = context['embeddings']
+    return tflosses.euclidean_distance(embeddings, tf.transpose(embeddings), False)
+
+@register_intermediate('embeddings_pdist_matrix')
+def _embeddings_pdist_matrix(context):
+    # Same as metric_loss_ops.pairwise_distance(embeddings, squared=True)
+    dist_mat = tf.maximum(context['embeddings_dist_mat'], 0.)
+    return dist_mat * (1. - tf.eye(tf.shape(dist_mat)[0]))
+
+
+# Losses
+
+@register_loss('softmax', 'sfloss')
+def _softmax(context, **params):
+    return tflosses.softmax_loss(context.prelogits, context.labels, context.num_classes,
+                weight_decay=context.weight_decay, **params)
+
+@register_loss('center', 'ctloss')
+def _center(context, **params):
+    return tflosses.center_loss(context.prelogits, context.labels, context.num_classes, **params)
+
+@register_loss('ring', 'rloss')
+def _ring(context, **params):
+    return tflosses.ring_loss(context.prelogits, **params)
+
+@register_loss('decov', 'decloss')
+def _decov(context, **params):
+    return tflosses.decov_loss(context.prelogits, **params)
+
+@register_loss('triplet', 'loss')
+def _triplet(context, **params):
+    return tflosses.triplet_semihard_loss(context.labels, context['embeddings'],
+                pdist_matrix=context['embeddings_pdist_matrix'], **params)
+
+@register_loss('triplet_avghard', 'loss')
+def _triplet_avghard(context, **params):
+    return tflosses.triplet_avghard_loss(context.labels, context['embeddings'],
+                dist_mat=context['embeddings_dist_mat'], label_mat=context['label_mat'], **params)
+
+@register_loss('contrastive', 'loss')
+def _contrastive(context, **params):
+    dist_mat = context['embeddings_dist_mat'] if params.get('normalize') else context['dist_mat']
+    return tflosses.contrastive_loss(context.labels, context.prelogits,
+                dist_mat=dist_mat, label_mat=context['label_mat'], **params)
+
+@register_loss('cosine', 'closs')
+def _cosine(context, gamma=16.0):
+    logits, cosine_loss = tflosses.cosine_softmax(context.prelogits, context.labels, context.num_classes,
+                gamma=gamma, weight_decay=context.weight_decay)
+    return cosine_loss
+
+@register_loss('angular', 'aloss')
+def _angular(context, m, lamb_min, lamb_max):
+    return tflosses.angular_softmax(context.prelogits, context.labels, context.num_classes,
+                context.global_step, m, lamb_min, lamb_max, weight_decay=context.weight_decay)
+
+@register_loss('am_softmax', 'loss')
+def _am_softmax(context, **params):
+    return tflosses.am_softmax(context.prelogits, context.labels, context.num_classes,
+                context.global_step, weight_decay=context.weight_decay, **params)
+
+@register_loss('am_imprint', 'amiloss')
+def _am_imprint(context, **params):
+    loss = tflosses.am_softmax_imprint(context.prelogits, context.labels, context.num_classes,
+                context.global_step, context.weight_decay, context.learning_rate, **params)
+    return tf.identity(loss, name='ami_loss')
+
+@register_loss('euc', 'euc_loss')
+def _euc(context, **params):
+    return tflosses.euc_loss(context.prelogits, context.labels, context.num_classes,
+                context.global_step, context.weight_decay, **params)
+
+@register_loss('split', 'sploss')
+def _split(context, **params):
+    return tflosses.split_softmax(context.prelogits, context.labels, context.num_classes,
+                context.global_step, context.weight_decay, **params)
+
+@register_loss('pair', 'loss')
+def _pair(context, gamma, m):
+    return tflosses.pair_loss(context.prelogits, context.labels, context.num_classes,
+                context.global_step, gamma=gamma, m=m, weight_decay=context.weight_decay)
@@ -927,7 +927,7 @@ def masked_reduce_mean(tensor, mask, axis, eps=1e-8):
 	num_valid = tf.reduce_sum(mask, axis=axis)
 	return tf.reduce_sum(tensor * mask, axis=axis)  / (num_valid + eps)
 
-def triplet_avghard_loss(labels, embeddings, margin=1., normalize=False):
+def triplet_avghard_loss(labels, embeddings, margin=1., normalize=False, dist_mat=None, label_mat=None):
 
 	with tf.name_scope('AvgHardTripletLoss'):
 	
@@ -937,28 +937,31 @@ def triplet_avghard_loss(labels, embeddings, margin=1., normalize=False):
 		batch_size = tf.shape(embeddings)[0]
 		num_features = embeddings.shape[1].value
 
-		dist_mat = euclidean_distance(embeddings, tf.transpose(embeddings), False)
+		if dist_mat is None:
+			dist_mat = euclidean_distance(embeddings, tf.transpose(embeddings), False)
 		
 		diag_mask = tf.eye(batch_size, dtype=tf.bool)
 		non_diag_mask = tf.logical_not(diag_mask)
-		label_mat = tf.equal(labels[:,None], labels[None,:])
+		if label_mat is None:
+			label_mat = tf.equal(labels[:,None], labels[None,:])
 		label_mask_pos = tf.logical_and(non_diag_mask, label_mat)
 		label_mask_neg = tf.logical_not(label_mat)
 
 
-		# Followings are different from hard negative mining
-
-		dist_tensor_neg = tf.tile(dist_mat, [1, batch_size])
-		dist_tensor_neg = tf.reshape(dist_tensor_neg, [batch_size, batch_size, batch_size])
-
-		label_tensor_neg= tf.tile(label_mask_neg, [1, batch_size])
-		label_tensor_neg = tf.reshape(label_tensor_neg, [batch_size, batch_size, batch_size])
-
-		loss = tf.nn.relu(dist_mat[:,:,None] - dist_tensor_neg + margin)
+		# Average of the positive hinges d(a,p) - d(a,n) + margin over the negatives n,
+		# i.e. over the negatives closer to the anchor than d(a,p) + margin. With the
+		# negative distances of each anchor sorted, their number and their sum are given
+		# by a binary search and a cumulative sum, without building the B x B x B tensor.
+		fill_value = tf.stop_gradient(tf.reduce_max(dist_mat)) + margin + 1.
+		dist_neg = tf.where(label_mask_neg, dist_mat, tf.fill(tf.shape(dist_mat), fill_value))
+		dist_neg = tf.sort(dist_neg, axis=1)
+		cumsum_neg = tf.pad(tf.cumsum(dist_neg, axis=1), [[0,0],[1,0]])
 
-		# Mask the third dimension to pick the negative samples
-		mask = tf.logical_and(label_tensor_neg, tf.greater(loss, 0.))
-		loss = masked_reduce_mean(loss, mask, axis=2)
+		threshold = dist_mat + margin
+		num_valid = tf.searchsorted(dist_neg, threshold, side='left')
+		sum_neg = tf.gather(cumsum_neg, num_valid, batch_dims=1)
+		num_valid = tf.cast(num_valid, tf.float32)
+		loss = (num_valid * threshold - sum_neg) / (num_valid + 1e-8)
 
 		# Mask the first two dimension to only keep positive pairs
 		loss = tf.boolean_mask(loss, label_mask_pos)
@@ -966,7 +969,7 @@ def triplet_avghard_loss(labels, embeddings, margin=1., normalize=False):
 
 		return loss
 
-def triplet_loss(labels, embeddings, margin=1.0, normalize=False):
+def triplet_loss(labels, embeddings, margin=1.0, normalize=False, dist_mat=None, label_mat=None):
 
 	with tf.name_scope('TripletLoss'):
 	
@@ -980,10 +983,12 @@ def triplet_loss(labels, embeddings, margin=1.0, normalize=False):
 		diag_mask = tf.eye(batch_size, dtype=tf.bool)
 		non_diag_mask = tf.logical_not(diag_mask)    
 
-		dist_mat = euclidean_distance(embeddings, tf.transpose(embeddings), False)
+		if dist_mat is None:
+			dist_mat = euclidean_distance(embeddings, tf.transpose(embeddings), False)
 		
 
-		label_mat = tf.equal(labels[:,None], labels[None,:])
+		if label_mat is None:
+			label_mat = tf.equal(labels[:,None], labels[None,:])
 		label_mask_pos = tf.logical_and(non_diag_mask, label_mat)
 		label_mask_neg = tf.logical_and(non_diag_mask, tf.logical_not(label_mat))
 
@@ -1156,7 +1161,7 @@ def deb_loss(embeddings, labels, margin=1.0):
 	return loss
 
 
-def contrastive_loss(labels, embeddings, margin=1.0, normalize=False):
+def contrastive_loss(labels, embeddings, margin=1.0, normalize=False, dist_mat=None, label_mat=None):
 
 	with tf.name_scope('ContrastiveLoss'):
 
@@ -1170,10 +1175,12 @@ def contrastive_loss(labels, embeddings, margin=1.0, normalize=False):
 		diag_mask = tf.eye(batch_size, dtype=tf.bool)
 		non_diag_mask = tf.logical_not(diag_mask)    
 
-		dist_mat = euclidean_distance(embeddings, tf.transpose(embeddings), False)
+		if dist_mat is None:
+			dist_mat = euclidean_distance(embeddings, tf.transpose(embeddings), False)
 		
 
-		label_mat = tf.equal(labels[:,None], labels[None,:])
+		if label_mat is None:
+			label_mat = tf.equal(labels[:,None], labels[None,:])
 		label_mask_pos = tf.logical_and(non_diag_mask, label_mat)
 		label_mask_neg = tf.logical_and(non_diag_mask, tf.logical_not(label_mat))
 
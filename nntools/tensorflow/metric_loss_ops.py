@@ -158,7 +158,7 @@ def masked_minimum(data, mask, dim=1):
   return masked_minimums
 
 
-def triplet_semihard_loss(labels, embeddings, margin=1.0):
+def triplet_semihard_loss(labels, embeddings, margin=1.0, pdist_matrix=None):
   """Computes the triplet loss with semi-hard negative mining.
 
   The loss encourages the positive distances (between a pair of embeddings with
@@ -174,6 +174,8 @@ def triplet_semihard_loss(labels, embeddings, margin=1.0):
     embeddings: 2-D float `Tensor` of embedding vectors. Embeddings should
       be l2 normalized.
     margin: Float, margin term in the loss definition.
+    pdist_matrix: Optional precomputed pairwise squared distance matrix of the
+      embeddings, as returned by `pairwise_distance(embeddings, squared=True)`.
 
   Returns:
     triplet_loss: tf.float32 scalar.
@@ -185,7 +187,8 @@ def triplet_semihard_loss(labels, embeddings, margin=1.0):
   labels = array_ops.reshape(labels, [lshape[0], 1])
 
   # Build pairwise squared distance matrix.
-  pdist_matrix = pairwise_distance(embeddings, squared=True)
+  if pdist_matrix is None:
+    pdist_matrix = pairwise_distance(embeddings, squared=True)
   # Build pairwise binary adjacency matrix.
   adjacency = math_ops.equal(labels, array_ops.transpose(labels))
   # Invert so we can select negatives only.
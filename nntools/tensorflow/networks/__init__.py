@@ -1,3 +1,5 @@
 from .basenet import BaseNetwork
 from .binary_cnn import JointCNN
-from .chimney_cnn import ChimneyCNN
\ No newline at end of file
+from .chimney_cnn import ChimneyCNN
+from .pool import InferencePool, MicroBatcher
+from .cascade import CascadeScorer
\ No newline at end of file
@@ -32,6 +32,7 @@ import numpy as np
 from nntools import tensorflow as tftools
 from .. import utils as tfutils 
 from .. import losses as tflosses
+from .. import loss_registry as tfloss_registry
 from .. import watcher as tfwatcher
 
 class BaseNetwork:
@@ -46,6 +47,11 @@ class BaseNetwork:
         '''
             Initialize the graph from scratch according config.
         '''
+        if getattr(config, 'cluster', None):
+            # Data-parallel training over worker processes, this process is the first worker
+            self.sess.close()
+            self.server, self.sess = tfutils.cluster_session(self.graph, config.cluster,
+                                        getattr(config, 'num_threads', 0))
         with self.graph.as_default():
             with self.sess.as_default():
                 # Set up placeholders
@@ -58,19 +64,20 @@ class BaseNetwork:
                 phase_train_placeholder = tf.placeholder(tf.bool, name='phase_train')
                 global_step = tf.Variable(0, trainable=False, dtype=tf.int32, name='global_step')
 
-                image_splits = tf.split(image_batch_placeholder, config.num_gpus)
-                label_splits = tf.split(label_batch_placeholder, config.num_gpus)
+                devices = tfutils.tower_devices(config)
+                image_splits = tf.split(image_batch_placeholder, len(devices))
+                label_splits = tf.split(label_batch_placeholder, len(devices))
                 grads_splits = []
                 split_dict = {}
                 def insert_dict(k,v):
                     if k in split_dict: split_dict[k].append(v)
                     else: split_dict[k] = [v]
                         
-                for i in range(config.num_gpus):
+                for i, device in enumerate(devices):
                     scope_name = '' if i==0 else 'gpu_%d' % i
                     with tf.name_scope(scope_name):
                         with tf.variable_scope('', reuse=i>0):
-                            with tf.device('/gpu:%d' % i):
+                            with tf.device(device):
                                 images = tf.identity(image_splits[i], name='inputs')
                                 labels = tf.identity(label_splits[i], name='labels')
                                 # Save the first channel for testing
@@ -110,99 +117,15 @@ class BaseNetwork:
                                 if i == 0:
                                     self.outputs = tf.identity(prelogits, name='outputs')
 
-                                # Build all losses
+                                # Build all losses, the intermediates shared by several
+                                # losses (e.g. distance matrices) are computed once per tower
+                                loss_context = tfloss_registry.LossContext(prelogits, labels, num_classes,
+                                                    global_step, learning_rate_placeholder, config.weight_decay,
+                                                    embeddings=embeddings)
                                 loss_list = []
-
-                                # Orignal Softmax
-                                if 'softmax' in config.losses.keys():
-                                    softmax_loss = tflosses.softmax_loss(prelogits, labels, num_classes,
-                                                    weight_decay=config.weight_decay, **config.losses['softmax'])
-                                    loss_list.append(softmax_loss)
-                                    insert_dict('sfloss', softmax_loss)
-                                # Center Loss
-                                if 'center' in config.losses.keys():
-                                    center_loss = tflosses.center_loss(prelogits, labels, 
-                                                        num_classes, **config.losses['center'])
-                                    loss_list.append(center_loss)
-                                    insert_dict('ctloss', center_loss)
-                                # Ring Loss
-                                if 'ring' in config.losses.keys():
-                                    ring_loss = tflosses.ring_loss(prelogits, **config.losses['ring'])
-                                    loss_list.append(ring_loss)
-                                    insert_dict('rloss', ring_loss)
-                                # Decov Loss
-                                if 'decov' in config.losses.keys():
-                                    decov_loss = tflosses.decov_loss(prelogits, **config.losses['decov'])
-                                    loss_list.append(decov_loss)
-                                    insert_dict('decloss', decov_loss)
-                                # Triplet Loss
-                                if 'triplet' in config.losses.keys():
-                                    triplet_loss = tflosses.triplet_semihard_loss(labels, embeddings, **config.losses['triplet'])
-                                    loss_list.append(triplet_loss)
-                                    insert_dict('loss', triplet_loss)
-                                # Contrastive Loss
-                                if 'contrastive' in config.losses.keys():
-                                    contrastive_loss = tflosses.contrastive_loss(labels, prelogits, **config.losses['contrastive'])
-                                    loss_list.append(contrastive_loss)
-                                    insert_dict('loss', contrastive_loss)
-
-                                # L2-Softmax
-                                if 'cosine' in config.losses.keys():
-                                    logits, cosine_loss = losses.cosine_softmax(prelogits, labels, num_classes, 
-                                                            gamma=config.losses['cosine']['gamma'], 
-                                                            weight_decay=config.weight_decay)
-                                    loss_list.append(cosine_loss)
-                                    insert_dict('closs', cosine_loss)
-                                # A-Softmax
-                                if 'angular' in config.losses.keys():
-                                    a_cfg = config.losses['angular']
-                                    angular_loss = tflosses.angular_softmax(prelogits, labels, num_classes, 
-                                                            global_step, a_cfg['m'], a_cfg['lamb_min'], a_cfg['lamb_max'],
-                                                            weight_decay=config.weight_decay)
-                                    loss_list.append(angular_loss)
-                                    insert_dict('aloss', angular_loss)
-                                # AM-Softmax
-                                if 'am_softmax' in config.losses.keys():
-                                    amloss = tflosses.am_softmax(prelogits, labels, num_classes, 
-                                                            global_step, weight_decay=config.weight_decay,
-                                                            **config.losses['am_softmax'])
-                                    loss_list.append(amloss)
-                                    insert_dict('loss', amloss)
-                                # AM-Softmax Dynamic Imprinting
-                                if 'am_imprint' in config.losses.keys():
-                                    ami_loss = tflosses.am_softmax_imprint(prelogits, labels, num_classes,
-                                        global_step, config.weight_decay, learning_rate_placeholder, **config.losses['am_imprint'])
-                                    ami_loss = tf.identity(ami_loss, name='ami_loss')
-                                    loss_list.append(ami_loss)
-                                    insert_dict('amiloss', ami_loss)
-                                # ArcFace
-                                if 'arcface' in config.losses.keys():
-                                    arc_loss = tflosses.arcface_loss(prelogits, labels, num_classes, **config.losses['arcface'])
-                                    arc_loss = tf.identity(arc_loss, name='arc_loss')
-                                    loss_list.append(arc_loss)
-                                    insert_dict('arcloss', arc_loss)
-
-                                # Euclidean Loss
-                                if 'euc' in config.losses.keys():
-                                    euc_loss = tflosses.euc_loss(prelogits, labels, num_classes,
-                                        global_step, config.weight_decay, **config.losses['euc'])
-                                    loss_list.append(euc_loss)
-                                    insert_dict('euc_loss', euc_loss)
-                                # Split Loss
-                                if 'split' in config.losses.keys():
-                                    split_losses = tflosses.split_softmax(prelogits, labels, num_classes, 
-                                                            global_step, config.weight_decay, **config.losses['split'])
-                                    loss_list.append(split_losses)
-                                    insert_dict('sploss', split_losses)
-                                # MPS
-                                if 'pair' in config.losses.keys():
-                                    pair_losses = tflosses.pair_loss(prelogits, labels, num_classes, 
-                                                            global_step, gamma=config.losses['pair']['gamma'],  
-                                                            m=config.losses['pair']['m'],
-                                                            weight_decay=config.weight_decay)
-                                    loss_list.extend(pair_losses)
-                                    insert_dict('loss', pair_losses[0])
-                                    
+                                for k, losses in tfloss_registry.build_losses(loss_context, config.losses):
+                                    loss_list.extend(losses)
+                                    insert_dict(k, losses[0])
 
                                # Collect all losses
                                 reg_loss = tf.reduce_sum(tf.get_collection(tf.GraphKeys.REGULARIZATION_LOSSES), name='reg_loss')
@@ -229,7 +152,8 @@ class BaseNetwork:
 
                 # Training Operaters
                 apply_gradient_op = tfutils.apply_gradient(tf.trainable_variables(), grads, config.optimizer,
-                                        learning_rate_placeholder, config.learning_rate_multipliers)
+                                        learning_rate_placeholder, config.learning_rate_multipliers,
+                                        accumulation_steps=getattr(config, 'gradient_accumulation_steps', 1))
 
                 update_global_step_op = tf.assign_add(global_step, 1)
 
@@ -279,8 +203,7 @@ class BaseNetwork:
         
 
     def load_model(self, *args, **kwargs):
-        tfutils.load_model(self.sess, *args, **kwargs)
-        print([n.name for n in self.graph.as_graph_def().node if 'keep_prob' in n.name])
+        timings = tfutils.load_model(self.sess, *args, **kwargs)
        
         self.phase_train_placeholder = self.graph.get_tensor_by_name('InceptionResnetV1/phase_train:0')
         self.keep_prob_placeholder = self.graph.get_tensor_by_name('InceptionResnetV1/InceptionResnetV1/Logits/Dropout/cond/dropout/keep_prob:0')
@@ -298,6 +221,7 @@ class BaseNetwork:
         
         
         #self.intermediate = self.graph.get_tensor_by_name('InceptionResnetV1/Conv2d_4b_3x3/Relu:0')
+        return timings
     
     def extract_intermediate_feature(self, images, batch_size, proc_func=None, verbose=False):
         num_images = images.shape[0] if type(images)==np.ndarray else len(images)
@@ -35,6 +35,7 @@ from .. import utils as tfutils
 from .. import losses as tflosses
 from .. import metric_loss_ops as mlosses
 from .. import watcher as tfwatcher
+from nntools.common import imageprocessing
 from tensorflow.python.ops import math_ops
 
 from tensorflow.contrib.tensorboard.plugins import projector
@@ -44,17 +45,31 @@ def softmax(x):
     return e_x / e_x.sum(axis=0)
 
 class JointCNN:
-    def __init__(self):
+    # Candidate names of the logits, covering exported frozen graphs,
+    # graphs built by nets/joint_cnn.py and the released checkpoints.
+    head_names = {
+        'fused': ['predicted:0', 'outputs:0'],
+    }
+
+    def __init__(self, intra_op_threads=0, inter_op_threads=0):
         self.graph = tf.Graph()
         gpu_options = tf.GPUOptions(allow_growth=True)
         tf_config = tf.ConfigProto(gpu_options=gpu_options,
-                allow_soft_placement=True, log_device_placement=False)
+                allow_soft_placement=True, log_device_placement=False,
+                intra_op_parallelism_threads=intra_op_threads,
+                inter_op_parallelism_threads=inter_op_threads)
         self.sess = tf.Session(graph=self.graph, config=tf_config)
+        self.checkpoint_writer = None
             
     def initialize(self, config, num_classes):
         '''
             Initialize the graph from scratch according config.
         '''
+        if getattr(config, 'cluster', None):
+            # Data-parallel training over worker processes, this process is the first worker
+            self.sess.close()
+            self.server, self.sess = tfutils.cluster_session(self.graph, config.cluster,
+                                        getattr(config, 'num_threads', 0))
         with self.graph.as_default():
             with self.sess.as_default():
                 # Set up placeholders
@@ -68,19 +83,25 @@ class JointCNN:
                 global_step = tf.Variable(0, trainable=False, dtype=tf.int32, name='global_step')
 
                 
-                label_splits = tf.split(label_batch_placeholder, config.num_gpus)
-                image_splits = tf.split(image_batch_placeholder, config.num_gpus)
+                devices = tfutils.tower_devices(config)
+                label_splits = tf.split(label_batch_placeholder, len(devices))
+                image_splits = tf.split(image_batch_placeholder, len(devices))
                 grads_splits = []
                 split_dict = {}
                 def insert_dict(k,v):
                     if k in split_dict: split_dict[k].append(v)
                     else: split_dict[k] = [v]
+
+                # Mixed precision: float16 network with float32 master weights and loss scaling
+                mixed_precision = getattr(config, 'mixed_precision', False)
+                custom_getter = tfutils.float32_variable_getter if mixed_precision else None
+                loss_scale = tfutils.DynamicLossScale() if mixed_precision else None
                         
-                for i in range(config.num_gpus):
+                for i, device in enumerate(devices):
                     scope_name = '' if i==0 else 'gpu_%d' % i
                     with tf.name_scope(scope_name):
-                        with tf.variable_scope('', reuse=i>0):
-                            with tf.device('/gpu:%d' % i):
+                        with tf.variable_scope('', reuse=i>0, custom_getter=custom_getter):
+                            with tf.device(device):
                                
                                 labels = tf.identity(label_splits[i], name='labels')
                                 # Save the first channel for testing
@@ -88,14 +109,18 @@ class JointCNN:
                                 self.inputs = images
                                
                                 network = imp.load_source('network', config.network)
-                                prelogits, emb = network.inference(images, keep_prob_placeholder, phase_train_placeholder,
+                                network_inputs = tf.cast(images, tf.float16) if mixed_precision else images
+                                prelogits, emb = network.inference(network_inputs, keep_prob_placeholder, phase_train_placeholder,
                                                                 bottleneck_layer_size = config.embedding_size, 
                                                                 weight_decay = config.weight_decay,
                                                                 reuse=False,
                                                                 model_version = config.model_version)  
+                                # Losses and outputs are computed in float32
+                                prelogits, emb = tf.cast(prelogits, tf.float32), tf.cast(emb, tf.float32)
                                 self.embeddings = tf.nn.l2_normalize(emb, dim=1)                                                                                       
                                 if i == 0:
                                     self.outputs = tf.identity(prelogits, name='outputs')
+                                    self.heads = {'fused': prelogits}
                                 self.total_loss = 0.0 
                                 if 'sigmoid_cross_entropy' in config.losses.keys():
                                     self.final_labels = tf.cast(tf.logical_not(tf.cast(tf.one_hot(labels, 1), tf.bool)), tf.float32) 
@@ -150,7 +175,8 @@ class JointCNN:
 
                                 #self.total_loss = tflosses.sigmoid_cross_entropy_with_logits(prelogits, labels)     
                                 #total_loss = tf.add_n(loss_list, name='total_loss')
-                                grads_split = tf.gradients(self.total_loss, tf.trainable_variables())
+                                scaled_loss = loss_scale.scale_loss(self.total_loss) if mixed_precision else self.total_loss
+                                grads_split = tf.gradients(scaled_loss, tf.trainable_variables())
                                 grads_splits.append(grads_split)
 
                 # Merge the splits
@@ -163,7 +189,9 @@ class JointCNN:
 
                
                 apply_gradient_op = tfutils.apply_gradient(tf.trainable_variables(), grads, config.optimizer,
-                                        learning_rate_placeholder, config.learning_rate_multipliers)
+                                        learning_rate_placeholder, config.learning_rate_multipliers,
+                                        loss_scale=loss_scale,
+                                        accumulation_steps=getattr(config, 'gradient_accumulation_steps', 1))
                 train_ops = [
                                 apply_gradient_op, 
                                 update_global_step_op
@@ -187,7 +215,7 @@ class JointCNN:
                 # Initialize variables
                 self.sess.run(tf.local_variables_initializer())
                 self.sess.run(tf.global_variables_initializer())
-                self.saver = tf.train.Saver(tf.trainable_variables(), max_to_keep=None)
+                self.saver = tf.train.Saver(tf.trainable_variables(), max_to_keep=getattr(config, 'keep_checkpoints', None))
 
 
                 # Keep useful tensors
@@ -221,44 +249,86 @@ class JointCNN:
         trainable_variables = self.graph.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)
         tfutils.restore_model(self.sess, trainable_variables, *args, **kwargs)
 
-    def save_model(self, model_dir, global_step):
-        tfutils.save_model(self.sess, self.saver, model_dir, global_step)
+    def save_model(self, model_dir, global_step, metric=None):
+        ''' metric: e.g. the EER of the model, with config.async_checkpoint the checkpoints
+        with the lowest metric are kept besides the last ones.'''
+        if getattr(self.config, 'async_checkpoint', False):
+            if self.checkpoint_writer is None:
+                self.checkpoint_writer = tfutils.AsyncCheckpointWriter(self.sess, self.saver,
+                    self.graph.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES), model_dir,
+                    keep_last=getattr(self.config, 'keep_checkpoints', None),
+                    keep_best=getattr(self.config, 'keep_best_checkpoints', 1))
+            self.checkpoint_writer.save(global_step, metric)
+        else:
+            tfutils.save_model(self.sess, self.saver, model_dir, global_step)
+
+    def update_checkpoint_metric(self, global_step, metric):
+        ''' Set the metric of the checkpoint of global_step once it has been evaluated.'''
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.update_metric(global_step, metric)
         
 
     def load_model(self, *args, **kwargs):
-        tfutils.load_model(self.sess, *args, **kwargs)
-        self.phase_train_placeholder = self.graph.get_tensor_by_name('phase_train:0')
-        self.keep_prob_placeholder = self.graph.get_tensor_by_name('keep_prob:0')
+        timings = tfutils.load_model(self.sess, *args, **kwargs)
+        # Frozen graphs do not have the phase_train and keep_prob placeholders
+        self.phase_train_placeholder = tfutils.get_tensor_by_names(self.graph, ['phase_train:0'])
+        self.keep_prob_placeholder = tfutils.get_tensor_by_names(self.graph, ['keep_prob:0'])
         self.inputs = self.graph.get_tensor_by_name('image_batch:0')
-        self.outputs = tf.nn.sigmoid(self.graph.get_tensor_by_name('predicted:0'))
-        self.embeddings = self.graph.get_tensor_by_name('embeddings:0')
+        self.heads = {'fused': tfutils.get_tensor_by_names(self.graph, self.head_names['fused'])}
+        with self.graph.as_default():
+            self.outputs = tf.nn.sigmoid(self.heads['fused'])
+        self.embeddings = tfutils.get_tensor_by_names(self.graph, ['embeddings:0'])
+        return timings
+
+    def feed_dict(self, inputs):
+        feed_dict = {self.inputs: inputs}
+        if self.phase_train_placeholder is not None:
+            feed_dict[self.phase_train_placeholder] = False
+        if self.keep_prob_placeholder is not None:
+            feed_dict[self.keep_prob_placeholder] = 1.0
+        return feed_dict
 
 
     def extract_feature(self, images, batch_size=512,
                         embeddings=False,
                         proc_func=None, 
-                        verbose=False):
+                        verbose=False,
+                        tta=None,
+                        tta_reduce='mean'):
+        ''' tta: 'flip', 'five_crop' or 'ten_crop'. Each image is expanded into its views,
+        which are scored in the same batch (batch_size counts the views) and the logits
+        of the views are reduced to one score by tta_reduce ('mean' or 'max').'''
         num_images = images.shape[0] if type(images)==np.ndarray else len(images)
         num_features = self.outputs.shape[1]
         result = np.ndarray((num_images, num_features), dtype=np.float32)
         if embeddings:
             num_embedding = self.embeddings.shape[1]
             emb = np.ndarray((num_images, num_embedding), dtype=np.float32)
+        num_views = imageprocessing.tta_num_views[tta] if tta else 1
+        step = max(1, batch_size // num_views)
         start_time = time.time()
         times = []
-        for start_idx in range(0, num_images, batch_size):
+        for start_idx in range(0, num_images, step):
             if verbose:
                 times.append(time.time()-start_time)
                 elapsed_time = time.strftime('%H:%M:%S', time.gmtime(time.time()-start_time))
                 sys.stdout.write('# of images: %d Current image: %d Elapsed time: %s \t\r' 
                     % (num_images, start_idx, elapsed_time))
-            end_idx = min(num_images, start_idx + batch_size)
+            end_idx = min(num_images, start_idx + step)
             inputs = images[start_idx:end_idx]
             inputs = proc_func(inputs) if proc_func else inputs
-            feed_dict = {
-                            self.inputs: inputs,
-                            self.phase_train_placeholder: False,
-                            self.keep_prob_placeholder: 1.0}
+            if tta:
+                inputs = imageprocessing.expand_views(np.asarray(inputs), tta)
+                feed_dict = self.feed_dict(inputs)
+                fetches = [self.heads['fused']] + ([self.embeddings] if embeddings else [])
+                values = self.sess.run(fetches, feed_dict=feed_dict)
+                logits = imageprocessing.reduce_views(values[0], num_views, tta_reduce)
+                # Loaded models output the sigmoid of the logits
+                result[start_idx:end_idx] = expit(logits) if self.outputs.op.type == 'Sigmoid' else logits
+                if embeddings:
+                    emb[start_idx:end_idx] = imageprocessing.reduce_views(values[1], num_views, 'mean')
+                continue
+            feed_dict = self.feed_dict(inputs)
             if embeddings:
                 result[start_idx:end_idx], emb[start_idx:end_idx] = self.sess.run([self.outputs, 
                     self.embeddings], feed_dict=feed_dict)
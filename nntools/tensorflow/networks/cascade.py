@@ -0,0 +1,24 @@
+import numpy as np
+
+class CascadeScorer:
+    ''' Score every input with a cheap first network and escalate the inputs whose
+    score falls inside the uncertainty band [low, high] to the second network,
+    whose score replaces the first one.'''
+    def __init__(self, first, second, band=(0.1, 0.9)):
+        self.first = first
+        self.second = second
+        self.band = band
+
+    def escalate(self, scores):
+        low, high = self.band
+        return (scores >= low) & (scores <= high)
+
+    def predict(self, images, batch_size=128, proc_funcs=(None, None)):
+        ''' Return the scores and the boolean mask of the escalated inputs.'''
+        scores = self.first.extract_feature(images, batch_size=batch_size, proc_func=proc_funcs[0])[:,0]
+        escalated = self.escalate(scores)
+        idx = np.where(escalated)[0]
+        if len(idx) > 0:
+            images = images[idx] if type(images)==np.ndarray else [images[i] for i in idx]
+            scores[idx] = self.second.extract_feature(images, batch_size=batch_size, proc_func=proc_funcs[1])[:,0]
+        return scores, escalated
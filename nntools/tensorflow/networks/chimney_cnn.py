@@ -35,6 +35,7 @@ from .. import utils as tfutils
 from .. import losses as tflosses
 from .. import metric_loss_ops as mlosses
 from .. import watcher as tfwatcher
+from nntools.common import imageprocessing
 from tensorflow.python.ops import math_ops
 
 from tensorflow.contrib.tensorboard.plugins import projector
@@ -44,17 +45,41 @@ def softmax(x):
     return e_x / e_x.sum(axis=0)
 
 class ChimneyCNN:
-    def __init__(self):
+    # Candidate names of the logits of each head, covering exported frozen graphs,
+    # graphs built by nets/chimney_cnn.py and the released checkpoints.
+    head_names = {
+        'adversarial': ['adversarial:0', 'ResNeXt/AdversarialBranch/Bottleneck/BiasAdd:0', 
+                        'AdversarialBranch/ImagePred/BiasAdd:0'],
+        'digital': ['digital:0', 'ResNeXt/DigitalBranch/Bottleneck/BiasAdd:0', 
+                        'DigitalBranch/ImagePred/BiasAdd:0'],
+        'physical': ['physical:0', 'ResNeXt/PhysicalBranch/Bottleneck/BiasAdd:0', 
+                        'PhysicalBranch/ImagePred/BiasAdd:0'],
+        'fused': ['predicted:0', 'outputs:0'],
+        # Output of the Common layers shared by the branches (global_conv2 in nets/chimney_cnn.py)
+        'trunk': ['trunk:0', 'ResNeXt/trunk:0', 'ResNeXt/Common/global_conv2/Conv/Relu:0',
+                        'Common/global_conv2/Conv/Relu:0'],
+    }
+    score_heads = ['adversarial', 'digital', 'physical', 'fused']
+
+    def __init__(self, intra_op_threads=0, inter_op_threads=0):
         self.graph = tf.Graph()
         gpu_options = tf.GPUOptions(allow_growth=True)
         tf_config = tf.ConfigProto(gpu_options=gpu_options,
-                allow_soft_placement=True, log_device_placement=False)
+                allow_soft_placement=True, log_device_placement=False,
+                intra_op_parallelism_threads=intra_op_threads,
+                inter_op_parallelism_threads=inter_op_threads)
         self.sess = tf.Session(graph=self.graph, config=tf_config)
+        self.checkpoint_writer = None
             
     def initialize(self, config, num_classes):
         '''
             Initialize the graph from scratch according config.
         '''
+        if getattr(config, 'cluster', None):
+            # Data-parallel training over worker processes, this process is the first worker
+            self.sess.close()
+            self.server, self.sess = tfutils.cluster_session(self.graph, config.cluster,
+                                        getattr(config, 'num_threads', 0))
         with self.graph.as_default():
             with self.sess.as_default():
                 # Set up placeholders
@@ -68,8 +93,9 @@ class ChimneyCNN:
                 global_step = tf.Variable(0, trainable=False, dtype=tf.int32, name='global_step')
 
                 
-                label_splits = tf.split(label_batch_placeholder, config.num_gpus)
-                image_splits = tf.split(image_batch_placeholder, config.num_gpus)
+                devices = tfutils.tower_devices(config)
+                label_splits = tf.split(label_batch_placeholder, len(devices))
+                image_splits = tf.split(image_batch_placeholder, len(devices))
                 grads_splits = []
                 split_dict = {}
                 summaries = []
@@ -80,12 +106,17 @@ class ChimneyCNN:
                         _dict[k].append(v)
                     else:
                         _dict[k] = [v]
+
+                # Mixed precision: float16 network with float32 master weights and loss scaling
+                mixed_precision = getattr(config, 'mixed_precision', False)
+                custom_getter = tfutils.float32_variable_getter if mixed_precision else None
+                accumulation_steps = getattr(config, 'gradient_accumulation_steps', 1)
                         
-                for i in range(config.num_gpus):
+                for i, device in enumerate(devices):
                     scope_name = '' if i==0 else 'gpu_%d' % i
                     with tf.name_scope(scope_name):
-                        with tf.variable_scope('', reuse=i>0):
-                            with tf.device('/gpu:%d' % i):
+                        with tf.variable_scope('', reuse=i>0, custom_getter=custom_getter):
+                            with tf.device(device):
                                
                                 labels = tf.identity(label_splits[i], name='labels')
                                 # Save the first channel for testing
@@ -93,14 +124,20 @@ class ChimneyCNN:
                                 self.inputs = images
                                
                                 network = imp.load_source('network', config.network)
-                                scores, final_feature = network.inference(images, keep_prob_placeholder, phase_train_placeholder,
+                                network_inputs = tf.cast(images, tf.float16) if mixed_precision else images
+                                scores, final_feature = network.inference(network_inputs, keep_prob_placeholder, phase_train_placeholder,
                                                                 bottleneck_layer_size = config.embedding_size, 
                                                                 weight_decay = config.weight_decay,
                                                                 reuse=False,
                                                                 model_version = config.model_version)  
+                                # Losses and outputs are computed in float32
+                                scores = [tf.cast(score, tf.float32) for score in scores]
+                                final_feature = tf.cast(final_feature, tf.float32)
                                 self.embeddings = tf.nn.l2_normalize(final_feature, dim=1)                                                                                       
                                 if i == 0:
                                     self.outputs = tf.identity(scores[-1], name='outputs')
+                                    self.heads = dict(zip(self.score_heads, scores))
+                                    self.heads['trunk'] = tfutils.get_tensor_by_names(self.graph, self.head_names['trunk'])
                                 self.total_loss = 0.0
 
                                 # Early Sharing Loss
@@ -133,29 +170,32 @@ class ChimneyCNN:
                                 insert_dict(average_dict, "dig_loss", digital_loss)
                                 insert_dict(average_dict, "phy_loss", physical_loss)
 
-                                G_vars = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope="ResNeXt")
-                                Early_vars = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope="ResNeXt/Common")
-                                Adv_vars = Early_vars + tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope="ResNeXt/AdversarialBranch")
-                                Dig_vars = Early_vars + tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope="ResNeXt/DigitalBranch")
-                                Phy_vars = Early_vars + tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope="ResNeXt/PhysicalBranch")
-            
-                                self.train_early_op = tf.train.AdamOptimizer(
-                                    0.01, beta1=0.5, beta2=0.9
-                                ).minimize(early_loss, var_list=G_vars)
+                # The gradients of each loss are averaged over the towers
+                G_vars = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope="ResNeXt")
+                Early_vars = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope="ResNeXt/Common")
+                Adv_vars = Early_vars + tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope="ResNeXt/AdversarialBranch")
+                Dig_vars = Early_vars + tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope="ResNeXt/DigitalBranch")
+                Phy_vars = Early_vars + tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope="ResNeXt/PhysicalBranch")
 
-                                self.train_adv_op = tf.train.AdamOptimizer(
-                                    0.01, beta1=0.5, beta2=0.9
-                                ).minimize(adversarial_loss, var_list=Adv_vars)
+                self.train_early_op = tfutils.minimize(tf.train.AdamOptimizer(
+                    0.01, beta1=0.5, beta2=0.9
+                ), average_dict["early_loss"], G_vars, tfutils.DynamicLossScale() if mixed_precision else None,
+                    accumulation_steps)
 
-                                self.train_dig_op = tf.train.AdamOptimizer(
-                                    0.01, beta1=0.5, beta2=0.9
-                                ).minimize(digital_loss, var_list=Dig_vars)
+                self.train_adv_op = tfutils.minimize(tf.train.AdamOptimizer(
+                    0.01, beta1=0.5, beta2=0.9
+                ), average_dict["adv_loss"], Adv_vars, tfutils.DynamicLossScale() if mixed_precision else None,
+                    accumulation_steps)
 
-                                self.train_phy_op = tf.train.AdamOptimizer(
-                                    0.01, beta1=0.5, beta2=0.9
-                                ).minimize(physical_loss, var_list=Phy_vars)
+                self.train_dig_op = tfutils.minimize(tf.train.AdamOptimizer(
+                    0.01, beta1=0.5, beta2=0.9
+                ), average_dict["dig_loss"], Dig_vars, tfutils.DynamicLossScale() if mixed_precision else None,
+                    accumulation_steps)
 
-                                
+                self.train_phy_op = tfutils.minimize(tf.train.AdamOptimizer(
+                    0.01, beta1=0.5, beta2=0.9
+                ), average_dict["phy_loss"], Phy_vars, tfutils.DynamicLossScale() if mixed_precision else None,
+                    accumulation_steps)
 
                 for k, v in average_dict.items():
                     v = tfutils.average_tensors(v)
@@ -180,7 +220,7 @@ class ChimneyCNN:
 
                 self.sess.run(tf.local_variables_initializer())
                 self.sess.run(tf.global_variables_initializer())
-                self.saver = tf.train.Saver(trainable_variables, max_to_keep=None)
+                self.saver = tf.train.Saver(trainable_variables, max_to_keep=getattr(config, 'keep_checkpoints', None))
 
 
                 # Keep useful tensors
@@ -192,6 +232,7 @@ class ChimneyCNN:
                 self.global_step = global_step
                 self.watch_list = tfwatcher.get_watchlist()
                 self.config = config
+                self.build_head_outputs()
                 
 
 
@@ -213,44 +254,101 @@ class ChimneyCNN:
         trainable_variables = self.graph.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)
         tfutils.restore_model(self.sess, trainable_variables, *args, **kwargs)
 
-    def save_model(self, model_dir, global_step):
-        tfutils.save_model(self.sess, self.saver, model_dir, global_step)
+    def save_model(self, model_dir, global_step, metric=None):
+        ''' metric: e.g. the EER of the model, with config.async_checkpoint the checkpoints
+        with the lowest metric are kept besides the last ones.'''
+        if getattr(self.config, 'async_checkpoint', False):
+            if self.checkpoint_writer is None:
+                self.checkpoint_writer = tfutils.AsyncCheckpointWriter(self.sess, self.saver,
+                    self.graph.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES), model_dir,
+                    keep_last=getattr(self.config, 'keep_checkpoints', None),
+                    keep_best=getattr(self.config, 'keep_best_checkpoints', 1))
+            self.checkpoint_writer.save(global_step, metric)
+        else:
+            tfutils.save_model(self.sess, self.saver, model_dir, global_step)
+
+    def update_checkpoint_metric(self, global_step, metric):
+        ''' Set the metric of the checkpoint of global_step once it has been evaluated.'''
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.update_metric(global_step, metric)
         
 
     def load_model(self, *args, **kwargs):
-        tfutils.load_model(self.sess, *args, **kwargs)
-        self.phase_train_placeholder = self.graph.get_tensor_by_name('phase_train:0')
-        self.keep_prob_placeholder = self.graph.get_tensor_by_name('keep_prob:0')
+        timings = tfutils.load_model(self.sess, *args, **kwargs)
+        # Frozen graphs do not have the phase_train and keep_prob placeholders
+        self.phase_train_placeholder = tfutils.get_tensor_by_names(self.graph, ['phase_train:0'])
+        self.keep_prob_placeholder = tfutils.get_tensor_by_names(self.graph, ['keep_prob:0'])
         self.inputs = self.graph.get_tensor_by_name('image_batch:0')
-        self.outputs = tf.nn.sigmoid(self.graph.get_tensor_by_name('predicted:0'))
-        # self.embeddings = self.graph.get_tensor_by_name('embeddings:0')
+        self.heads = {}
+        for head, names in self.head_names.items():
+            tensor = tfutils.get_tensor_by_names(self.graph, names)
+            if tensor is not None:
+                self.heads[head] = tensor
+        with self.graph.as_default():
+            self.outputs = tf.nn.sigmoid(self.heads['fused'])
+        self.embeddings = tfutils.get_tensor_by_names(self.graph, ['embeddings:0'])
+        self.build_head_outputs()
+        return timings
+
+    def build_head_outputs(self):
+        ''' Sigmoid scores of the heads that can be requested in predict.'''
+        self.head_outputs = {}
+        with self.graph.as_default():
+            for head in self.score_heads:
+                if self.heads.get(head) is not None:
+                    self.head_outputs[head] = tf.nn.sigmoid(self.heads[head])
+        if self.embeddings is not None:
+            self.head_outputs['embeddings'] = self.embeddings
+
+    def feed_dict(self, inputs):
+        feed_dict = {} if inputs is None else {self.inputs: inputs}
+        if self.phase_train_placeholder is not None:
+            feed_dict[self.phase_train_placeholder] = False
+        if self.keep_prob_placeholder is not None:
+            feed_dict[self.keep_prob_placeholder] = 1.0
+        return feed_dict
 
 
     def extract_feature(self, images, batch_size=512,
                         embeddings=False,
                         proc_func=None, 
-                        verbose=False):
+                        verbose=False,
+                        tta=None,
+                        tta_reduce='mean'):
+        ''' tta: 'flip', 'five_crop' or 'ten_crop'. Each image is expanded into its views,
+        which are scored in the same batch (batch_size counts the views) and the logits
+        of the views are reduced to one score by tta_reduce ('mean' or 'max').'''
         num_images = images.shape[0] if type(images)==np.ndarray else len(images)
         num_features = self.outputs.shape[1]
         result = np.ndarray((num_images, num_features), dtype=np.float32)
         if embeddings:
             num_embedding = self.embeddings.shape[1]
             emb = np.ndarray((num_images, num_embedding), dtype=np.float32)
+        num_views = imageprocessing.tta_num_views[tta] if tta else 1
+        step = max(1, batch_size // num_views)
         start_time = time.time()
         times = []
-        for start_idx in range(0, num_images, batch_size):
+        for start_idx in range(0, num_images, step):
             if verbose:
                 times.append(time.time()-start_time)
                 elapsed_time = time.strftime('%H:%M:%S', time.gmtime(time.time()-start_time))
                 sys.stdout.write('# of images: %d Current image: %d Elapsed time: %s \t\r' 
                     % (num_images, start_idx, elapsed_time))
-            end_idx = min(num_images, start_idx + batch_size)
+            end_idx = min(num_images, start_idx + step)
             inputs = images[start_idx:end_idx]
             inputs = proc_func(inputs) if proc_func else inputs
-            feed_dict = {
-                            self.inputs: inputs,
-                            self.phase_train_placeholder: False,
-                            self.keep_prob_placeholder: 1.0}
+            if tta:
+                inputs = imageprocessing.expand_views(np.asarray(inputs), tta)
+                feed_dict = self.feed_dict(inputs)
+                fetches = [self.heads['fused']] + ([self.embeddings] if embeddings else [])
+                values = self.sess.run(fetches, feed_dict=feed_dict)
+                logits = imageprocessing.reduce_views(values[0], num_views, tta_reduce)
+                # Loaded models output the sigmoid of the logits
+                result[start_idx:end_idx] = expit(logits) if self.outputs.op.type == 'Sigmoid' else logits
+                if embeddings:
+                    emb[start_idx:end_idx] = imageprocessing.reduce_views(values[1], num_views, 'mean')
+                continue
+            feed_dict = self.feed_dict(inputs)
             if embeddings:
                 result[start_idx:end_idx], emb[start_idx:end_idx] = self.sess.run([self.outputs, 
                     self.embeddings], feed_dict=feed_dict)
@@ -260,3 +358,118 @@ class ChimneyCNN:
             return result, emb
         else:
             return result
+
+    def predict(self, images, heads=['fused'], batch_size=512,
+                early_exit=None,
+                proc_func=None,
+                verbose=False):
+        ''' Compute only the requested heads (adversarial, digital, physical, fused
+        and embeddings). Only the subgraph needed by the fetched heads is run,
+        so a single branch costs the trunk and that branch.
+        early_exit: (head, low, high) with a branch head. The head is computed first
+        and the inputs whose score is outside [low, high] skip the rest of the network:
+        the score of the exit head is always returned, the fused score and the other
+        heads are nan for the exited inputs.
+        Returns a dict of {head: array}, plus the exited mask with early_exit.'''
+        for head in heads + ([early_exit[0]] if early_exit else []):
+            if head not in self.head_outputs:
+                raise ValueError('Head %s is not available, choose from %s' % (head, list(self.head_outputs.keys())))
+        if early_exit is not None:
+            exit_head, low, high = early_exit
+            if exit_head == 'fused':
+                raise ValueError('The fused head needs all the branches, exit on a branch head instead')
+            heads = heads + [exit_head]
+            first_heads = [exit_head]
+            rest_heads = [h for h in heads if h != exit_head]
+        else:
+            first_heads, rest_heads = heads, []
+        trunk = self.heads.get('trunk')
+        fetch_trunk = len(rest_heads) > 0 and trunk is not None
+
+        num_images = images.shape[0] if type(images)==np.ndarray else len(images)
+        results = {}
+        for head in set(heads):
+            num_features = self.head_outputs[head].shape[1]
+            results[head] = np.full((num_images, num_features), np.nan, dtype=np.float32)
+        if early_exit is not None:
+            results['exited'] = np.zeros(num_images, dtype=np.bool_)
+        start_time = time.time()
+        for start_idx in range(0, num_images, batch_size):
+            if verbose:
+                elapsed_time = time.strftime('%H:%M:%S', time.gmtime(time.time()-start_time))
+                sys.stdout.write('# of images: %d Current image: %d Elapsed time: %s \t\r' 
+                    % (num_images, start_idx, elapsed_time))
+            end_idx = min(num_images, start_idx + batch_size)
+            inputs = images[start_idx:end_idx]
+            inputs = proc_func(inputs) if proc_func else inputs
+            fetches = [self.head_outputs[h] for h in first_heads]
+            if fetch_trunk:
+                fetches.append(trunk)
+            values = self.sess.run(fetches, feed_dict=self.feed_dict(inputs))
+            for head, value in zip(first_heads, values):
+                if head in results:
+                    results[head][start_idx:end_idx] = value
+            if early_exit is None:
+                continue
+
+            score = values[0][:,0]
+            exited = (score < low) | (score > high)
+            results['exited'][start_idx:end_idx] = exited
+            idx = np.where(~exited)[0]
+            if len(idx) == 0 or len(rest_heads) == 0:
+                continue
+            feed_dict = self.feed_dict(np.asarray(inputs)[idx])
+            if fetch_trunk:
+                # Reuse the trunk instead of computing it again
+                feed_dict[trunk] = values[-1][idx]
+            values = self.sess.run([self.head_outputs[h] for h in rest_heads], feed_dict=feed_dict)
+            for head, value in zip(rest_heads, values):
+                results[head][start_idx + idx] = value
+        return results
+
+    def extract_trunk(self, images, output_file, batch_size=512,
+                        proc_func=None,
+                        verbose=False):
+        ''' Compute the trunk features shared by the branches and save them as
+        a float16 .npy file, which can be scored with predict_from_trunk by
+        any model that has the same Common layers.'''
+        trunk = self.heads.get('trunk')
+        if trunk is None:
+            raise ValueError('The trunk features are not available in this model')
+        num_images = images.shape[0] if type(images)==np.ndarray else len(images)
+        shape = (num_images,) + tuple(trunk.shape.as_list()[1:])
+        result = np.lib.format.open_memmap(output_file, mode='w+', dtype=np.float16, shape=shape)
+        start_time = time.time()
+        for start_idx in range(0, num_images, batch_size):
+            if verbose:
+                elapsed_time = time.strftime('%H:%M:%S', time.gmtime(time.time()-start_time))
+                sys.stdout.write('# of images: %d Current image: %d Elapsed time: %s \t\r' 
+                    % (num_images, start_idx, elapsed_time))
+            end_idx = min(num_images, start_idx + batch_size)
+            inputs = images[start_idx:end_idx]
+            inputs = proc_func(inputs) if proc_func else inputs
+            result[start_idx:end_idx] = self.sess.run(trunk, feed_dict=self.feed_dict(inputs))
+        result.flush()
+        return result
+
+    def predict_from_trunk(self, trunk_features, heads=['fused'], batch_size=512):
+        ''' Score the heads from trunk features, e.g. the memory-mapped output of
+        extract_trunk, without running the Common layers.'''
+        trunk = self.heads.get('trunk')
+        if trunk is None:
+            raise ValueError('The trunk features are not available in this model')
+        num_images = trunk_features.shape[0]
+        results = {}
+        for head in heads:
+            num_features = self.head_outputs[head].shape[1]
+            results[head] = np.ndarray((num_images, num_features), dtype=np.float32)
+        fetches = [self.head_outputs[head] for head in heads]
+        for start_idx in range(0, num_images, batch_size):
+            end_idx = min(num_images, start_idx + batch_size)
+            inputs = trunk_features[start_idx:end_idx].astype(np.float32)
+            feed_dict = self.feed_dict(None)
+            feed_dict[trunk] = inputs
+            values = self.sess.run(fetches, feed_dict=feed_dict)
+            for head, value in zip(heads, values):
+                results[head][start_idx:end_idx] = value
+        return results
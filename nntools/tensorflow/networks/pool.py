@@ -0,0 +1,151 @@
+import time
+import threading
+import collections
+import numpy as np
+import queue
+
+class InferencePool:
+    ''' Serve predict calls from multiple threads with a single loaded model.
+    The graph is finalized after loading so that no thread can add ops to it,
+    every call uses its own output buffers and the number of concurrent
+    session runs is bounded to avoid oversubscribing the CPU threads.'''
+    def __init__(self, network_class, model_path, 
+                    intra_op_threads=0, 
+                    inter_op_threads=0,
+                    max_concurrent=None,
+                    batch_size=128):
+        self.network = network_class(intra_op_threads=intra_op_threads, 
+            inter_op_threads=inter_op_threads)
+        self.network.load_model(model_path)
+        head_outputs = getattr(self.network, 'head_outputs', None)
+        if head_outputs is None:
+            head_outputs = {'fused': self.network.outputs}
+            if self.network.embeddings is not None:
+                head_outputs['embeddings'] = self.network.embeddings
+        self.head_outputs = head_outputs
+        self.network.graph.finalize()
+
+        self.batch_size = batch_size
+        self.semaphore = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+        self.lock = threading.Lock()
+        self.num_calls = 0
+        self.num_images = 0
+        self.run_time = 0.0
+
+    @property
+    def heads(self):
+        return list(self.head_outputs.keys())
+
+    def run(self, inputs, fetches):
+        if self.semaphore is None:
+            return self.network.sess.run(fetches, feed_dict=self.network.feed_dict(inputs))
+        with self.semaphore:
+            return self.network.sess.run(fetches, feed_dict=self.network.feed_dict(inputs))
+
+    def predict(self, images, heads=None, proc_func=None):
+        ''' Return a dict of {head: scores} of the images, by default for all heads.
+        Safe to be called concurrently from multiple threads.'''
+        heads = heads or self.heads
+        for head in heads:
+            if head not in self.head_outputs:
+                raise ValueError('Head %s is not available, choose from %s' % (head, self.heads))
+        fetches = [self.head_outputs[head] for head in heads]
+        num_images = images.shape[0] if type(images)==np.ndarray else len(images)
+        results = {}
+        for head, fetch in zip(heads, fetches):
+            results[head] = np.ndarray((num_images, fetch.shape[1]), dtype=np.float32)
+        start_time = time.time()
+        for start_idx in range(0, num_images, self.batch_size):
+            end_idx = min(num_images, start_idx + self.batch_size)
+            inputs = images[start_idx:end_idx]
+            inputs = proc_func(inputs) if proc_func else inputs
+            values = self.run(inputs, fetches)
+            for head, value in zip(heads, values):
+                results[head][start_idx:end_idx] = value
+        with self.lock:
+            self.num_calls += 1
+            self.num_images += num_images
+            self.run_time += time.time() - start_time
+        return results
+
+    def stats(self):
+        with self.lock:
+            return {
+                'calls': self.num_calls,
+                'images': self.num_images,
+                'run_time': self.run_time,
+            }
+
+
+class MicroBatcher:
+    ''' Group single inputs submitted from multiple threads into batches of at
+    most max_batch inputs, waiting at most max_wait seconds after the first
+    input of a batch, and run one predict call per batch.'''
+    def __init__(self, predict_func, max_batch=64, max_wait=0.005, num_latencies=10000):
+        self.predict_func = predict_func
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=num_latencies)
+        self.num_batches = 0
+        self.num_inputs = 0
+        self.thread = threading.Thread(target=self.loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, inputs):
+        ''' Queue one input and wait for its result, a dict of {head: scores}.'''
+        request = {'inputs': inputs, 'event': threading.Event(), 'time': time.time()}
+        self.queue.put(request)
+        request['event'].wait()
+        if 'error' in request:
+            raise request['error']
+        return request['result']
+
+    def next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def loop(self):
+        while True:
+            batch = self.next_batch()
+            try:
+                results = self.predict_func(np.stack([request['inputs'] for request in batch]))
+                for i, request in enumerate(batch):
+                    request['result'] = {head: value[i] for head, value in results.items()}
+            except Exception as e:
+                for request in batch:
+                    request['error'] = e
+            end_time = time.time()
+            with self.lock:
+                self.num_batches += 1
+                self.num_inputs += len(batch)
+                self.latencies.extend([end_time - request['time'] for request in batch])
+            for request in batch:
+                request['event'].set()
+
+    def stats(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            stats = {
+                'batches': self.num_batches,
+                'inputs': self.num_inputs,
+                'mean_batch_size': float(self.num_inputs) / max(1, self.num_batches),
+            }
+        if len(latencies) > 0:
+            stats['latency_ms'] = {
+                'p50': float(np.percentile(latencies, 50)),
+                'p99': float(np.percentile(latencies, 99)),
+                'max': float(latencies.max()),
+            }
+        return stats
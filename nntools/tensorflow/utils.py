@@ -1,7 +1,16 @@
 import os
+import time
+import json
+import mmap
+import queue
+import struct
+import atexit
+import threading
 import numpy as np
 import tensorflow as tf
 import tensorflow.contrib.slim as slim
+from tensorflow.python.platform import gfile
+from tensorflow.python.framework import tensor_util
 
 
 def average_tensors(tensors, name=None):
@@ -42,11 +51,168 @@ def average_grads(tower_grads):
 
         return average_grads
 
-def apply_gradient(update_gradient_vars, grads, optimizer, learning_rate, learning_rate_multipliers=None):
+def tower_devices(config):
+    ''' Devices of the training towers: the worker processes of config.cluster (a list
+    of host:port addresses, the training process is the first one) or the GPUs.'''
+    cluster = getattr(config, 'cluster', None)
+    if cluster:
+        return ['/job:worker/task:%d' % i for i in range(len(cluster))]
+    return ['/gpu:%d' % i for i in range(config.num_gpus)]
+
+
+def start_server(cluster, task_index, num_threads=0):
+    ''' Start the tf.train.Server of a worker of the cluster (a list of host:port addresses).
+    num_threads sets the size of its thread pools (0 for all the cores).'''
+    cluster_spec = tf.train.ClusterSpec({'worker': list(cluster)})
+    tf_config = tf.ConfigProto(allow_soft_placement=True,
+        intra_op_parallelism_threads=num_threads, inter_op_parallelism_threads=num_threads)
+    return tf.train.Server(cluster_spec, job_name='worker', task_index=task_index, config=tf_config)
+
+
+def cluster_session(graph, cluster, num_threads=0):
+    ''' Start the server of the first worker in this process and return it with a
+    session on the cluster. The towers placed on the other workers run in their
+    processes, which must have been started with start_server.'''
+    server = start_server(cluster, 0, num_threads)
+    tf_config = tf.ConfigProto(allow_soft_placement=True, log_device_placement=False)
+    return server, tf.Session(server.target, graph=graph, config=tf_config)
+
+
+def float32_variable_getter(getter, name, *args, **kwargs):
+    ''' Custom getter for mixed precision: the float16 variables are stored in
+    float32 (master weights) and cast to float16 where they are used.'''
+    if kwargs.get('dtype') != tf.float16:
+        return getter(name, *args, **kwargs)
+    kwargs['dtype'] = tf.float32
+    return tf.cast(getter(name, *args, **kwargs), tf.float16)
+
+
+def float32_batch_norm(inputs, **kwargs):
+    ''' slim.batch_norm computed in float32, so that its statistics stay in float32
+    when the network is built on float16 inputs (mixed precision).'''
+    outputs = slim.batch_norm(tf.cast(inputs, tf.float32), **kwargs)
+    return tf.cast(outputs, inputs.dtype)
+
+
+def gradient_values(grad):
+    return grad.values if isinstance(grad, tf.IndexedSlices) else grad
+
+
+def scale_gradient(grad, scale):
+    if isinstance(grad, tf.IndexedSlices):
+        return tf.IndexedSlices(grad.values * scale, grad.indices, grad.dense_shape)
+    return grad * scale
+
+
+class DynamicLossScale:
+    ''' Loss scaling for float16 training. The loss is multiplied by the scale before
+    the gradients are computed, and the gradients are divided by it before they are
+    applied. The update is skipped and the scale halved when a gradient overflows,
+    the scale is doubled after increment_period steps without overflow.'''
+    def __init__(self, initial_scale=2.**15, increment_period=2000, multiplier=2., name='loss_scale'):
+        with tf.variable_scope(None, default_name=name):
+            self.scale = tf.Variable(float(initial_scale), trainable=False, dtype=tf.float32, name='scale')
+            self.good_steps = tf.Variable(0, trainable=False, dtype=tf.int32, name='good_steps')
+        self.increment_period = increment_period
+        self.multiplier = multiplier
+
+    def scale_loss(self, loss):
+        return tf.cast(loss, tf.float32) * self.scale
+
+    def unscale(self, grads):
+        return [None if g is None else scale_gradient(g, 1. / self.scale) for g in grads]
+
+    def apply(self, grads, apply_fn):
+        ''' Run apply_fn() (which builds the update op) only if all the unscaled
+        grads are finite and update the scale.'''
+        finite = tf.reduce_all([tf.reduce_all(tf.is_finite(gradient_values(g))) for g in grads if g is not None])
+        apply_op = tf.cond(finite, lambda: tf.group(*apply_fn()), tf.no_op)
+
+        def increase():
+            increment = tf.greater_equal(self.good_steps + 1, self.increment_period)
+            new_scale = tf.where(increment, self.scale * self.multiplier, self.scale)
+            new_steps = tf.where(increment, 0, self.good_steps + 1)
+            return tf.group(tf.assign(self.scale, new_scale), tf.assign(self.good_steps, new_steps))
+        def decrease():
+            new_scale = tf.maximum(1., self.scale / self.multiplier)
+            return tf.group(tf.assign(self.scale, new_scale), tf.assign(self.good_steps, 0))
+        with tf.control_dependencies([apply_op]):
+            update_op = tf.cond(finite, increase, decrease)
+        return tf.group(apply_op, update_op)
+
+
+class GradientAccumulator:
+    ''' Sum the gradients of accumulation_steps micro-batches into variables. The
+    mean gradients are applied, and the sums reset, once every accumulation_steps
+    runs of the op returned by apply.'''
+    def __init__(self, variables, accumulation_steps, name='gradient_accumulator'):
+        self.accumulation_steps = accumulation_steps
+        with tf.variable_scope(None, default_name=name):
+            self.counter = tf.Variable(0, trainable=False, dtype=tf.int32, name='counter')
+            self.sums = [tf.Variable(tf.zeros(v.shape, v.dtype.base_dtype), trainable=False,
+                name=v.op.name.replace('/', '_')) for v in variables]
+
+    def apply(self, grads, apply_fn):
+        ''' apply_fn(mean_grads) builds the update from the mean of the accumulated grads.'''
+        assert len(grads) == len(self.sums)
+        accumulate_ops = []
+        for grad, grad_sum in zip(grads, self.sums):
+            if isinstance(grad, tf.IndexedSlices):
+                accumulate_ops.append(tf.scatter_add(grad_sum, grad.indices, grad.values))
+            elif grad is not None:
+                accumulate_ops.append(tf.assign_add(grad_sum, grad))
+        with tf.control_dependencies(accumulate_ops):
+            counter = tf.assign_add(self.counter, 1)
+
+        def apply_and_reset():
+            with tf.control_dependencies([counter]):
+                mean_grads = [None if grad is None else grad_sum.read_value() / self.accumulation_steps \
+                    for grad, grad_sum in zip(grads, self.sums)]
+            with tf.control_dependencies([apply_fn(mean_grads)]):
+                reset_ops = [tf.assign(grad_sum, tf.zeros_like(grad_sum)) for grad_sum in self.sums]
+                reset_ops.append(tf.assign(self.counter, 0))
+            return tf.group(*reset_ops)
+        return tf.cond(tf.greater_equal(counter, self.accumulation_steps), apply_and_reset, tf.no_op)
+
+
+def minimize(optimizer, loss, var_list, loss_scale=None, accumulation_steps=1):
+    ''' optimizer.minimize, with the loss scaled by loss_scale (a DynamicLossScale) if given
+    and the gradients of accumulation_steps runs accumulated before they are applied.
+    loss can be the list of the losses of the towers, their gradients are averaged.'''
+    tower_losses = loss if type(loss) is list else [loss]
+    if loss_scale is None and accumulation_steps == 1 and len(tower_losses) == 1:
+        return optimizer.minimize(tower_losses[0], var_list=var_list)
+    if loss_scale is not None:
+        tower_losses = [loss_scale.scale_loss(tower_loss) for tower_loss in tower_losses]
+    # The gradients of each tower are computed on the device of the tower
+    tower_grads = [tf.gradients(tower_loss, var_list, colocate_gradients_with_ops=True) \
+        for tower_loss in tower_losses]
+    grads_vars = [(g, v) for g, v in zip(average_grads(tower_grads), var_list) if g is not None]
+    grads, variables = [g for g, v in grads_vars], [v for g, v in grads_vars]
+    if loss_scale is not None:
+        grads = loss_scale.unscale(grads)
+
+    def apply_fn(grads):
+        apply_gradients = lambda: [optimizer.apply_gradients(list(zip(grads, variables)))]
+        if loss_scale is not None:
+            return loss_scale.apply(grads, apply_gradients)
+        return tf.group(*apply_gradients())
+    if accumulation_steps > 1:
+        return GradientAccumulator(variables, accumulation_steps).apply(grads, apply_fn)
+    return apply_fn(grads)
+
+
+def apply_gradient(update_gradient_vars, grads, optimizer, learning_rate, learning_rate_multipliers=None,
+        loss_scale=None, accumulation_steps=1):
+    ''' loss_scale: a DynamicLossScale if the grads were computed from a scaled loss.
+        accumulation_steps: number of runs (micro-batches) whose gradients are
+            accumulated, the mean gradient is applied every accumulation_steps runs.'''
     assert(len(grads)==len(update_gradient_vars))
+    if loss_scale is not None:
+        grads = loss_scale.unscale(grads)
     if learning_rate_multipliers is None: learning_rate_multipliers = {}
     # Build a dictionary to save multiplier config
-    # format -> {scope_name: ((grads, vars), lr_multi)}
+    # format -> {scope_name: (indices of (grads, vars), lr_multi)}
     learning_rate_dict = {}
     learning_rate_dict['__default__'] = ([], 1.0)
     for scope, multiplier in learning_rate_multipliers.items():
@@ -55,7 +221,7 @@ def apply_gradient(update_gradient_vars, grads, optimizer, learning_rate, learni
 
     # Scan all the variables, insert into dict
     scopes = learning_rate_dict.keys()
-    for var, grad in zip(update_gradient_vars, grads):
+    for index, (var, grad) in enumerate(zip(update_gradient_vars, grads)):
         count = 0
         scope_temp = ''
         for scope in scopes:
@@ -65,13 +231,13 @@ def apply_gradient(update_gradient_vars, grads, optimizer, learning_rate, learni
         assert count <= 1, "More than one multiplier scopes appear in variable: %s" % var.name
         if count == 0: scope_temp = '__default__'
         if grad is not None:
-            learning_rate_dict[scope_temp][0].append((grad, var))
+            learning_rate_dict[scope_temp][0].append(index)
      
     # Build a optimizer for each multiplier scope
-    apply_gradient_ops = []
+    scope_optimizers = []
     print('\nLearning rate multipliers:')
     for scope, scope_content in learning_rate_dict.items():
-        scope_grads_vars, multiplier = scope_content
+        scope_indices, multiplier = scope_content
         if type(multiplier) is tuple:
             optimizer_name, optimizer_params, scope_multiplier = multiplier
         else:
@@ -79,10 +245,10 @@ def apply_gradient(update_gradient_vars, grads, optimizer, learning_rate, learni
             scope_multiplier = multiplier
         scope_learning_rate = scope_multiplier * learning_rate
         
-        skipped = len(scope_grads_vars) == 0 or scope_multiplier == 0
+        skipped = len(scope_indices) == 0 or scope_multiplier == 0
         warning = '\033[92m (SKIPPED)\033[0m' if skipped else ''
         print('{}{}:\n--#variables: {}\n--optimizer:{}\n--lr_multi: {}'.format(
-            scope, warning, len(scope_grads_vars), (optimizer_name, optimizer_params), scope_multiplier))
+            scope, warning, len(scope_indices), (optimizer_name, optimizer_params), scope_multiplier))
         if skipped: continue
         if optimizer_name=='ADAGRAD':
             opt = tf.train.AdagradOptimizer(scope_learning_rate, **optimizer_params)
@@ -98,9 +264,27 @@ def apply_gradient(update_gradient_vars, grads, optimizer, learning_rate, learni
             opt = tf.train.GradientDescentOptimizer(scope_learning_rate)
         else:
             raise ValueError('Invalid optimization algorithm')
-        apply_gradient_ops.append(opt.apply_gradients(scope_grads_vars))
+        scope_optimizers.append((opt, scope_indices))
     print('')
-    apply_gradient_op = tf.group(*apply_gradient_ops)
+
+    def apply_fn(grads):
+        apply_gradients = lambda: [opt.apply_gradients([(grads[i], update_gradient_vars[i]) for i in scope_indices]) \
+            for opt, scope_indices in scope_optimizers]
+        if loss_scale is not None:
+            return loss_scale.apply(grads, apply_gradients)
+        return tf.group(*apply_gradients())
+
+    if accumulation_steps > 1:
+        used = [i for i, grad in enumerate(grads) if grad is not None]
+        accumulator = GradientAccumulator([update_gradient_vars[i] for i in used], accumulation_steps)
+        def apply_used(used_grads):
+            grads_full = [None] * len(grads)
+            for i, grad in zip(used, used_grads):
+                grads_full[i] = grad
+            return apply_fn(grads_full)
+        apply_gradient_op = accumulator.apply([grads[i] for i in used], apply_used)
+    else:
+        apply_gradient_op = apply_fn(grads)
 
     return apply_gradient_op
 
@@ -116,6 +300,133 @@ def save_model(sess, saver, model_dir, global_step):
             print('Saving metagraph...')
             saver.export_meta_graph(metagraph_path)
 
+class AsyncCheckpointWriter:
+    ''' Save checkpoints without blocking the training loop. save() only copies the
+    variable values to host memory, they are written by a background thread into a
+    copy of the variables in a separate graph. The checkpoints are the same as the
+    ones of save_model. Only the last keep_last (None for all) checkpoints and the keep_best ones
+    with the lowest metric (e.g. the EER) are kept; the best one is also recorded in
+    the 'checkpoint_best' state file:
+        tf.train.latest_checkpoint(model_dir, latest_filename='checkpoint_best')'''
+    def __init__(self, sess, saver, var_list, model_dir, keep_last=5, keep_best=1, max_pending=2):
+        assert keep_last is None or keep_last >= 1, 'The last checkpoint must be kept'
+        self.sess = sess
+        self.saver = saver
+        self.var_list = list(var_list)
+        self.model_dir = model_dir
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.checkpoints = [] # [global_step, path, metric]
+        self.pending_metrics = {} # global_step -> metric of checkpoints not written yet
+        self.durations = []
+        self.error = None
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.copies = [tf.Variable(tf.zeros(var.shape, var.dtype.base_dtype), trainable=False) \
+                for var in self.var_list]
+            self.copy_saver = tf.train.Saver({var.op.name: copy for var, copy in zip(self.var_list, self.copies)},
+                max_to_keep=None)
+        self.copy_sess = tf.Session(graph=self.graph)
+        self.copy_sess.run([copy.initializer for copy in self.copies])
+
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._write_loop)
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)
+
+    def save(self, global_step, metric=None):
+        ''' Snapshot the variables, the checkpoint is written in the background.'''
+        self._check_error()
+        metagraph_path = os.path.join(self.model_dir, 'graph.meta')
+        if not os.path.exists(metagraph_path):
+            print('Saving metagraph...')
+            with self.sess.graph.as_default():
+                self.saver.export_meta_graph(metagraph_path)
+        start_time = time.time()
+        values = self.sess.run(self.var_list)
+        snapshot_time = time.time() - start_time
+        self.queue.put((int(global_step), values, metric, snapshot_time))
+
+    def update_metric(self, global_step, metric):
+        ''' Set the metric of a checkpoint saved before, e.g. when it is evaluated later.'''
+        with self.lock:
+            for checkpoint in self.checkpoints:
+                if checkpoint[0] == int(global_step):
+                    checkpoint[2] = metric
+                    self._apply_retention()
+                    return
+            # The checkpoint is still queued or being written, the metric
+            # is set when the writer adds it
+            self.pending_metrics[int(global_step)] = metric
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                global_step, values, metric, snapshot_time = item
+                start_time = time.time()
+                for copy, value in zip(self.copies, values):
+                    copy.load(value, self.copy_sess)
+                path = self.copy_saver.save(self.copy_sess, os.path.join(self.model_dir, 'ckpt'),
+                    global_step=global_step, write_meta_graph=False, write_state=False)
+                write_time = time.time() - start_time
+                with self.lock:
+                    self.durations.append((snapshot_time, write_time))
+                    metric = self.pending_metrics.pop(global_step, metric)
+                    self.checkpoints.append([global_step, path, metric])
+                    self._apply_retention()
+                print('Saved checkpoint %s (snapshot %.3fs, write %.2fs in background)' % \
+                    (path, snapshot_time, write_time))
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _apply_retention(self):
+        last = self.checkpoints if self.keep_last is None else self.checkpoints[-self.keep_last:]
+        keep = set([checkpoint[1] for checkpoint in last])
+        rated = [checkpoint for checkpoint in self.checkpoints if checkpoint[2] is not None]
+        best = sorted(rated, key=lambda checkpoint: checkpoint[2])[:self.keep_best]
+        keep.update([checkpoint[1] for checkpoint in best])
+        for checkpoint in self.checkpoints:
+            if checkpoint[1] not in keep:
+                for filename in gfile.Glob(checkpoint[1] + '.*'):
+                    gfile.Remove(filename)
+        self.checkpoints = [checkpoint for checkpoint in self.checkpoints if checkpoint[1] in keep]
+        tf.train.update_checkpoint_state(self.model_dir, self.checkpoints[-1][1],
+            [checkpoint[1] for checkpoint in self.checkpoints])
+        if len(best) > 0:
+            tf.train.update_checkpoint_state(self.model_dir, best[0][1], [best[0][1]],
+                latest_filename='checkpoint_best')
+
+    def _check_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def stats(self):
+        ''' Mean and maximum snapshot (blocking) and write (background) durations.'''
+        with self.lock:
+            durations = np.array(self.durations).reshape(-1, 2)
+        if len(durations) == 0:
+            return {'num_checkpoints': 0}
+        return {'num_checkpoints': len(durations),
+            'snapshot_mean': durations[:,0].mean(), 'snapshot_max': durations[:,0].max(),
+            'write_mean': durations[:,1].mean(), 'write_max': durations[:,1].max()}
+
+    def close(self):
+        ''' Wait for the pending checkpoints to be written.'''
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self._check_error()
+
+
 def restore_model(sess, var_list, model_dir, restore_scopes=None, replace=None):
     ''' Load the variable values from a checkpoint file into pre-defined graph.
     Filter the variables so that they contain at least one of the given keywords.'''
@@ -137,19 +448,48 @@ def restore_model(sess, var_list, model_dir, restore_scopes=None, replace=None):
         saver = tf.train.Saver(var_list)
         saver.restore(sess, ckpt_file)
 
-def load_model(sess, model_path, scope=None, ckpt_file=None):
+BUNDLE_FILENAME = 'inference.bundle'
+_BUNDLE_MAGIC = b'UNIFADB1'
+_BUNDLE_ALIGNMENT = 64
+
+def _align(offset):
+    return (offset + _BUNDLE_ALIGNMENT - 1) // _BUNDLE_ALIGNMENT * _BUNDLE_ALIGNMENT
+
+def load_model(sess, model_path, scope=None, ckpt_file=None, use_bundle=True):
     ''' Load the the graph and variables values from a model path.
-    Model path is either a a frozen graph or a directory with both
-    a .meta file and checkpoint files.'''
+    Model path is either a a frozen graph, an inference bundle or a directory with both
+    a .meta file and checkpoint files. If the directory has an inference bundle that is
+    not older than the checkpoint, the bundle is loaded instead (unless use_bundle is False).
+    Returns the duration of each loading stage in seconds.'''
+    timings = {}
+    last_time = [time.time()]
+    def lap(stage):
+        now = time.time()
+        timings[stage] = timings.get(stage, 0.0) + now - last_time[0]
+        last_time[0] = now
+
     with sess.graph.as_default():
         model_path = os.path.expanduser(model_path)
-        if (os.path.isfile(model_path)):
+        bundle_file = os.path.join(model_path, BUNDLE_FILENAME)
+        if os.path.isdir(model_path) and use_bundle and ckpt_file is None and os.path.isfile(bundle_file):
+            latest = tf.train.latest_checkpoint(model_path)
+            if latest is None or os.path.getmtime(bundle_file) >= os.path.getmtime(latest + '.index'):
+                model_path = bundle_file
+            else:
+                print('Inference bundle is older than %s, loading the checkpoint' % latest)
+            lap('find')
+        if model_path.endswith('.bundle'):
+            print('Inference bundle: %s' % model_path)
+            load_bundle(sess, model_path, lap)
+        elif (os.path.isfile(model_path)):
             # Frozen grpah
             print('Model filename: %s' % model_path)
             with gfile.FastGFile(model_path,'rb') as f:
                 graph_def = tf.GraphDef()
                 graph_def.ParseFromString(f.read())
+                lap('read')
                 tf.import_graph_def(graph_def, name='')
+                lap('import')
         else:
             # Load grapha and variables separatedly.
             meta_files = [file for file in os.listdir(model_path) if file.endswith('.meta')]
@@ -162,5 +502,241 @@ def load_model(sess, model_path, scope=None, ckpt_file=None):
             # ckpt_file = 'log/sigmoid/global_sigmoid_cross_entropy_Replay_[112, 112]/20200326-224329/checkpoint'
             print('Metagraph file: %s' % meta_file)
             print('Checkpoint file: %s' % ckpt_file)
+            lap('find')
             saver = tf.train.import_meta_graph(meta_file, clear_devices=True, import_scope=scope)
+            lap('import')
             saver.restore(sess, ckpt_file)
+            lap('restore')
+    print('Model loaded in %.3f seconds (%s)' % (sum(timings.values()),
+        ', '.join(['%s %.3fs' % item for item in timings.items()])))
+    return timings
+
+def export_bundle(sess, output_file, inputs, outputs, constants=None, minimum_size=1024):
+    ''' Write an inference bundle: the optimized inference graph of export_frozen_graph
+    followed by its weights in a single file. The constants with at least minimum_size
+    elements are stored as raw aligned arrays outside of the graph, so that loading
+    only parses the small graph and the weights are memory-mapped.'''
+    from .graph_ops import optimize_for_inference
+    outputs = name_outputs(sess.graph, outputs)
+    graph_def = optimize_for_inference(sess, list(outputs.keys()), constants)
+    arrays = []
+    variables = []
+    offset = 0
+    for node in graph_def.node:
+        if node.op != 'Const':
+            continue
+        dtype = tf.as_dtype(node.attr['dtype'].type)
+        if dtype == tf.string:
+            continue
+        value = tensor_util.MakeNdarray(node.attr['value'].tensor)
+        if value.size < minimum_size:
+            continue
+        value = np.ascontiguousarray(value)
+        variables.append({'name': node.name, 'dtype': value.dtype.str,
+            'shape': list(value.shape), 'offset': offset})
+        arrays.append(value)
+        offset = _align(offset + value.nbytes)
+        # The weights are fed in place of the constant when the bundle is loaded
+        node.op = 'Placeholder'
+        node.attr.clear()
+        node.attr['dtype'].type = dtype.as_datatype_enum
+        node.attr['shape'].shape.CopyFrom(tf.TensorShape(value.shape).as_proto())
+    graph_bytes = graph_def.SerializeToString()
+    header = json.dumps({'graph_def': [offset, len(graph_bytes)], 'variables': variables,
+        'inputs': [tensor.name for tensor in inputs], 'outputs': list(outputs.keys())}).encode()
+    data_start = _align(len(_BUNDLE_MAGIC) + 8 + len(header))
+    output_file = os.path.expanduser(output_file)
+    with open(output_file, 'wb') as f:
+        f.write(_BUNDLE_MAGIC + struct.pack('<Q', len(header)) + header)
+        for variable, value in zip(variables, arrays):
+            f.seek(data_start + variable['offset'])
+            f.write(value.tobytes())
+        f.seek(data_start + offset)
+        f.write(graph_bytes)
+    print('%d ops and %d weights (%.1f MB) in the inference bundle, saved to %s' % (len(graph_def.node),
+        len(variables), offset / 2**20, output_file))
+    return graph_def
+
+def load_bundle(sess, bundle_file, lap=None):
+    ''' Import the graph of an inference bundle written by export_bundle into the graph of
+    the session and initialize its weights from the memory-mapped file with a single run.'''
+    if lap is None: lap = lambda stage: None
+    with open(os.path.expanduser(bundle_file), 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    assert buffer[:len(_BUNDLE_MAGIC)] == _BUNDLE_MAGIC, '%s is not an inference bundle' % bundle_file
+    header_size, = struct.unpack('<Q', buffer[len(_BUNDLE_MAGIC):len(_BUNDLE_MAGIC)+8])
+    header_start = len(_BUNDLE_MAGIC) + 8
+    header = json.loads(buffer[header_start:header_start+header_size].decode())
+    data_start = _align(header_start + header_size)
+    graph_offset, graph_size = header['graph_def']
+    graph_def = tf.GraphDef()
+    graph_def.ParseFromString(buffer[data_start+graph_offset:data_start+graph_offset+graph_size])
+    lap('read')
+    with sess.graph.as_default():
+        input_map = {}
+        initializers = []
+        feed_dict = {}
+        with tf.name_scope('bundle'):
+            for i, variable in enumerate(header['variables']):
+                dtype = np.dtype(variable['dtype'])
+                shape = variable['shape']
+                # The pages of the file are only read when the values are fed
+                value = np.frombuffer(buffer, dtype=dtype, count=int(np.prod(shape)),
+                    offset=data_start+variable['offset']).reshape(shape)
+                placeholder = tf.placeholder(dtype, shape)
+                var = tf.Variable(placeholder, trainable=False, collections=[], name='weight_%d' % i)
+                input_map[variable['name'] + ':0'] = var.value()
+                initializers.append(var.initializer)
+                feed_dict[placeholder] = value
+        tf.import_graph_def(graph_def, input_map=input_map, name='')
+        lap('import')
+        sess.run(initializers, feed_dict=feed_dict)
+        lap('restore')
+
+def get_tensor_by_names(graph, names):
+    ''' Return the first tensor in the graph that matches one of the names.
+    Return None if none of them exists (e.g. phase_train in a frozen graph).'''
+    for name in names:
+        try:
+            return graph.get_tensor_by_name(name)
+        except KeyError:
+            continue
+    return None
+
+def name_outputs(graph, outputs):
+    ''' Give the output tensors fixed node names so that they can be found
+    in an exported graph. outputs is a dict of {name: tensor}.'''
+    with graph.as_default():
+        named = {}
+        for name, tensor in outputs.items():
+            if tensor.op.name != name:
+                tensor = tf.identity(tensor, name=name)
+                assert tensor.op.name == name, 'Node name %s is already used in the graph!' % name
+            named[name] = tensor
+    return named
+
+def _const_node(name, value, dtype):
+    node = tf.NodeDef()
+    node.op = 'Const'
+    node.name = name
+    node.attr['dtype'].type = dtype.as_datatype_enum
+    node.attr['value'].tensor.CopyFrom(tensor_util.make_tensor_proto(value, dtype=dtype))
+    return node
+
+def _bool_value(node_map, tensor_name):
+    # Follow the identity chain (e.g. cond/pred_id) back to a boolean constant.
+    name = tensor_name.split(':')[0]
+    while name in node_map and node_map[name].op == 'Identity':
+        name = node_map[name].input[0].split(':')[0]
+    node = node_map.get(name)
+    if node is None or node.op != 'Const' or node.attr['dtype'].type != tf.bool.as_datatype_enum:
+        return None
+    return bool(tensor_util.MakeNdarray(node.attr['value'].tensor))
+
+def resolve_conditionals(graph_def):
+    ''' Remove the tf.cond branches whose predicate is a constant.
+    Switch outputs on the dead side and everything depending on them are
+    removed, Merge nodes are replaced by an Identity of their live input.'''
+    from .graph_ops import parse_input, topological_order
+    node_map = {node.name: node for node in graph_def.node}
+    live_port = {}
+    for node in graph_def.node:
+        if node.op in ['Switch', 'RefSwitch']:
+            pred = _bool_value(node_map, node.input[1])
+            if pred is not None:
+                live_port[node.name] = 1 if pred else 0
+
+    order = topological_order(graph_def)
+
+    def is_dead(inp):
+        name, port, control = parse_input(inp)
+        if name in dead:
+            return True
+        return not control and name in live_port and port != live_port[name]
+
+    def bypass(inp):
+        name, port, control = parse_input(inp)
+        while name in live_port:
+            inp = node_map[name].input[0]
+            name, port, control = parse_input(inp)
+        return inp
+
+    # Propagate deadness from the dead switch outputs
+    dead = set()
+    for name in order:
+        node = node_map[name]
+        data_inputs = [inp for inp in node.input if not inp.startswith('^')]
+        if node.op in ['Merge', 'RefMerge']:
+            if all([is_dead(inp) for inp in data_inputs]):
+                dead.add(name)
+        elif any([is_dead(inp) for inp in node.input]):
+            dead.add(name)
+
+    output_graph_def = tf.GraphDef()
+    output_graph_def.versions.CopyFrom(graph_def.versions)
+    output_graph_def.library.CopyFrom(graph_def.library)
+    for node in graph_def.node:
+        if node.name in dead:
+            continue
+        new_node = output_graph_def.node.add()
+        new_node.CopyFrom(node)
+        if node.op in ['Merge', 'RefMerge']:
+            live_inputs = [inp for inp in node.input if not inp.startswith('^') and not is_dead(inp)]
+            if len(live_inputs) == 1:
+                new_node.op = 'Identity'
+                del new_node.input[:]
+                new_node.input.append(bypass(live_inputs[0]))
+                del new_node.attr['N']
+                continue
+        inputs = []
+        for inp in node.input:
+            name, port, control = parse_input(inp)
+            if name in live_port:
+                if control:
+                    continue
+                inp = bypass(inp)
+            inputs.append(inp)
+        del new_node.input[:]
+        new_node.input.extend(inputs)
+    return output_graph_def
+
+def freeze_graph_def(sess, output_names, constants=None):
+    ''' Convert the variables into constants and keep only the nodes that are needed
+    to compute the outputs. constants is a dict of {placeholder_name: value}, those
+    placeholders (e.g. phase_train, keep_prob) are replaced by fixed values and the
+    conditionals depending on them are resolved.'''
+    if constants is None: constants = {}
+    graph_def = sess.graph.as_graph_def()
+    for node in graph_def.node:
+        if node.name in constants:
+            assert node.op == 'Placeholder', '%s is not a placeholder' % node.name
+            dtype = tf.as_dtype(node.attr['dtype'].type)
+            node.CopyFrom(_const_node(node.name, constants[node.name], dtype))
+        # Moving average updates cannot be applied to constants
+        elif node.op == 'AssignSub':
+            node.op = 'Sub'
+            if 'use_locking' in node.attr: del node.attr['use_locking']
+        elif node.op == 'AssignAdd':
+            node.op = 'Add'
+            if 'use_locking' in node.attr: del node.attr['use_locking']
+    graph_def = resolve_conditionals(graph_def)
+    graph_def = tf.graph_util.convert_variables_to_constants(sess, graph_def, output_names)
+    graph_def = tf.graph_util.remove_training_nodes(graph_def, protected_nodes=output_names)
+    return graph_def
+
+def export_frozen_graph(sess, output_file, inputs, outputs, constants=None, optimize=True):
+    ''' Write a frozen inference graph that can be loaded by load_model.
+    inputs is a list of input tensors and outputs is a dict of {name: tensor},
+    the outputs are renamed as their keys in the exported graph.'''
+    outputs = name_outputs(sess.graph, outputs)
+    output_names = list(outputs.keys())
+    if optimize:
+        from .graph_ops import optimize_for_inference
+        graph_def = optimize_for_inference(sess, output_names, constants)
+    else:
+        graph_def = freeze_graph_def(sess, output_names, constants)
+    output_file = os.path.expanduser(output_file)
+    with gfile.GFile(output_file, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    print('%d ops in the frozen graph, saved to %s' % (len(graph_def.node), output_file))
+    return graph_def
@@ -0,0 +1,102 @@
+"""Post-training quantization of a frozen detector graph
+"""
+# MIT License
+# 
+# Copyright (c) 2022 Debayan Deb
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.platform import gfile
+import utils
+import evaluation
+from nntools.common.dataset import Dataset
+from nntools.common.imageprocessing import preprocess
+from nntools.tensorflow import graph_ops
+
+output_candidates = ['predicted', 'adversarial', 'digital', 'physical', 'trunk', 'embeddings']
+
+def evaluate(network, images, labels, batch_size):
+    network.extract_feature(images[:1])
+    start_time = time.time()
+    scores = network.extract_feature(images, batch_size=batch_size)[:,0]
+    latency = 1000 * (time.time() - start_time) / len(images)
+    live_scores = scores[labels == 0].tolist()
+    spoof_scores = scores[labels != 0].tolist()
+    eer, _, tdr = evaluation.eer(live_scores, spoof_scores)
+    return eer, tdr, latency
+
+def main(args):
+    config, Network = utils.load_network_config(args.model_path, args.network)
+    frozen_graph = args.frozen_graph or os.path.join(args.model_path, 'frozen_graph.pb')
+    output_file = args.output_file or os.path.splitext(frozen_graph)[0] + '_%s.pb' % args.mode
+
+    with gfile.GFile(frozen_graph, 'rb') as f:
+        graph_def = tf.GraphDef()
+        graph_def.ParseFromString(f.read())
+    node_names = set([node.name for node in graph_def.node])
+    output_names = [name for name in output_candidates if name in node_names]
+
+    dataset = Dataset(args.dataset_path)
+    images = preprocess(dataset.images, config, False)
+    labels = np.array(dataset.labels)
+
+    if args.mode == 'float16':
+        graph_def = graph_ops.quantize_weights_float16(graph_def)
+    else:
+        graph_def = graph_ops.quantize_graph_int8(graph_def, ['image_batch'], output_names)
+        calibration = images[np.random.permutation(len(images))[:args.num_calibration]]
+        batches = [calibration[i:i+args.batch_size] for i in range(0, len(calibration), args.batch_size)]
+        graph_def = graph_ops.calibrate_int8_ranges(graph_def, 'image_batch', batches, output_names)
+    with gfile.GFile(output_file, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    print('Quantized graph saved to %s (%.1f MB -> %.1f MB)' % (output_file,
+        os.path.getsize(frozen_graph) / 2**20, os.path.getsize(output_file) / 2**20))
+
+    for name, path in [('float32', frozen_graph), (args.mode, output_file)]:
+        network = Network()
+        network.load_model(path)
+        eer, tdr, latency = evaluate(network, images, labels, args.batch_size)
+        print('{}: EER = {}%, TDR = {}%, {:.2f} ms per image'.format(name, eer * 100, tdr * 100, latency))
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model_path", help="The path to the model directory with config.py",
+                        type=str)
+    parser.add_argument("dataset_path", help="The dataset directory or list file used for calibration and evaluation",
+                        type=str)
+    parser.add_argument("--frozen_graph", help="The frozen graph written by export_detector.py, default: <model_path>/frozen_graph.pb",
+                        type=str, default=None)
+    parser.add_argument("--output_file", help="The path of the quantized graph, default: <frozen_graph>_<mode>.pb",
+                        type=str, default=None)
+    parser.add_argument("--mode", help="Quantize the weights to float16 or the weights and activations to int8",
+                        type=str, choices=['int8', 'float16'], default='int8')
+    parser.add_argument("--num_calibration", help="Number of images used to calibrate the int8 activation ranges",
+                        type=int, default=300)
+    parser.add_argument("--batch_size", help="Batch size for calibration and evaluation",
+                        type=int, default=64)
+    parser.add_argument("--network", help="Type of the detector, inferred from the config by default",
+                        type=str, choices=['joint', 'chimney'], default=None)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,208 @@
+"""Score a folder or a list file in fixed-size chunks with bounded memory
+"""
+# MIT License
+# 
+# Copyright (c) 2022 Debayan Deb
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import sys
+import time
+import csv
+import argparse
+import itertools
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import utils
+from nntools.common.imageprocessing import preprocess
+from nntools.tensorflow.networks import InferencePool
+
+def iter_images(path):
+    ''' Yield (image_path, label) from a folder (walked in sorted order) or from a
+    list file in the format "fullpath(str) label(int)", without loading the whole list.'''
+    path = os.path.expanduser(path)
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for file in sorted(files):
+                yield os.path.join(root, file), ''
+    else:
+        with open(path, 'r') as f:
+            for line in f:
+                line = line.strip().split(' ')
+                if len(line[0]) > 0:
+                    yield line[0], line[-1] if len(line) > 1 else ''
+
+def iter_chunks(iterable, chunk_size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+def load_chunk(chunk, config):
+    ''' Preprocess a chunk, the images that cannot be decoded are dropped and
+    their indices returned.'''
+    paths = [image_path for image_path, _ in chunk]
+    try:
+        return preprocess(paths, config, False), []
+    except Exception:
+        images, failed = [], []
+        for i, image_path in enumerate(paths):
+            try:
+                images.append(preprocess([image_path], config, False)[0])
+            except Exception:
+                failed.append(i)
+        images = np.stack(images) if len(images) > 0 else None
+        return images, failed
+
+def count_lines(filename, block_size=2**20):
+    ''' Number of complete rows in a CSV output, dropping a partially written last row.'''
+    num_lines, position, last_newline = 0, 0, -1
+    with open(filename, 'rb+') as f:
+        while True:
+            block = f.read(block_size)
+            if len(block) == 0:
+                break
+            num_lines += block.count(b'\n')
+            if b'\n' in block:
+                last_newline = position + block.rfind(b'\n')
+            position += len(block)
+        if last_newline + 1 < position:
+            f.truncate(last_newline + 1)
+    return max(0, num_lines - 1)
+
+class CSVWriter:
+    def __init__(self, filename, heads, resume):
+        self.num_done = count_lines(filename) if resume and os.path.exists(filename) else 0
+        self.file = open(filename, 'a' if self.num_done > 0 else 'w', newline='')
+        # Paths with commas or quotes are quoted
+        self.writer = csv.writer(self.file, lineterminator='\n')
+        if self.num_done == 0:
+            self.writer.writerow(['path', 'label'] + heads)
+
+    def write(self, chunk, scores):
+        for (image_path, label), score in zip(chunk, scores):
+            self.writer.writerow([image_path, label] + ['%.6f' % s for s in score])
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class NPYWriter:
+    ''' Scores in a memory-mapped .npy file, the number of scored images is kept
+    in <filename>.progress for resuming. The image paths are in the input order.'''
+    def __init__(self, filename, heads, resume, num_images):
+        self.progress_file = filename + '.progress'
+        if resume and os.path.exists(filename) and os.path.exists(self.progress_file):
+            self.scores = np.load(filename, mmap_mode='r+')
+            assert self.scores.shape == (num_images, len(heads)), 'The output does not match the input'
+            with open(self.progress_file, 'r') as f:
+                self.num_done = int(f.read().strip())
+        else:
+            self.scores = np.lib.format.open_memmap(filename, mode='w+', dtype=np.float32,
+                shape=(num_images, len(heads)))
+            self.num_done = 0
+        self.position = self.num_done
+
+    def write(self, chunk, scores):
+        self.scores[self.position:self.position+len(chunk)] = scores
+        self.scores.flush()
+        self.position += len(chunk)
+        with open(self.progress_file, 'w') as f:
+            f.write('%d\n' % self.position)
+
+    def close(self):
+        self.scores.flush()
+
+def main(args):
+    config, Network = utils.load_network_config(args.model_path, args.network)
+    pool = InferencePool(Network, args.frozen_graph or args.model_path, batch_size=args.batch_size)
+    heads = [head for head in pool.heads if head != 'embeddings']
+
+    if args.output_file.endswith('.npy'):
+        num_images = sum(1 for _ in iter_images(args.input_path))
+        writer = NPYWriter(args.output_file, heads, args.resume, num_images)
+    else:
+        writer = CSVWriter(args.output_file, heads, args.resume)
+    if writer.num_done > 0:
+        print('Resuming after %d images' % writer.num_done)
+    images = itertools.islice(iter_images(args.input_path), writer.num_done, None)
+
+    # Decode and preprocess the next chunks while the current one is scored
+    executor = ThreadPoolExecutor(max_workers=args.num_workers)
+    pending = collections.deque()
+    chunks = iter_chunks(images, args.chunk_size)
+    num_scored, num_failed = 0, 0
+    start_time = time.time()
+    while True:
+        while len(pending) < args.prefetch:
+            chunk = next(chunks, None)
+            if chunk is None:
+                break
+            pending.append((chunk, executor.submit(load_chunk, chunk, config)))
+        if len(pending) == 0:
+            break
+        chunk, future = pending.popleft()
+        chunk_images, failed = future.result()
+        scores = np.full((len(chunk), len(heads)), np.nan, dtype=np.float32)
+        if chunk_images is not None:
+            results = pool.predict(chunk_images, heads)
+            valid = np.setdiff1d(np.arange(len(chunk)), failed)
+            scores[valid] = np.concatenate([results[head] for head in heads], axis=1)
+        writer.write(chunk, scores)
+        num_scored += len(chunk)
+        num_failed += len(failed)
+        elapsed_time = time.time() - start_time
+        sys.stdout.write('# of images: %d (%d failed) Elapsed time: %s Throughput: %.1f images/s \t\r'
+            % (writer.num_done + num_scored, num_failed,
+            time.strftime('%H:%M:%S', time.gmtime(elapsed_time)), num_scored / elapsed_time))
+        sys.stdout.flush()
+    executor.shutdown()
+    writer.close()
+    print('\n%d images scored in %.1f seconds, saved to %s' % (num_scored, time.time() - start_time, args.output_file))
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model_path", help="The path to the model directory with config.py and the checkpoint",
+                        type=str)
+    parser.add_argument("input_path", help="A folder of images or a list file",
+                        type=str)
+    parser.add_argument("output_file", help="The output .csv (path, label, scores) or .npy (scores) file",
+                        type=str)
+    parser.add_argument("--frozen_graph", help="Score with a frozen graph instead of the checkpoint",
+                        type=str, default=None)
+    parser.add_argument("--network", help="Type of the detector, inferred from the config by default",
+                        type=str, choices=['joint', 'chimney'], default=None)
+    parser.add_argument("--chunk_size", help="Number of images decoded and scored at a time",
+                        type=int, default=1024)
+    parser.add_argument("--batch_size", help="Batch size of the model",
+                        type=int, default=128)
+    parser.add_argument("--prefetch", help="Number of chunks decoded ahead",
+                        type=int, default=2)
+    parser.add_argument("--num_workers", help="Number of threads decoding the chunks",
+                        type=int, default=2)
+    parser.add_argument("--resume", help="Continue a partially written output file",
+                        action='store_true')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,212 @@
+"""Score videos frame by frame with online fusion of the frame scores
+"""
+# MIT License
+# 
+# Copyright (c) 2022 Debayan Deb
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import cv2
+from scipy import stats
+import utils
+import evaluation
+from nntools.common.imageprocessing import preprocess
+
+video_extensions = ['.mp4', '.avi', '.mov', '.mkv', '.webm']
+
+def list_videos(path):
+    ''' (video_path, label) from a folder or a list file "fullpath(str) label(int)".'''
+    path = os.path.expanduser(path)
+    if os.path.isdir(path):
+        videos = []
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            videos.extend([(os.path.join(root, file), None) for file in sorted(files) \
+                if os.path.splitext(file)[1].lower() in video_extensions])
+        return videos
+    with open(path, 'r') as f:
+        lines = [line.strip().split(' ') for line in f if len(line.strip()) > 0]
+    return [(line[0], int(line[-1]) if len(line) > 1 else None) for line in lines]
+
+class VideoScore:
+    ''' Fuse the frame scores of a video online. The decision is final when the
+    fused score is away from the threshold by more than z standard errors of
+    the mean frame score, or with max fusion as soon as a frame is above it.'''
+    def __init__(self, path, label, method='mean', threshold=0.5, z=3.0, min_frames=8, 
+                    trim=0.1):
+        self.path = path
+        self.label = label
+        self.method = method
+        self.threshold = threshold
+        self.z = z
+        self.min_frames = min_frames
+        self.trim = trim
+        self.scores = []
+
+    def add(self, score):
+        self.scores.append(float(score))
+
+    @property
+    def score(self):
+        if len(self.scores) == 0:
+            return np.nan
+        if self.method == 'max':
+            return max(self.scores)
+        elif self.method == 'trimmed_mean':
+            return stats.trim_mean(self.scores, self.trim)
+        else:
+            return np.mean(self.scores)
+
+    def confident(self):
+        if self.z <= 0:
+            return False
+        if self.method == 'max' and len(self.scores) > 0 and max(self.scores) >= self.threshold:
+            return True
+        if len(self.scores) < self.min_frames:
+            return False
+        std_error = np.std(self.scores) / np.sqrt(len(self.scores))
+        return abs(self.score - self.threshold) > self.z * std_error
+
+class VideoReader:
+    ''' Read every stride-th frame of a video, skipped frames are not decoded.'''
+    def __init__(self, path, stride, max_frames=None):
+        self.capture = cv2.VideoCapture(path)
+        self.stride = stride
+        self.max_frames = max_frames
+        self.num_read = 0
+        self.finished = not self.capture.isOpened()
+
+    def read(self):
+        if self.finished or (self.max_frames and self.num_read >= self.max_frames):
+            self.close()
+            return None
+        for _ in range(self.stride - 1):
+            if not self.capture.grab():
+                self.close()
+                return None
+        success, frame = self.capture.read()
+        if not success:
+            self.close()
+            return None
+        self.num_read += 1
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    def close(self):
+        self.finished = True
+        self.capture.release()
+
+def main(args):
+    config, Network = utils.load_network_config(args.model_path, args.network)
+    network = Network()
+    network.load_model(args.frozen_graph or args.model_path)
+
+    videos = list_videos(args.input_path)
+    next_video = 0
+    active = []
+    results = []
+    num_frames = 0
+    start_time = time.time()
+    with open(args.output_file, 'w') as f:
+        f.write('video,label,score,frames,early_stop\n')
+        while next_video < len(videos) or len(active) > 0:
+            while len(active) < args.num_active and next_video < len(videos):
+                path, label = videos[next_video]
+                video = VideoScore(path, label, args.fusion, args.threshold, args.z, args.min_frames)
+                active.append((video, VideoReader(path, args.stride, args.max_frames)))
+                next_video += 1
+
+            # Fill a batch with frames from all active videos in turn
+            frames, owners = [], []
+            while len(frames) < args.batch_size and any(not reader.finished for _, reader in active):
+                for i, (video, reader) in enumerate(active):
+                    frame = reader.read()
+                    if frame is not None:
+                        frames.append(frame)
+                        owners.append(i)
+                    if len(frames) >= args.batch_size:
+                        break
+            if len(frames) > 0:
+                scores = network.extract_feature(preprocess(frames, config, False), batch_size=args.batch_size)
+                for i, score in zip(owners, scores[:,0]):
+                    active[i][0].add(score)
+                num_frames += len(frames)
+
+            still_active = []
+            for video, reader in active:
+                early_stop = not reader.finished and video.confident()
+                if early_stop or reader.finished:
+                    reader.close()
+                    results.append(video)
+                    f.write('%s,%s,%.6f,%d,%d\n' % (video.path, '' if video.label is None else video.label,
+                        video.score, len(video.scores), int(early_stop)))
+                else:
+                    still_active.append((video, reader))
+            active = still_active
+            elapsed_time = time.time() - start_time
+            sys.stdout.write('# of videos: %d/%d Frames: %d Elapsed time: %s (%.1f frames/s) \t\r'
+                % (len(results), len(videos), num_frames,
+                time.strftime('%H:%M:%S', time.gmtime(elapsed_time)), num_frames / elapsed_time))
+            sys.stdout.flush()
+    print('\n%d videos scored with %d frames, saved to %s' % (len(results), num_frames, args.output_file))
+
+    labels = np.array([video.label for video in results])
+    scores = np.array([video.score for video in results])
+    if all([label is not None for label in labels]) and len(np.unique(labels)) > 1:
+        valid = ~np.isnan(scores)
+        live_scores = scores[valid & (labels == 0)].tolist()
+        spoof_scores = scores[valid & (labels != 0)].tolist()
+        eer, _, tdr = evaluation.eer(live_scores, spoof_scores)
+        print('EER = {}%, TDR = {}%'.format(eer * 100, tdr * 100))
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model_path", help="The path to the model directory with config.py and the checkpoint",
+                        type=str)
+    parser.add_argument("input_path", help="A folder of videos or a list file of videos with labels",
+                        type=str)
+    parser.add_argument("output_file", help="The output CSV file of the video scores",
+                        type=str)
+    parser.add_argument("--frozen_graph", help="Score with a frozen graph instead of the checkpoint",
+                        type=str, default=None)
+    parser.add_argument("--network", help="Type of the detector, inferred from the config by default",
+                        type=str, choices=['joint', 'chimney'], default=None)
+    parser.add_argument("--stride", help="Score every stride-th frame",
+                        type=int, default=5)
+    parser.add_argument("--max_frames", help="Maximum number of frames scored per video",
+                        type=int, default=None)
+    parser.add_argument("--fusion", help="Fusion of the frame scores",
+                        type=str, choices=['mean', 'max', 'trimmed_mean'], default='mean')
+    parser.add_argument("--threshold", help="Decision threshold of the fused score",
+                        type=float, default=0.5)
+    parser.add_argument("--z", help="Stop a video when the fused score is z standard errors away from the threshold, 0 to disable",
+                        type=float, default=3.0)
+    parser.add_argument("--min_frames", help="Minimum number of frames before stopping early",
+                        type=int, default=8)
+    parser.add_argument("--num_active", help="Number of videos whose frames are batched together",
+                        type=int, default=16)
+    parser.add_argument("--batch_size", help="Number of frames in a batch",
+                        type=int, default=128)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,117 @@
+"""HTTP inference service with dynamic micro-batching
+"""
+# MIT License
+# 
+# Copyright (c) 2022 Debayan Deb
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import json
+import argparse
+import numpy as np
+import http.server as httpserver
+import utils
+from nntools.common.imageprocessing import preprocess
+from nntools.tensorflow.networks import InferencePool, MicroBatcher
+
+class Handler(httpserver.BaseHTTPRequestHandler):
+    ''' POST /predict with an encoded image as the body returns the scores of
+    all heads as JSON, GET /stats returns the batching statistics.'''
+    batcher = None
+    config = None
+
+    def send_json(self, code, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.split('?')[0] == '/stats':
+            self.send_json(200, self.batcher.stats())
+        else:
+            self.send_json(404, {'error': 'Unknown path %s' % self.path})
+
+    def do_POST(self):
+        if self.path.split('?')[0] != '/predict':
+            self.send_json(404, {'error': 'Unknown path %s' % self.path})
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        data = self.rfile.read(length)
+        try:
+            # Decode in the request thread so that the batches only run the model
+            image = preprocess([data], self.config, False)[0]
+        except Exception as e:
+            self.send_json(400, {'error': 'Cannot decode the image: %s' % str(e)})
+            return
+        try:
+            result = self.batcher.submit(image)
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+            return
+        self.send_json(200, {head: value.tolist() for head, value in result.items()})
+
+    def log_message(self, format, *args):
+        pass
+
+def main(args):
+    config, Network = utils.load_network_config(args.model_path, args.network)
+
+    pool = InferencePool(Network, args.frozen_graph or args.model_path,
+        intra_op_threads=args.intra_op_threads,
+        inter_op_threads=args.inter_op_threads,
+        batch_size=args.max_batch)
+    heads = [head for head in pool.heads if head != 'embeddings']
+    Handler.batcher = MicroBatcher(lambda images: pool.predict(images, heads), 
+        max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000.)
+    Handler.config = config
+
+    server = httpserver.ThreadingHTTPServer((args.host, args.port), Handler)
+    print('Serving %s heads %s on http://%s:%d/predict' % (Network.__name__, heads, args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model_path", help="The path to the model directory with config.py and the checkpoint",
+                        type=str)
+    parser.add_argument("--frozen_graph", help="Serve a frozen graph instead of the checkpoint",
+                        type=str, default=None)
+    parser.add_argument("--network", help="Type of the detector, inferred from the config by default",
+                        type=str, choices=['joint', 'chimney'], default=None)
+    parser.add_argument("--host", help="The address to listen on",
+                        type=str, default='127.0.0.1')
+    parser.add_argument("--port", help="The port to listen on",
+                        type=int, default=8000)
+    parser.add_argument("--max_batch", help="Maximum number of images in a batch",
+                        type=int, default=64)
+    parser.add_argument("--max_wait_ms", help="Maximum time to wait for a batch to fill after its first image",
+                        type=float, default=5.0)
+    parser.add_argument("--intra_op_threads", help="Threads used inside an op, 0 for the TF default",
+                        type=int, default=0)
+    parser.add_argument("--inter_op_threads", help="Threads used to run independent ops, 0 for the TF default",
+                        type=int, default=0)
+    args = parser.parse_args()
+    main(args)
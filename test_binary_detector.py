@@ -36,12 +36,16 @@ def main(args):
     dataset = Dataset('data/examples')
     proc_func = lambda images: preprocess(images, config, False)
     test_images = proc_func(dataset.images)
-    outputs = network.extract_feature(test_images)
+    outputs = network.extract_feature(test_images, tta=args.tta, tta_reduce=args.tta_reduce)
     print(outputs)
 
 if __name__=="__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("model_path", help="The path to the saved checkpoint and model file",
                         type=str)
+    parser.add_argument("--tta", help="Average the scores of flipped or cropped views of each image",
+                        type=str, choices=['flip', 'five_crop', 'ten_crop'], default=None)
+    parser.add_argument("--tta_reduce", help="Reduction of the logits of the views",
+                        type=str, choices=['mean', 'max'], default='mean')
     args = parser.parse_args()
     main(args)
\ No newline at end of file
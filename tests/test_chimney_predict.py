@@ -0,0 +1,47 @@
+"""Branch-selective inference and early exit of ChimneyCNN.predict
+"""
+import numpy as np
+import pytest
+
+
+def toy_network(tf):
+    ''' ChimneyCNN with a toy graph: a linear trunk, three linear branches and
+    their sum as the fused head.'''
+    from nntools.tensorflow.networks import ChimneyCNN
+    network = ChimneyCNN()
+    rng = np.random.RandomState(0)
+    with network.graph.as_default():
+        network.inputs = tf.placeholder(tf.float32, [None, 6], name='image_batch')
+        trunk = tf.identity(tf.matmul(network.inputs, rng.randn(6, 5).astype(np.float32)), name='trunk')
+        network.heads = {'trunk': trunk}
+        for head in ['adversarial', 'digital', 'physical']:
+            network.heads[head] = tf.matmul(trunk, rng.randn(5, 1).astype(np.float32), name=head)
+        network.heads['fused'] = tf.add_n([network.heads[head] for head in ['adversarial', 'digital', 'physical']],
+            name='predicted')
+        network.phase_train_placeholder = None
+        network.keep_prob_placeholder = None
+        network.embeddings = None
+        network.build_head_outputs()
+    return network
+
+def test_early_exit():
+    tf = pytest.importorskip('tensorflow')
+    network = toy_network(tf)
+    images = np.random.RandomState(1).randn(64, 6).astype(np.float32)
+    full = network.predict(images, heads=['fused', 'adversarial', 'physical'], batch_size=16)
+    results = network.predict(images, heads=['fused', 'adversarial'], batch_size=16,
+        early_exit=('physical', 0.2, 0.8))
+    exited = results['exited']
+    assert 0 < exited.sum() < len(images)
+    # The exit head keeps its own score, the fused score of the exited inputs is unknown
+    np.testing.assert_allclose(results['physical'], full['physical'], rtol=1e-5)
+    assert np.all(np.isnan(results['fused'][exited]))
+    assert np.all(np.isnan(results['adversarial'][exited]))
+    np.testing.assert_allclose(results['fused'][~exited], full['fused'][~exited], rtol=1e-5)
+    np.testing.assert_allclose(results['adversarial'][~exited], full['adversarial'][~exited], rtol=1e-5)
+
+def test_early_exit_on_fused():
+    tf = pytest.importorskip('tensorflow')
+    network = toy_network(tf)
+    with pytest.raises(ValueError):
+        network.predict(np.zeros((2, 6), np.float32), early_exit=('fused', 0.2, 0.8))
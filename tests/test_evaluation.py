@@ -0,0 +1,23 @@
+"""Spoof detection metrics of evaluation.evaluate
+"""
+import numpy as np
+import pytest
+
+import evaluation
+
+
+def test_evaluate():
+    scores = np.array([0.1, 0.2, 0.3, 0.4, 0.35, 0.6, 0.7, 0.9, 0.05, 0.95])
+    labels = np.array([0, 0, 0, 0, 1, 1, 1, 2, 2, 2])
+    result = evaluation.evaluate(scores, labels, threshold=0.5)
+    assert result['bpcer'] == 0.
+    assert result['attacks'][1]['apcer'] == pytest.approx(1. / 3)
+    assert result['attacks'][2]['apcer'] == pytest.approx(1. / 3)
+    assert result['apcer'] == pytest.approx(1. / 3)
+    assert result['attacks'][1]['eer'] == pytest.approx(0.25)
+    assert result['attacks'][1]['tdr'][0.002] == pytest.approx(2. / 3)
+
+@pytest.mark.parametrize('labels', [[0, 0, 0], [1, 2, 1], []])
+def test_evaluate_single_class(labels):
+    with pytest.raises(ValueError):
+        evaluation.evaluate(np.linspace(0, 1, len(labels)), labels)
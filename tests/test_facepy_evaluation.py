@@ -0,0 +1,109 @@
+"""Compare the vectorized facepy.evaluation against the previous loop implementation
+"""
+import numpy as np
+import pytest
+
+from facepy import evaluation
+
+
+# Loop implementation before the vectorization, used as the reference
+
+def find_thresholds_by_FAR_loop(score_vec, label_vec, FARs=None, epsilon=10e-8):
+    score_neg = score_vec[~label_vec]
+    score_neg = np.sort(score_neg)[::-1] # score from high to low
+    num_neg = len(score_neg)
+    if FARs is None:
+        epsilon = 10e-5
+        thresholds = np.unique(score_neg)
+        thresholds = np.insert(thresholds, 0, thresholds[0]+epsilon)
+        thresholds = np.insert(thresholds, thresholds.size, thresholds[-1]-epsilon)
+    else:
+        FARs = np.array(FARs)
+        num_false_alarms = (num_neg * FARs).astype(np.int32)
+        thresholds = []
+        for num_false_alarm in num_false_alarms:
+            if num_false_alarm==0:
+                threshold = score_neg[0] + epsilon
+            else:
+                threshold = score_neg[num_false_alarm-1]
+            thresholds.append(threshold)
+        thresholds = np.array(thresholds)
+    return thresholds
+
+def ROC_loop(score_vec, label_vec, thresholds=None, FARs=None):
+    if thresholds is None:
+        thresholds = find_thresholds_by_FAR_loop(score_vec, label_vec, FARs=FARs)
+    TARs = np.zeros(thresholds.shape[0])
+    FARs = np.zeros(thresholds.shape[0])
+    false_accept_indices = []
+    false_reject_indices = []
+    for i,threshold in enumerate(thresholds):
+        accept = score_vec >= threshold
+        TARs[i] = np.mean(accept[label_vec])
+        FARs[i] = np.mean(accept[~label_vec])
+        false_accept_indices.append(np.argwhere(accept & (~label_vec)).flatten())
+        false_reject_indices.append(np.argwhere((~accept) & label_vec).flatten())
+    return TARs, FARs, thresholds, false_accept_indices, false_reject_indices
+
+def accuracy_loop(score_vec, label_vec, thresholds=None):
+    if thresholds is None:
+        score_pos = score_vec[label_vec==True]
+        thresholds = np.sort(score_pos)[::1]
+    accuracies = np.zeros(np.size(thresholds))
+    for i, threshold in enumerate(thresholds):
+        pred_vec = score_vec>=threshold
+        accuracies[i] = np.mean(pred_vec==label_vec)
+    argmax = np.argmax(accuracies)
+    accuracy = accuracies[argmax]
+    threshold = np.mean(thresholds[accuracies==accuracy])
+    return accuracy, threshold
+
+
+def random_scores(seed, size=500):
+    ''' Scores rounded to two decimals, so that there are many ties.'''
+    rng = np.random.RandomState(seed)
+    label_vec = rng.rand(size) < 0.3
+    label_vec[:2] = [True, False]
+    score_vec = np.round(rng.rand(size) + 0.5 * label_vec, 2)
+    return score_vec, label_vec
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_find_thresholds_by_FAR(seed):
+    score_vec, label_vec = random_scores(seed)
+    for FARs in [None, [0.0, 1e-3, 0.01, 0.1, 0.5, 1.0]]:
+        np.testing.assert_array_equal(evaluation.find_thresholds_by_FAR(score_vec, label_vec, FARs=FARs),
+            find_thresholds_by_FAR_loop(score_vec, label_vec, FARs=FARs))
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('mode', ['default', 'FARs', 'thresholds'])
+def test_ROC(seed, mode):
+    score_vec, label_vec = random_scores(seed)
+    kwargs = {}
+    if mode == 'FARs':
+        kwargs['FARs'] = [0.0, 1e-3, 0.01, 0.1, 0.5, 1.0]
+    elif mode == 'thresholds':
+        # Thresholds between and exactly on the scores
+        kwargs['thresholds'] = np.concatenate([np.linspace(-0.5, 2.0, 37), score_vec[:20]])
+    expected = ROC_loop(score_vec, label_vec, **kwargs)
+    result = evaluation.ROC(score_vec, label_vec, get_false_indices=True, **kwargs)
+    for name, value, reference in zip(['TARs', 'FARs', 'thresholds'], result[:3], expected[:3]):
+        np.testing.assert_allclose(value, reference, rtol=0, atol=1e-12, err_msg=name)
+    for indices, reference in zip(result[3], expected[3]):
+        np.testing.assert_array_equal(indices, reference)
+    for indices, reference in zip(result[4], expected[4]):
+        np.testing.assert_array_equal(indices, reference)
+
+@pytest.mark.parametrize('seed', range(20))
+def test_accuracy(seed):
+    score_vec, label_vec = random_scores(seed)
+    for thresholds in [None, np.linspace(-0.5, 2.0, 51)]:
+        accuracy, threshold = evaluation.accuracy(score_vec, label_vec, thresholds)
+        expected_accuracy, expected_threshold = accuracy_loop(score_vec, label_vec, thresholds)
+        assert accuracy == pytest.approx(expected_accuracy, abs=1e-12)
+        assert threshold == pytest.approx(expected_threshold, abs=1e-12)
+
+def test_roc_accumulator_out_of_range_scores():
+    accumulator = evaluation.ROCAccumulator(min_score=-1.0, max_score=1.0, num_bins=10)
+    scores = np.array([np.inf, 1e300, 1.0, 2.0, -np.inf, -1e300, -2.0, -1.0, 0.999, 0.0])
+    np.testing.assert_array_equal(accumulator.bin_indices(scores), [11, 11, 11, 11, 0, 0, 0, 1, 10, 6])
@@ -0,0 +1,41 @@
+"""Outputs of the optimized inference graph against the original graph
+"""
+import numpy as np
+import pytest
+
+
+def test_optimize_for_inference():
+    tf = pytest.importorskip('tensorflow')
+    slim = pytest.importorskip('tensorflow.contrib.slim')
+    from nntools.tensorflow import graph_ops
+    rng = np.random.RandomState(0)
+    graph = tf.Graph()
+    with graph.as_default():
+        images = tf.placeholder(tf.float32, [None, 8, 8, 3], name='images')
+        phase_train = tf.placeholder(tf.bool, name='phase_train')
+        net = slim.conv2d(images, 4, 3, normalizer_fn=slim.batch_norm,
+            normalizer_params={'is_training': phase_train, 'fused': True, 'scale': True})
+        net = tf.cond(phase_train, lambda: tf.nn.dropout(net, 0.5), lambda: net)
+        net = slim.conv2d(net, 2, 1, activation_fn=None, normalizer_fn=slim.batch_norm,
+            normalizer_params={'is_training': phase_train, 'fused': True})
+        output = tf.identity(tf.reduce_mean(net, [1, 2]), name='output')
+        with tf.Session(graph=graph) as sess:
+            sess.run(tf.global_variables_initializer())
+            # Moving statistics and weights different from their initial values
+            for var in tf.global_variables():
+                shape = var.shape.as_list()
+                value = rng.rand(*shape) + 0.5 if 'moving_variance' in var.op.name else rng.randn(*shape)
+                var.load(value.astype(np.float32), sess)
+            inputs = rng.randn(5, 8, 8, 3).astype(np.float32)
+            expected = sess.run(output, feed_dict={images: inputs, phase_train: False})
+            graph_def = graph_ops.optimize_for_inference(sess, ['output'], {'phase_train': False})
+
+    ops = set([node.op for node in graph_def.node])
+    # The conditionals are resolved and the batch normalizations folded
+    assert not ops.intersection(['Switch', 'Merge'] + graph_ops.batch_norm_ops)
+    optimized = tf.Graph()
+    with optimized.as_default():
+        tf.import_graph_def(graph_def, name='')
+        with tf.Session(graph=optimized) as sess:
+            result = sess.run('output:0', feed_dict={'images:0': inputs})
+    np.testing.assert_allclose(result, expected, rtol=1e-4, atol=1e-5)
@@ -0,0 +1,91 @@
+"""Compare triplet_avghard_loss against the previous B x B x B implementation
+"""
+import numpy as np
+import pytest
+
+batch_sizes = [2, 3, 8, 17]
+margins = [0.0, 0.2, 1.0, 5.0]
+
+
+def random_batch(seed, batch_size, num_features=4, num_classes=3):
+    rng = np.random.RandomState(seed)
+    labels = rng.randint(num_classes, size=batch_size).astype(np.int32)
+    # At least one positive pair, and one negative when batch_size > 2
+    labels[:3] = [0, 0, 1][:batch_size]
+    embeddings = rng.randn(batch_size, num_features).astype(np.float32)
+    return labels, embeddings
+
+
+# Numpy versions of the two algorithms, they run without tensorflow
+
+def avghard_loss_cube(labels, embeddings, margin):
+    ''' Average of the positive hinges over a B x B x B tensor of triplets.'''
+    dist_mat = np.square(embeddings[:,None] - embeddings[None]).sum(2)
+    label_mat = labels[:,None] == labels[None,:]
+    label_mask_pos = label_mat & ~np.eye(len(labels), dtype=bool)
+    loss = np.maximum(dist_mat[:,:,None] - dist_mat[:,None,:] + margin, 0)
+    mask = ~label_mat[:,None,:] & (loss > 0)
+    loss = (loss * mask).sum(2) / (mask.sum(2) + 1e-8)
+    return loss[label_mask_pos].mean()
+
+def avghard_loss_sorted(labels, embeddings, margin):
+    ''' Same loss from the sorted negative distances of each anchor.'''
+    dist_mat = np.square(embeddings[:,None] - embeddings[None]).sum(2)
+    label_mat = labels[:,None] == labels[None,:]
+    label_mask_pos = label_mat & ~np.eye(len(labels), dtype=bool)
+    fill_value = dist_mat.max() + margin + 1.
+    dist_neg = np.sort(np.where(label_mat, fill_value, dist_mat), axis=1)
+    cumsum_neg = np.pad(np.cumsum(dist_neg, axis=1), [[0,0],[1,0]])
+    threshold = dist_mat + margin
+    num_valid = np.stack([np.searchsorted(row, t, side='left') for row, t in zip(dist_neg, threshold)])
+    sum_neg = np.take_along_axis(cumsum_neg, num_valid, axis=1)
+    loss = (num_valid * threshold - sum_neg) / (num_valid + 1e-8)
+    return loss[label_mask_pos].mean()
+
+@pytest.mark.parametrize('batch_size', batch_sizes)
+@pytest.mark.parametrize('margin', margins)
+def test_sorted_algorithm(batch_size, margin):
+    for seed in range(10):
+        labels, embeddings = random_batch(seed, batch_size)
+        embeddings = embeddings.astype(np.float64)
+        assert avghard_loss_sorted(labels, embeddings, margin) == \
+            pytest.approx(avghard_loss_cube(labels, embeddings, margin), rel=1e-6, abs=1e-6)
+
+
+# The tensorflow implementation against the previous one
+
+def triplet_avghard_loss_cube(tf, tflosses, labels, embeddings, margin=1.):
+    ''' triplet_avghard_loss before it was computed from the sorted distances.'''
+    batch_size = tf.shape(embeddings)[0]
+    dist_mat = tflosses.euclidean_distance(embeddings, tf.transpose(embeddings), False)
+    diag_mask = tf.eye(batch_size, dtype=tf.bool)
+    non_diag_mask = tf.logical_not(diag_mask)
+    label_mat = tf.equal(labels[:,None], labels[None,:])
+    label_mask_pos = tf.logical_and(non_diag_mask, label_mat)
+    label_mask_neg = tf.logical_not(label_mat)
+    dist_tensor_neg = tf.tile(dist_mat, [1, batch_size])
+    dist_tensor_neg = tf.reshape(dist_tensor_neg, [batch_size, batch_size, batch_size])
+    label_tensor_neg= tf.tile(label_mask_neg, [1, batch_size])
+    label_tensor_neg = tf.reshape(label_tensor_neg, [batch_size, batch_size, batch_size])
+    loss = tf.nn.relu(dist_mat[:,:,None] - dist_tensor_neg + margin)
+    mask = tf.logical_and(label_tensor_neg, tf.greater(loss, 0.))
+    loss = tflosses.masked_reduce_mean(loss, mask, axis=2)
+    loss = tf.boolean_mask(loss, label_mask_pos)
+    return tf.reduce_mean(loss)
+
+@pytest.mark.parametrize('batch_size', batch_sizes)
+def test_triplet_avghard_loss(batch_size):
+    tf = pytest.importorskip('tensorflow')
+    from nntools.tensorflow import losses as tflosses
+    graph = tf.Graph()
+    with graph.as_default():
+        labels = tf.placeholder(tf.int32, [None])
+        embeddings = tf.placeholder(tf.float32, [None, 4])
+        outputs = [(tflosses.triplet_avghard_loss(labels, embeddings, margin=margin),
+            triplet_avghard_loss_cube(tf, tflosses, labels, embeddings, margin=margin)) for margin in margins]
+        with tf.Session(graph=graph) as sess:
+            for seed in range(5):
+                labels_value, embeddings_value = random_batch(seed, batch_size)
+                values = sess.run(outputs, feed_dict={labels: labels_value, embeddings: embeddings_value})
+                for loss, expected in values:
+                    assert loss == pytest.approx(expected, rel=1e-4, abs=1e-5)
@@ -31,24 +31,46 @@ import numpy as np
 from functools import partial
 from scipy.special import expit
 from sklearn.metrics import roc_curve, auc
-import matplotlib
-matplotlib.use('agg')
-import matplotlib.pyplot as plt
 from scipy.spatial.distance import cdist
 import random
 import utils
 # import visualize
-import facepy
-from tensorflow.contrib.tensorboard.plugins import projector
 from nntools.common.dataset import Dataset
 from nntools.common.imageprocessing import preprocess, random_crop, patch_loc, random_flip
 from nntools.tensorflow.networks import JointCNN
-from facepy.metric import *
 import evaluation
-import seaborn as sns
-import scipy.misc
 
-from MulticoreTSNE import MulticoreTSNE as TSNE
+def pyplot():
+    ''' matplotlib is only imported when the first figure is saved.'''
+    import matplotlib
+    matplotlib.use('agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+def plot_tsne(embeddings, labels, names, filename):
+    ''' Scatter plot of the t-SNE of the embeddings of each class.'''
+    import seaborn as sns
+    from MulticoreTSNE import MulticoreTSNE as TSNE
+    plt = pyplot()
+    embeddings = TSNE(n_jobs=18, verbose=True).fit_transform(embeddings)
+    sns.set_context('paper')
+    for mat, name in enumerate(names):
+        idx = np.where(labels == mat)[0]
+        sns.scatterplot(embeddings[idx, 0], embeddings[idx, 1], label=name, alpha=0.3)
+    plt.savefig(filename)
+    plt.clf()
+
+def plot_score_histogram(live_scores, spoof_scores, filename):
+    plt = pyplot()
+    bins = np.linspace(0, 1, 100)
+    plt.hist(np.array(spoof_scores), bins, alpha=.7, color='red', label='spoofs', density=True)
+    plt.hist(np.array(live_scores), bins, alpha=.7, color='green', label='lives', density=True)
+    plt.xlabel('Spoofness Score')
+    plt.ylabel('Normalized Score Frequency')
+    plt.legend(loc="upper right")
+    plt.title('Spoof Detection Histogram')
+    plt.savefig(filename)
+    plt.clf()
 
 def test(network, config, original_images, log_dir, step):
     output_dir = os.path.join(log_dir, 'samples')
@@ -113,8 +135,6 @@ def main(args):
         % (config.num_epochs, config.epoch_size, config.batch_size))
     global_step = 0
     start_time = time.time()
-    tsne = TSNE(n_jobs=18, verbose=True)
-    sns.set_context('paper')
     MAT_NAMES = ['real', 'AdvFaces', 'GFLM', 'DeepFool', 'Semantic']
     for epoch in range(config.num_epochs):
 
@@ -132,36 +152,25 @@ def main(args):
                 test_features, embeddings = network.extract_feature(test_images,
                     verbose=True, embeddings=True,
                     batch_size=64,)
-                embeddings = tsne.fit_transform(embeddings)
                 test_scores = expit(test_features)
                 test_live_scores = test_scores[testset_labels == 0].tolist()
                 test_spoof_scores = test_scores[testset_labels != 0].tolist()
 
-                for mat in range(len(np.unique(testset.labels))):
-                    idx = np.where(testset.labels[random_test_idx] == mat)[0]
-                    sns.scatterplot(embeddings[idx, 0], embeddings[idx, 1], label=MAT_NAMES[mat], alpha=0.3)
-                plt.savefig("{}/test/tsne_{}.png".format(log_dir, global_step))
-                plt.clf()
+                plot_tsne(embeddings, testset_labels, MAT_NAMES[:len(np.unique(testset.labels))],
+                    "{}/test/tsne_{}.png".format(log_dir, global_step))
 
-                test_eer, test_eer_th, tdr = evaluation.eer(test_live_scores, test_spoof_scores)
-                print('EER = {}%, TDR = {}%'.format(test_eer * 100, tdr * 100))
+                result = evaluation.evaluate(test_scores, testset_labels)
+                print('EER = {}%, TDR = {}%'.format(result['eer'] * 100, result['tdr'][0.002] * 100))
+                # The weights tested here are the ones saved at the end of the last epoch
+                network.update_checkpoint_metric(global_step, result['eer'])
                 
                 eers = []
-                for mat in range(1, len(np.unique(testset.labels))):
-                    spoof = test_scores[testset_labels == mat].tolist()
-                    eer, _, tdr_mat = evaluation.eer(test_live_scores, spoof)
-                    print('{}: EER = {}%, TDR = {}%'.format(testset.images[testset.labels == mat][0].split('/')[-3], eer * 100, tdr_mat * 100))
-                    eers.append(eer * 100)
-
-                bins = np.linspace(0, 1, 100)
-                plt.hist(np.array(test_spoof_scores), bins, alpha=.7, color='red', label='spoofs', density=True)
-                plt.hist(np.array(test_live_scores), bins, alpha=.7, color='green', label='lives', density=True)
-                plt.xlabel('Spoofness Score')
-                plt.ylabel('Normalized Score Frequency')
-                plt.legend(loc="upper right")
-                plt.title('Spoof Detection Histogram')
-                plt.savefig("{}/test/scores_{}.png".format(log_dir, global_step))
-                plt.clf()
+                for mat, attack in result['attacks'].items():
+                    print('{}: EER = {}%, TDR = {}%'.format(testset.images[testset.labels == mat][0].split('/')[-3], attack['eer'] * 100, attack['tdr'][0.002] * 100))
+                    eers.append(attack['eer'] * 100)
+
+                plot_score_histogram(test_live_scores, test_spoof_scores,
+                    "{}/test/scores_{}.png".format(log_dir, global_step))
 
         # Training
         for step in range(config.epoch_size):
@@ -184,6 +193,11 @@ def main(args):
                 summary_writer.add_summary(sm, global_step=global_step)
 
         network.save_model(log_dir, global_step)
+
+    if network.checkpoint_writer is not None:
+        network.checkpoint_writer.close()
+        print('Checkpoints: snapshot {snapshot_mean:.3f}s (max {snapshot_max:.3f}s), '
+              'write {write_mean:.3f}s (max {write_max:.3f}s)'.format(**network.checkpoint_writer.stats()))
             
 if __name__=="__main__":
     parser = argparse.ArgumentParser()
@@ -31,24 +31,14 @@ import numpy as np
 from functools import partial
 from scipy.special import expit
 from sklearn.metrics import roc_curve, auc
-import matplotlib
-matplotlib.use('agg')
-import matplotlib.pyplot as plt
 from scipy.spatial.distance import cdist
 import random
 import utils
 # import visualize
-import facepy
-from tensorflow.contrib.tensorboard.plugins import projector
 from nntools.common.dataset import Dataset
 from nntools.common.imageprocessing import preprocess, random_crop, patch_loc, random_flip
 from nntools.tensorflow.networks import ChimneyCNN
-from facepy.metric import *
 import evaluation
-import seaborn as sns
-import scipy.misc
-
-from MulticoreTSNE import MulticoreTSNE as TSNE
 
 def test(network, config, original_images, log_dir, step):
     output_dir = os.path.join(log_dir, 'samples')
@@ -113,8 +103,6 @@ def main(args):
         % (config.num_epochs, config.epoch_size, config.batch_size))
     global_step = 0
     start_time = time.time()
-    tsne = TSNE(n_jobs=18, verbose=True)
-    sns.set_context('paper')
     MAT_NAMES = ['real', 'AdvFaces', 'GFLM', 'DeepFool', 'Semantic']
     for epoch in range(config.num_epochs):
 
@@ -184,6 +172,11 @@ def main(args):
                 summary_writer.add_summary(sm, global_step=global_step)
 
         network.save_model(log_dir, global_step)
+
+    if network.checkpoint_writer is not None:
+        network.checkpoint_writer.close()
+        print('Checkpoints: snapshot {snapshot_mean:.3f}s (max {snapshot_max:.3f}s), '
+              'write {write_mean:.3f}s (max {write_max:.3f}s)'.format(**network.checkpoint_writer.stats()))
             
 if __name__=="__main__":
     parser = argparse.ArgumentParser()
@@ -0,0 +1,52 @@
+"""Worker process for data-parallel training over a cluster of processes
+"""
+# MIT License
+# 
+# Copyright (c) 2022 Debayan Deb
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import argparse
+import utils
+from nntools.tensorflow import utils as tfutils
+
+def main(args):
+    cluster = args.cluster.split(',') if args.cluster else None
+    if cluster is None:
+        config = utils.import_file(args.config_file, 'config')
+        cluster = config.cluster
+    assert cluster and 0 < args.task_index < len(cluster), \
+        'The task index must be one of the workers 1..%d of the cluster' % (len(cluster or [None]) - 1)
+    server = tfutils.start_server(cluster, args.task_index, args.num_threads)
+    print('Worker %d of %d listening on %s' % (args.task_index, len(cluster), cluster[args.task_index]))
+    server.join()
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config_file", help="The training configuration file with the cluster addresses",
+                        type=str, default=None, nargs='?')
+    parser.add_argument("--task_index", help="Index of this worker in the cluster (the trainer is 0)",
+                        type=int, required=True)
+    parser.add_argument("--cluster", help="Comma separated host:port addresses, overrides the config",
+                        type=str, default=None)
+    parser.add_argument("--num_threads", help="Size of the thread pools of the worker (0 for all the cores)",
+                        type=int, default=0)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,101 @@
+"""Cache the shared trunk features of ChimneyCNN and score branch variants from the cache
+"""
+# MIT License
+# 
+# Copyright (c) 2022 Debayan Deb
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import time
+import argparse
+import numpy as np
+import utils
+import evaluation
+from nntools.common.dataset import Dataset
+from nntools.common.imageprocessing import preprocess
+from nntools.tensorflow.networks import ChimneyCNN
+
+def extract(args):
+    config = utils.import_file(os.path.join(args.model_path, 'config.py'), 'config')
+    network = ChimneyCNN()
+    network.load_model(args.model_path)
+    dataset = Dataset(args.dataset_path)
+    proc_func = lambda images: preprocess(images, config, False)
+    start_time = time.time()
+    trunk = network.extract_trunk(dataset.images, args.cache_file, batch_size=args.batch_size,
+        proc_func=proc_func, verbose=True)
+    print('\nTrunk features of shape %s saved to %s in %.1f seconds' % (str(trunk.shape), 
+        args.cache_file, time.time() - start_time))
+
+def score(args):
+    dataset = Dataset(args.dataset_path)
+    labels = np.array(dataset.labels)
+    trunk = np.load(args.cache_file, mmap_mode='r')
+    assert trunk.shape[0] == len(labels), 'The cache does not match the dataset'
+    for model_path in args.model_paths:
+        network = ChimneyCNN()
+        network.load_model(model_path)
+        if args.check > 0:
+            # The cache is only valid for models with the same Common layers
+            config = utils.import_file(os.path.join(model_path, 'config.py'), 'config')
+            images = preprocess(dataset.images[:args.check], config, False)
+            new_trunk = network.sess.run(network.heads['trunk'], feed_dict=network.feed_dict(images))
+            diff = np.abs(new_trunk - trunk[:args.check].astype(np.float32)).max()
+            if diff > 1e-2 * max(1.0, np.abs(new_trunk).max()):
+                print('%s: skipped, the trunk differs from the cache (%.2e)' % (model_path, diff))
+                continue
+        start_time = time.time()
+        heads = [head for head in network.score_heads if head in network.head_outputs]
+        scores = network.predict_from_trunk(trunk, heads, batch_size=args.batch_size)
+        print('%s (%.1f seconds)' % (model_path, time.time() - start_time))
+        for head in heads:
+            head_scores = scores[head][:,0]
+            eer, _, tdr = evaluation.eer(head_scores[labels == 0].tolist(), head_scores[labels != 0].tolist())
+            print('    {}: EER = {}%, TDR = {}%'.format(head, eer * 100, tdr * 100))
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    parser_extract = subparsers.add_parser('extract', help='Save the trunk features of a dataset')
+    parser_extract.add_argument("model_path", help="The path to the saved checkpoint and model file",
+                        type=str)
+    parser_extract.add_argument("dataset_path", help="The dataset directory or list file",
+                        type=str)
+    parser_extract.add_argument("cache_file", help="The .npy file of the float16 trunk features",
+                        type=str)
+    parser_extract.add_argument("--batch_size", help="Batch size for feature extraction",
+                        type=int, default=128)
+    parser_score = subparsers.add_parser('score', help='Evaluate the heads of models from cached trunk features')
+    parser_score.add_argument("cache_file", help="The .npy file written by extract",
+                        type=str)
+    parser_score.add_argument("dataset_path", help="The dataset used for extract, for the labels",
+                        type=str)
+    parser_score.add_argument("model_paths", help="The models to evaluate",
+                        type=str, nargs='+')
+    parser_score.add_argument("--check", help="Number of images used to check that a model has the cached trunk",
+                        type=int, default=8)
+    parser_score.add_argument("--batch_size", help="Batch size for scoring",
+                        type=int, default=512)
+    args = parser.parse_args()
+    if args.command == 'extract':
+        extract(args)
+    else:
+        score(args)
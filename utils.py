@@ -25,22 +25,16 @@
 import sys
 import os
 import numpy as np
-from scipy import misc
 import imp
 import time
 import math
 import random
 from datetime import datetime
 import shutil
-import facepy
-from nntools.common.dataset_original import Dataset
 from nntools.common.imageprocessing import *
-import tensorflow as tf
-from tensorflow.python.ops import control_flow_ops
-import matplotlib.pyplot as plt
-import skimage
-import skimage.io
-import skimage.transform
+
+# tensorflow, matplotlib, skimage, cv2 and facepy are imported by the functions
+# that use them, the scripts only importing import_file start quickly
 
 
 def apply_with_random_selector(x, func, num_cases):
@@ -55,6 +49,8 @@ def apply_with_random_selector(x, func, num_cases):
     The result of func(x, sel), where func receives the value of the
     selector as a python integer, but sel is sampled dynamically.
   """
+  import tensorflow as tf
+  from tensorflow.python.ops import control_flow_ops
   sel = tf.random_uniform([], maxval=num_cases, dtype=tf.int32)
   # Pass the real x only to one of the func calls.
   return control_flow_ops.merge([
@@ -79,6 +75,7 @@ def distort_color(image, color_ordering=0, fast_mode=True, scope=None):
   Raises:
     ValueError: if color_ordering not in [0, 3]
   """
+  import tensorflow as tf
   with tf.name_scope(scope, 'distort_color', [image]):
     if fast_mode:
       if color_ordering == 0:
@@ -145,6 +142,7 @@ def distorted_bounding_box_crop(image,
   Returns:
     A tuple, a 3-D Tensor cropped_image and the distorted bbox
   """
+  import tensorflow as tf
   with tf.name_scope(scope, 'distorted_bounding_box_crop', [image, bbox]):
     # Each bounding box has shape [1, num_boxes, box coords] and
     # the coordinates are ordered [ymin, xmin, ymax, xmax].
@@ -174,6 +172,7 @@ def distorted_bounding_box_crop(image,
 
 class TFPreprocess:
     def __init__(self, size):
+        import tensorflow as tf
         self.graph = tf.Graph()
         tf_config = tf.ConfigProto(device_count={'GPU': 0})
         self.sess = tf.Session(graph=self.graph, config=tf_config)
@@ -211,6 +210,7 @@ class TFPreprocess:
 
 
 def save_manifold(images, path, manifold_size=None, normalize=True):
+    from scipy import misc
     if normalize:
         images = (images+1.) / 2
     if manifold_size is None:
@@ -240,6 +240,9 @@ def merge(images, size):
 
 
 def visualize_gradcam(figname, image, conv_output, conv_grad, gb_viz):
+    import cv2
+    import skimage.transform
+    import matplotlib.pyplot as plt
     output = conv_output           # [7,7,512]
     grads_val = conv_grad          # [7,7,512]
     # print("grads_val shape:", grads_val.shape)
@@ -308,6 +311,17 @@ def import_file(full_path_to_module, name='module.name'):
     
     return module_obj
 
+def load_network_config(model_path, network_type=None):
+    ''' Read the config.py of a model directory and return it with the network class
+    of the detector. network_type ('chimney' or 'joint') is inferred from config.network
+    by default.'''
+    from nntools.tensorflow.networks import JointCNN, ChimneyCNN
+    config = import_file(os.path.join(model_path, 'config.py'), 'config')
+    if network_type is None:
+        network_type = 'chimney' if 'chimney' in config.network else 'joint'
+    Network = ChimneyCNN if network_type == 'chimney' else JointCNN
+    return config, Network
+
 def create_log_dir(config, config_file):
     subdir = datetime.strftime(datetime.now(), '%Y%m%d-%H%M%S')
     log_dir = os.path.join(os.path.expanduser(config.log_base_dir), config.name, subdir)
@@ -361,13 +375,43 @@ def fuse_features(mu1, sigma_sq1, mu2, sigma_sq2):
     mu_new = (sigma_sq2 * mu1 + sigma_sq1 * mu2) / (sigma_sq1 + sigma_sq2)
     return mu_new, sigma_new
 
-def match_features(mu1, sigma_sq1, mu2, sigma_sq2):
-    t1 = list(zip(mu1, sigma_sq1))
-    t2 = list(zip(mu2, sigma_sq2))
-    def metric(t1, t2):
-        mu1, sigma_sq1 = tuple(t1)
-        mu2, sigma_sq2 = tuple(t2)
-        sigma_sq_sum = sigma_sq1 + sigma_sq2
-        score = - np.sum(np.square(mu1 - mu2) / sigma_sq_sum) - np.sum(np.log(sigma_sq_sum))
-        return score
-    return facepy.protocol.compare_sets(t1, t2, metric)
+def match_features(mu1, sigma_sq1, mu2, sigma_sq2, block_elements=2**22, output_file=None):
+    ''' Mutual likelihood scores of every row of (mu1, sigma_sq1) against every row of
+    (mu2, sigma_sq2): - sum((mu1-mu2)^2 / (sigma_sq1+sigma_sq2)) - sum(log(sigma_sq1+sigma_sq2)).
+    The scores are computed in float32 tiles of at most block_elements values, and
+    with matrix products if the variance of every template is the same in all
+    dimensions. The result can be written into a memory-mapped .npy file.'''
+    from facepy import metric, protocol
+    mu1, sigma_sq1 = np.asarray(mu1, np.float32), np.asarray(sigma_sq1, np.float32)
+    mu2, sigma_sq2 = np.asarray(mu2, np.float32), np.asarray(sigma_sq2, np.float32)
+    if sigma_sq1.ndim == 1:
+        sigma_sq1 = sigma_sq1[:,None]
+    if sigma_sq2.ndim == 1:
+        sigma_sq2 = sigma_sq2[:,None]
+    m, n, d = mu1.shape[0], mu2.shape[0], mu1.shape[1]
+    scores = protocol.output_array((m,n), output_file)
+
+    isotropic = np.all(sigma_sq1 == sigma_sq1[:,:1]) and np.all(sigma_sq2 == sigma_sq2[:,:1])
+    if isotropic:
+        # The variance sum is a scalar for each pair:
+        # - |mu1-mu2|^2 / (s1+s2) - d * log(s1+s2)
+        block_size = max(1, int(np.sqrt(block_elements)))
+        for i in range(0, m, block_size):
+            for j in range(0, n, block_size):
+                sigma_sq_sum = sigma_sq1[i:i+block_size,:1] + sigma_sq2[j:j+block_size,:1].T
+                dist = metric.euclidean(mu1[i:i+block_size], mu2[j:j+block_size])
+                scores[i:i+block_size, j:j+block_size] = - np.maximum(dist, 0) / sigma_sq_sum - d * np.log(sigma_sq_sum)
+    else:
+        # Tiles of rows1 x rows2 x d values
+        block_size1 = max(1, min(m, int(np.sqrt(block_elements / d))))
+        block_size2 = max(1, int(block_elements / d / block_size1))
+        for i in range(0, m, block_size1):
+            mu_block, sigma_block = mu1[i:i+block_size1,None], sigma_sq1[i:i+block_size1,None]
+            for j in range(0, n, block_size2):
+                sigma_sq_sum = sigma_block + sigma_sq2[None,j:j+block_size2]
+                scores[i:i+block_size1, j:j+block_size2] = \
+                    - np.sum(np.square(mu_block - mu2[None,j:j+block_size2]) / sigma_sq_sum, axis=2) \
+                    - np.sum(np.log(sigma_sq_sum), axis=2)
+    if output_file is not None:
+        scores.flush()
+    return scores